@@ -0,0 +1,94 @@
+"""
+Compute core for blocked_review.py. Creates obstruction review segments from cross section vertices
+and RAS blocked obstructions without arcpy.
+"""
+import os
+import sys
+path = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, path)
+import review_core
+import skew_offset
+import station_index
+
+
+class CrossSectionLengthError(Exception):
+    pass
+
+
+# The following 3 functions may be overridden for use with arcpy, etc.
+def message(x):
+    print(x)
+
+
+def warn(x):
+    print(x)
+
+
+def error(x):
+    print(x)
+
+
+def blocked_changes(geo_xs):
+    """
+    Converts blocked values to list more friendly to the legacy (n-value) code
+    :param geo_xs: rasgeo.CrossSection object
+    :return: list of tuples [(station, blocked elevation, 999), ...], stations are not corrected
+    """
+    start = geo_xs.sta_elev.points[0][0]
+    orig_blocked = geo_xs.obstruct.blocked
+    message(str(geo_xs.header.xs_id) + str(orig_blocked))
+
+    blocked_values = []
+    if geo_xs.obstruct.blocked_type == -1:  # blocked obstruction
+        intervals = station_index.blocked_intervals(orig_blocked)
+        # No obstruction ahead of the first area, unless it starts at the first station
+        if not intervals or intervals[0][0] > start:
+            blocked_values.append((start, 0, 999))
+
+        for area_start, area_end, elev in intervals:
+            blocked_values.append((area_start, elev, 999))
+            blocked_values.append((area_end, 0, 999))
+    else:  # normal obstruction
+        blocked_values.append((start, 0, 999))
+        left_blocked = orig_blocked[0]
+        right_blocked = orig_blocked[1]
+        # See if left blocked is valid
+        if left_blocked[1] != '':
+            if left_blocked[2] == '':
+                elev = 99999
+            else:
+                elev = left_blocked[2]
+            blocked_values.append((start, elev, 999))
+            blocked_values.append((left_blocked[1], 0, 999))
+        # See if right blocked is valid
+        if right_blocked[0] != '':
+            if right_blocked[2] == '':
+                elev = 99999
+            else:
+                elev = right_blocked[2]
+            blocked_values.append((right_blocked[0], elev, 999))
+            blocked_values.append((geo_xs.sta_elev.points[-1][0], 0, 999))
+    return blocked_values
+
+
+def create_blocked_segments(xs_coords, geo_xs):
+    """
+    Creates segments representing portions of a cross section with consistent obstruction
+    :param xs_coords: (n, 2) array of cross section vertices
+    :param geo_xs: rasgeo.CrossSection object
+    :return: a list of tuples [((k, 2) array of vertices, blocked elevation (float)), ... ]
+    """
+    blocked_values = blocked_changes(geo_xs)
+
+    # verify n-values aren't longer than cross section
+    if blocked_values[-1][1] > review_core.line_length(xs_coords):
+            raise CrossSectionLengthError
+
+    # Correct cross section offset and skew
+    stations = skew_offset.correct_xs_stations([sta for sta, _, _ in blocked_values], geo_xs)
+    blocked_values = [(sta, b, c) for sta, (_, b, c) in zip(stations.tolist(), blocked_values)]
+
+    # Station 0 obstruction is placed on the first vertex to avoid possible rounding errors
+    stations = [0] + [sta for sta, _, _ in blocked_values[1:]]
+    values = [blocked for _, blocked, _ in blocked_values]
+    return review_core.split_line(xs_coords, stations, values)
@@ -0,0 +1,113 @@
+"""
+Compute core for iefa_review.py. Creates IEFA review segments from cross section vertices and RAS
+ineffective flow areas without arcpy.
+"""
+import os
+import sys
+path = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, path)
+import review_core
+import skew_offset
+import station_index
+
+
+class CrossSectionLengthError(Exception):
+    pass
+
+
+# The following 3 functions may be overridden for use with arcpy, etc.
+def message(x):
+    print(x)
+
+
+def warn(x):
+    print(x)
+
+
+def error(x):
+    print(x)
+
+
+def iefa_changes(geo_xs):
+    """
+    Converts iefa values to list more friendly to the legacy (n-value) code
+    :param geo_xs: rasgeo.CrossSection object
+    :return: list of tuples [(station, iefa elevation, 999), ...], stations are not corrected
+    """
+    start = geo_xs.sta_elev.points[0][0]
+    orig_iefa = geo_xs.iefa.iefa_list
+
+    iefa_values = []
+    if geo_xs.iefa.type == -1:  # blocked iefa
+        intervals = station_index.blocked_intervals(orig_iefa)
+        # No ineffective flow ahead of the first area, unless it starts at the first station
+        if not intervals or intervals[0][0] > start:
+            iefa_values.append((start, 0, 999))
+
+        for area_start, area_end, elev in intervals:
+            iefa_values.append((area_start, elev, 999))
+            iefa_values.append((area_end, 0, 999))
+    else:  # normal iefa
+        iefa_values.append((start, 0, 999))
+        left_iefa = orig_iefa[0]
+        right_iefa = orig_iefa[1]
+        # See if left IEFA is valid
+        if left_iefa[1] != '':
+            if left_iefa[2] == '':
+                elev = 99999
+            else:
+                elev = left_iefa[2]
+            iefa_values.append((start, elev, 999))
+            iefa_values.append((left_iefa[1], 0, 999))
+        # See if right IEFA is valid
+        if right_iefa[0] != '':
+            if right_iefa[2] == '':
+                elev = 99999
+            else:
+                elev = right_iefa[2]
+            iefa_values.append((right_iefa[0], elev, 999))
+            iefa_values.append((geo_xs.sta_elev.points[-1][0], 0, 999))
+    return iefa_values
+
+
+def create_iefa_segments(xs_coords, geo_xs):
+    """
+    Creates segments representing portions of a cross section with consistent IEFA
+    Stations are corrected for offset and skew with skew_offset
+    :param xs_coords: (n, 2) array of cross section vertices
+    :param geo_xs: rasgeo.CrossSection object
+    :return: a list of tuples [((k, 2) array of vertices, iefa elevation (float)), ... ]
+    """
+    iefa_values = iefa_changes(geo_xs)
+    length = review_core.line_length(xs_coords)
+
+    # verify n-values aren't longer than cross section
+    if iefa_values[-1][1] > length:
+        raise CrossSectionLengthError
+
+    # Correct cross section offset and skew
+    stations = skew_offset.correct_xs_stations([sta for sta, _, _ in iefa_values], geo_xs)
+    iefa_values = [(sta, b, c) for sta, (_, b, c) in zip(stations.tolist(), iefa_values)]
+
+    # Station 0 iefa is placed on the first vertex to avoid possible rounding errors
+    first_iefa = iefa_values.pop(0)
+    stations = [0]
+    values = [first_iefa[1]]
+
+    for station, iefa, _ in iefa_values:
+        # Look out for IEFA changes that exceed length of the cut line
+        if station > length:
+            if station - length > 0.1:  # small errors are caused by rounding
+                warn('At XS {}, IEFA station {},'.format(geo_xs.header.xs_id, station) + \
+                     ' exceeds length of GIS cutline ({})'.format(length) + \
+                     '. Changing station to match end of line.')
+            station = length
+        # positionAlongLine doesn't like negative stations
+        if station < 0:
+            warn('At XS {}, IEFA station {},'.format(geo_xs.header.xs_id, station) + \
+                 ' is being reset to zero.')
+            station = 0
+        stations.append(station)
+        values.append(iefa)
+
+    return review_core.split_line(xs_coords, stations, values)
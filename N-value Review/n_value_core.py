@@ -0,0 +1,70 @@
+"""
+Compute core for n_value_review.py. Creates n-value review segments from cross section vertices and
+RAS Manning's n values without arcpy.
+"""
+import os
+import sys
+path = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, path)
+import review_core
+import skew_offset
+
+
+class CrossSectionLengthError(Exception):
+    pass
+
+
+# The following 3 functions may be overridden for use with arcpy, etc.
+def message(x):
+    print(x)
+
+
+def warn(x):
+    print(x)
+
+
+def error(x):
+    print(x)
+
+
+def correct_skew(geo_xs):
+    """
+    Corrects Mannings n value stations for offset and skew with skew_offset, the first n-value station
+    is the cross section offset
+    :param geo_xs: rasgeo.CrossSection object
+    :return: list of n-values in rasgeo format
+    """
+    n_values = geo_xs.mannings_n.values
+    stations = skew_offset.correct_xs_stations([sta for sta, _, _ in n_values], geo_xs, n_values[0][0])
+    return [(sta, b, c) for sta, (_, b, c) in zip(stations.tolist(), n_values)]
+
+
+def create_n_value_segments(xs_coords, orig_n_values, xs_id):
+    """
+    Creates segments representing portions of a cross section with a consistent manning's n
+    :param xs_coords: (n, 2) array of cross section vertices
+    :param orig_n_values: list of tuples from rasgeotools CrossSection.mannings_n
+    :param xs_id: id of the current cross section, only used for reporting
+    :return: a list of tuples [((k, 2) array of vertices, n-value (float)), ... ]
+    """
+    n_values = list(orig_n_values)
+    length = review_core.line_length(xs_coords)
+
+    # Correct offset if first station is not 0
+    if n_values[0][0] != 0:
+        offset = n_values[0][0]
+        n_values = [(sta-offset, b, c) for sta, b, c in n_values]
+
+    # verify n-values aren't longer than cross section
+    if n_values[-1][0] >= length:
+        # Check if it's the last station on the cross section
+        if abs(n_values[-1][0] - length) < 1:
+            n_values.pop(-1)
+            warn('Cross section ' + str(xs_id) + ' appears to have n-value change at last station. Ignoring.')
+        else:
+            raise CrossSectionLengthError
+
+    # Station 0 n-value is placed on the first vertex to avoid possible rounding errors
+    stations = [0] + [sta for sta, _, _ in n_values[1:]]
+    values = [n_value for _, n_value, _ in n_values]
+    return review_core.split_line(xs_coords, stations, values)
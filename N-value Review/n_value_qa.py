@@ -0,0 +1,256 @@
+"""
+Model wide Manning's n QA. All n-value tables in a HEC-RAS geometry file are flattened into columnar
+arrays (cross section, station, n) and each rule is evaluated for the whole model in one vectorized
+pass. Rules:
+
+    duplicate       two n-values at the same station of a cross section
+    redundant       n-value doesn't change from the previous station
+    range           n-value outside N_RANGE
+    channel         channel n-value is greater than the lowest overbank n-value
+    jump            channel n-value changes by more than MAX_JUMP (ratio) from the previous cross
+                    section of the same reach
+
+Findings are returned as a list of Finding and can be written to a csv with write_findings().
+"""
+import collections
+import csv
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gisio
+import rasgeo
+
+DUPLICATE = 'duplicate'
+REDUNDANT = 'redundant'
+RANGE = 'range'
+CHANNEL = 'channel'
+JUMP = 'jump'
+RULES = (DUPLICATE, REDUNDANT, RANGE, CHANNEL, JUMP)
+
+N_RANGE = (0.01, 0.25)
+MAX_JUMP = 0.5
+
+Finding = collections.namedtuple('Finding', ['river', 'reach', 'xs_id', 'station', 'rule', 'value', 'detail'])
+
+
+class NValueTable(object):
+    """
+    Manning's n values of all cross sections in columnar form. Values of cross section i are
+    stations[offsets[i]:offsets[i + 1]] and n[offsets[i]:offsets[i + 1]].
+
+    rivers, reaches, xs_ids, left_banks, right_banks - one value per cross section, banks are nan if missing
+    xs - index of the cross section of each n-value
+    """
+    def __init__(self, rivers, reaches, xs_ids, left_banks, right_banks, offsets, stations, n):
+        self.rivers = rivers
+        self.reaches = reaches
+        self.xs_ids = xs_ids
+        self.left_banks = left_banks
+        self.right_banks = right_banks
+        self.offsets = offsets
+        self.stations = stations
+        self.n = n
+        self.xs = np.repeat(np.arange(len(xs_ids)), np.diff(offsets))
+
+    def __len__(self):
+        return len(self.xs_ids)
+
+    @classmethod
+    def from_cross_sections(cls, cross_sections):
+        """ Builds table from rasgeo.CrossSection objects with mannings_n and bank_sta blocks """
+        rivers, reaches, xs_ids, banks, counts, values = [], [], [], [], [], []
+        for geo_xs in cross_sections:
+            rivers.append(geo_xs.header.river)
+            reaches.append(geo_xs.header.reach)
+            xs_ids.append(geo_xs.header.xs_id)
+            banks.append(geo_xs.bank_sta if geo_xs.bank_sta else (np.nan, np.nan))
+            n_values = geo_xs.mannings_n.values if geo_xs.mannings_n is not None else []
+            counts.append(len(n_values))
+            values.extend(value[:2] for value in n_values)
+        values = np.array(values, dtype=float).reshape(-1, 2)
+        banks = np.array(banks, dtype=float).reshape(-1, 2)
+        offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64)
+        return cls(np.array(rivers, dtype=object), np.array(reaches, dtype=object), np.array(xs_ids, dtype=float),
+                   banks[:, 0], banks[:, 1], offsets, values[:, 0], values[:, 1])
+
+
+def read_table(geofile, wanted=None):
+    """
+    Returns NValueTable of every cross section in geofile, only n-values and bank stations are parsed
+    :param wanted: optional function(river, reach, xs_id) returning False for cross sections to skip
+    """
+    cross_sections = rasgeo.iter_cross_sections(geofile, blocks=(rasgeo.MANNINGS_N, rasgeo.BANK_STA), wanted=wanted)
+    return NValueTable.from_cross_sections(cross_sections)
+
+
+# ------------------------------------- Rules -------------------------------------
+def _same_xs_as_previous(table):
+    """ Returns bool array, True where n-value i belongs to the same cross section as n-value i - 1 """
+    same = np.zeros(len(table.n), dtype=bool)
+    same[1:] = table.xs[1:] == table.xs[:-1]
+    return same
+
+
+def duplicate_rule(table):
+    """ Returns indexes of n-values at the same station as the previous n-value """
+    same = _same_xs_as_previous(table)
+    same[1:] &= table.stations[1:] == table.stations[:-1]
+    return np.flatnonzero(same)
+
+
+def redundant_rule(table):
+    """ Returns indexes of n-values equal to the previous n-value """
+    same = _same_xs_as_previous(table)
+    same[1:] &= table.n[1:] == table.n[:-1]
+    return np.flatnonzero(same)
+
+
+def range_rule(table, n_range=N_RANGE):
+    """ Returns indexes of n-values outside n_range """
+    return np.flatnonzero((table.n < n_range[0]) | (table.n > n_range[1]))
+
+
+def _segment_index(table, xs, stations, side):
+    """
+    Returns index of the n-value in effect at stations[k] of cross section xs[k], the last n-value
+    with station <= stations[k] (side='right') or < stations[k] (side='left'). -1 if before the first.
+    """
+    # Sort n-values and queries together by cross section and station, ties put queries after
+    # n-values for side='right'
+    num_n = len(table.n)
+    all_xs = np.concatenate([table.xs, xs])
+    all_sta = np.concatenate([table.stations, stations])
+    is_query = np.concatenate([np.zeros(num_n, dtype=bool), np.ones(len(xs), dtype=bool)])
+    tie = is_query if side == 'right' else ~is_query
+    order = np.lexsort((tie, all_sta, all_xs))
+    # Number of n-values sorted before each query
+    n_before = np.cumsum(~is_query[order])[is_query[order]]
+    index = np.empty(len(xs), dtype=np.int64)
+    index[order[is_query[order]] - num_n] = n_before - 1
+    return np.where(index >= table.offsets[xs], index, -1)
+
+
+def _reduce_ranges(func, values, starts, ends, empty=np.nan):
+    """ Returns func.reduce(values[starts[k]:ends[k]]) for each k, empty for empty ranges """
+    result = np.full(len(starts), empty)
+    full = ends > starts
+    if full.any():
+        # reduceat over interleaved starts and ends, every other result is a requested range
+        padded = np.append(values, empty)
+        bounds = np.column_stack([starts[full], ends[full]]).ravel()
+        result[full] = func.reduceat(padded, bounds)[::2]
+    return result
+
+
+def channel_n_values(table):
+    """
+    Returns (channel n, lowest overbank n) arrays, one value per cross section. Channel n is the highest
+    n-value between the bank stations, nan where bank stations are missing.
+    """
+    xs = np.arange(len(table))
+    has_banks = ~(np.isnan(table.left_banks) | np.isnan(table.right_banks)) & (np.diff(table.offsets) > 0)
+    left = np.where(has_banks, table.left_banks, 0)
+    right = np.where(has_banks, table.right_banks, 0)
+    first = table.offsets[:-1]
+    last = table.offsets[1:]
+    # n-value in effect at the left bank through the last n-value starting before the right bank
+    channel_start = np.maximum(_segment_index(table, xs, left, 'right'), first)
+    channel_end = np.maximum(_segment_index(table, xs, right, 'left') + 1, channel_start + 1)
+    channel_end = np.minimum(channel_end, last)
+
+    channel = _reduce_ranges(np.maximum, table.n, channel_start, channel_end)
+    left_ob = _reduce_ranges(np.minimum, table.n, first, channel_start)
+    right_ob = _reduce_ranges(np.minimum, table.n, channel_end, last)
+    overbank = np.fmin(left_ob, right_ob)
+    channel[~has_banks] = np.nan
+    overbank[~has_banks] = np.nan
+    return channel, overbank
+
+
+def channel_rule(table, channel=None, overbank=None):
+    """ Returns indexes of cross sections with channel n greater than the lowest overbank n """
+    if channel is None:
+        channel, overbank = channel_n_values(table)
+    with np.errstate(invalid='ignore'):
+        return np.flatnonzero(channel > overbank)
+
+
+def jump_rule(table, channel=None, max_jump=MAX_JUMP):
+    """
+    Returns indexes of cross sections whose channel n changes by more than max_jump, as a ratio of the
+    lower value, from the previous cross section in the same river and reach
+    """
+    if channel is None:
+        channel = channel_n_values(table)[0]
+    if len(table) < 2:
+        return np.array([], dtype=np.int64)
+    same_reach = (table.rivers[1:] == table.rivers[:-1]) & (table.reaches[1:] == table.reaches[:-1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = np.abs(channel[1:] - channel[:-1]) / np.fmin(channel[1:], channel[:-1])
+        return np.flatnonzero(same_reach & (ratio > max_jump)) + 1
+
+
+def check_table(table, n_range=N_RANGE, max_jump=MAX_JUMP):
+    """
+    Evaluates all rules for table
+    :param max_jump: None to skip the jump rule, e.g. when table isn't every cross section of the reaches
+    :return: list of Finding, sorted by cross section
+    """
+    findings = []
+
+    def n_finding(i, rule, detail):
+        xs = table.xs[i]
+        findings.append((xs, Finding(table.rivers[xs], table.reaches[xs], float(table.xs_ids[xs]),
+                                     float(table.stations[i]), rule, float(table.n[i]), detail)))
+
+    def xs_finding(xs, rule, value, detail):
+        findings.append((xs, Finding(table.rivers[xs], table.reaches[xs], float(table.xs_ids[xs]), '', rule,
+                                     float(value), detail)))
+
+    for i in duplicate_rule(table):
+        n_finding(i, DUPLICATE, 'more than one n-value at station, not visible in the cross section editor')
+    for i in redundant_rule(table):
+        n_finding(i, REDUNDANT, 'n-value is the same as the previous station')
+    for i in range_rule(table, n_range):
+        n_finding(i, RANGE, 'n-value is outside of {} - {}'.format(n_range[0], n_range[1]))
+
+    channel, overbank = channel_n_values(table)
+    for xs in channel_rule(table, channel, overbank):
+        xs_finding(xs, CHANNEL, channel[xs], 'channel n-value is greater than overbank n-value {}'.format(overbank[xs]))
+    for xs in jump_rule(table, channel, max_jump) if max_jump is not None else []:
+        xs_finding(xs, JUMP, channel[xs], 'channel n-value changed from {} at the previous cross section'.format(
+            channel[xs - 1]))
+
+    findings.sort(key=lambda finding: finding[0])
+    return [finding for _, finding in findings]
+
+
+def check_geometry(geofile, n_range=N_RANGE, max_jump=MAX_JUMP, wanted=None):
+    """
+    Returns list of Finding for every cross section in HEC-RAS geometry file geofile
+    :param wanted: optional function(river, reach, xs_id) returning False for cross sections to skip, the jump
+        rule is skipped since it compares neighboring cross sections
+    """
+    if wanted is not None:
+        max_jump = None
+    return check_table(read_table(geofile, wanted), n_range, max_jump)
+
+
+def summary(findings):
+    """ Returns OrderedDict of rule: number of findings """
+    counts = collections.OrderedDict((rule, 0) for rule in RULES)
+    for finding in findings:
+        counts[finding.rule] += 1
+    return counts
+
+
+def write_findings(findings, filename):
+    """ Writes findings to csv filename """
+    with gisio.open_csv(filename) as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(Finding._fields)
+        for finding in findings:
+            writer.writerow(finding)
@@ -0,0 +1,95 @@
+"""
+Synthetic benchmark for parallel top width measurement in tw_core.py. Creates a meandering floodplain
+and evenly spaced cross sections, measures top widths with an increasing number of processes, and
+verifies every run matches the single process results.
+
+usage: python tw_benchmark.py [--xs 20000] [--processes 1 2 4 8]
+"""
+import argparse
+import math
+import multiprocessing
+import time
+
+import numpy as np
+
+import tw_core
+
+REACH_LENGTH = 200000.0
+MEANDER_AMPLITUDE = 800.0
+MEANDER_WAVELENGTH = 6000.0
+FP_HALF_WIDTH = 400.0
+FP_VERTEX_SPACING = 10.0
+XS_VERTICES = 12
+
+
+def _centerline_y(x):
+    return MEANDER_AMPLITUDE * np.sin(2 * math.pi * x / MEANDER_WAVELENGTH)
+
+
+def synthetic_floodplain():
+    """ Returns list of rings: a meandering floodplain with an island every meander """
+    x = np.arange(0, REACH_LENGTH + FP_VERTEX_SPACING, FP_VERTEX_SPACING)
+    y = _centerline_y(x)
+    outer = np.vstack([np.column_stack([x, y + FP_HALF_WIDTH]),
+                       np.column_stack([x[::-1], y[::-1] - FP_HALF_WIDTH])])
+    rings = [outer]
+    angles = np.linspace(0, 2 * math.pi, 40, endpoint=False)
+    for cx in np.arange(MEANDER_WAVELENGTH / 2, REACH_LENGTH, MEANDER_WAVELENGTH):
+        cy = _centerline_y(cx) + FP_HALF_WIDTH / 2
+        rings.append(np.column_stack([cx + 50 * np.cos(angles), cy + 50 * np.sin(angles)]))
+    return rings
+
+
+def synthetic_cross_sections(count):
+    """ Returns list of (n, 2) arrays, cross sections spanning the floodplain """
+    cross_sections = []
+    for i, x in enumerate(np.linspace(10, REACH_LENGTH - 10, count)):
+        yc = _centerline_y(x)
+        # Every tenth cross section starts inside the floodplain
+        start = yc - 0.5 * FP_HALF_WIDTH if i % 10 == 0 else yc - 1.5 * FP_HALF_WIDTH
+        ys = np.linspace(start, yc + 1.5 * FP_HALF_WIDTH, XS_VERTICES)
+        xs = x + np.linspace(-20, 20, XS_VERTICES)
+        cross_sections.append(np.column_stack([xs, ys]))
+    return cross_sections
+
+
+def _same_results(results1, results2):
+    for (tw1, status1), (tw2, status2) in zip(results1, results2):
+        if status1 != status2:
+            return False
+        if tw1 is not None and not np.array_equal(tw1, tw2):
+            return False
+    return len(results1) == len(results2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parallel top width measurement')
+    parser.add_argument('--xs', type=int, default=20000, help='number of cross sections')
+    parser.add_argument('--processes', type=int, nargs='+', default=None, help='process counts to test')
+    args = parser.parse_args()
+    if args.processes is None:
+        args.processes = [1]
+        while args.processes[-1] * 2 <= multiprocessing.cpu_count():
+            args.processes.append(args.processes[-1] * 2)
+
+    start = time.time()
+    index = tw_core.FloodplainIndex(synthetic_floodplain())
+    xs_coords = synthetic_cross_sections(args.xs)
+    print('Indexed {} floodplain edges, created {} cross sections in {:.2f} s'.format(
+        len(index.edges), len(xs_coords), time.time() - start))
+
+    print('{:>10} {:>10} {:>10} {:>10}'.format('processes', 'seconds', 'speedup', 'matches'))
+    baseline = None
+    base_time = None
+    for processes in args.processes:
+        start = time.time()
+        results = tw_core.measure_cross_sections(index, xs_coords, processes)
+        elapsed = time.time() - start
+        if baseline is None:
+            baseline, base_time = results, elapsed
+        print('{:>10} {:>10.2f} {:>10.2f} {:>10}'.format(processes, elapsed, base_time / elapsed,
+                                                          str(_same_results(baseline, results))))
+
+
+if __name__ == '__main__':
+    main()
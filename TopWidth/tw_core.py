@@ -0,0 +1,240 @@
+"""
+Top width measurement without arcpy. The floodplain polygon edges are loaded into a uniform grid
+(FloodplainIndex) which is used to intersect cross sections with the floodplain boundary and to test
+whether cross section end points are inside the floodplain. Cross sections are independent once the
+index exists, so they may be measured in a process pool. The index is shipped to each worker once via
+the pool initializer instead of being pickled with every chunk of cross sections.
+
+Requires numpy
+"""
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+# Status codes returned by measure_cross_section()
+TW_OK = 0
+TW_NO_INTERSECT = 1
+TW_NOT_FOUND = 2
+
+# Average number of floodplain edges per grid cell
+EDGES_PER_CELL = 2.0
+# Number of chunks handed to each worker when chunk_size isn't specified
+CHUNKS_PER_WORKER = 8
+
+
+class FloodplainIndex(object):
+    """
+    Grid index of floodplain polygon edges. Edges are stored as an (m, 4) array of x1, y1, x2, y2. The
+    edges touching each grid cell are stored in cell_edges[cell_start[c]:cell_start[c+1]]. All
+    attributes are numpy arrays or scalars so the index pickles quickly.
+    """
+    def __init__(self, rings, cell_size=None):
+        """
+        :param rings: list of rings, each a sequence of (x, y) vertices. Rings may be open or closed.
+        :param cell_size: grid cell size, calculated from the number of edges if None
+        """
+        edges = []
+        for ring in rings:
+            ring = np.asarray(ring, dtype=float)
+            if len(ring) < 3:
+                continue
+            if ring[0, 0] != ring[-1, 0] or ring[0, 1] != ring[-1, 1]:
+                ring = np.vstack([ring, ring[:1]])
+            edges.append(np.hstack([ring[:-1], ring[1:]]))
+        if not edges:
+            raise ValueError('Floodplain has no valid rings')
+        self.edges = np.vstack(edges)
+
+        self.xmin = min(self.edges[:, 0].min(), self.edges[:, 2].min())
+        self.ymin = min(self.edges[:, 1].min(), self.edges[:, 3].min())
+        xmax = max(self.edges[:, 0].max(), self.edges[:, 2].max())
+        ymax = max(self.edges[:, 1].max(), self.edges[:, 3].max())
+
+        if cell_size is None:
+            area = max((xmax - self.xmin) * (ymax - self.ymin), 1.0)
+            cell_size = (area * EDGES_PER_CELL / len(self.edges)) ** 0.5
+        self.cell_size = float(cell_size)
+        self.nx = int((xmax - self.xmin) / self.cell_size) + 1
+        self.ny = int((ymax - self.ymin) / self.cell_size) + 1
+
+        # Assign every edge to all cells its bounding box touches
+        cx0, cx1 = self._col(np.minimum(self.edges[:, 0], self.edges[:, 2])), \
+            self._col(np.maximum(self.edges[:, 0], self.edges[:, 2]))
+        cy0, cy1 = self._row(np.minimum(self.edges[:, 1], self.edges[:, 3])), \
+            self._row(np.maximum(self.edges[:, 1], self.edges[:, 3]))
+        width = cx1 - cx0 + 1
+        counts = width * (cy1 - cy0 + 1)
+        edge_ids = np.repeat(np.arange(len(self.edges)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (cy0[edge_ids] + k // width[edge_ids]) * self.nx + cx0[edge_ids] + k % width[edge_ids]
+        order = np.argsort(cells, kind='mergesort')
+        self.cell_edges = edge_ids[order]
+        self.cell_start = np.searchsorted(cells[order], np.arange(self.nx * self.ny + 1))
+
+    def _col(self, x):
+        return np.clip(((np.asarray(x) - self.xmin) / self.cell_size).astype(int), 0, self.nx - 1)
+
+    def _row(self, y):
+        return np.clip(((np.asarray(y) - self.ymin) / self.cell_size).astype(int), 0, self.ny - 1)
+
+    def candidates(self, xmin, ymin, xmax, ymax):
+        """ Returns array of ids of edges that may touch the bounding box """
+        cx0, cx1 = int(self._col(xmin)), int(self._col(xmax))
+        cy0, cy1 = int(self._row(ymin)), int(self._row(ymax))
+        chunks = []
+        for row in range(cy0, cy1 + 1):
+            start = self.cell_start[row * self.nx + cx0]
+            end = self.cell_start[row * self.nx + cx1 + 1]
+            if end > start:
+                chunks.append(self.cell_edges[start:end])
+        if not chunks:
+            return np.empty(0, dtype=int)
+        return np.unique(np.concatenate(chunks))
+
+    def contains(self, x, y):
+        """ Returns True if point x, y is inside the floodplain (even-odd rule, ray cast in +x) """
+        if x < self.xmin or y < self.ymin:
+            return False
+        ids = self.candidates(x, y, self.xmin + self.nx * self.cell_size, y)
+        if len(ids) == 0:
+            return False
+        x1, y1, x2, y2 = self.edges[ids].T
+        straddle = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        crossings = np.count_nonzero(straddle & (x < x_cross))
+        return crossings % 2 == 1
+
+    def intersect(self, coords, stations):
+        """
+        Intersects a polyline with the floodplain edges
+
+        :param coords: (n, 2) array of polyline vertices
+        :param stations: (n,) array of vertex stations along the polyline
+        :return: (xy, stations) of the unique intersection points, sorted by station
+        """
+        ids = self.candidates(coords[:, 0].min(), coords[:, 1].min(), coords[:, 0].max(), coords[:, 1].max())
+        if len(ids) == 0:
+            return np.empty((0, 2)), np.empty(0)
+        edges = self.edges[ids]
+
+        # Line segments p + t*r and edges q + u*s, broadcast as (segments, edges)
+        p = coords[:-1, np.newaxis, :]
+        r = (coords[1:] - coords[:-1])[:, np.newaxis, :]
+        q = edges[np.newaxis, :, 0:2]
+        s = edges[np.newaxis, :, 2:4] - edges[np.newaxis, :, 0:2]
+        qp = q - p
+        denom = r[..., 0] * s[..., 1] - r[..., 1] * s[..., 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (qp[..., 0] * s[..., 1] - qp[..., 1] * s[..., 0]) / denom
+            u = (qp[..., 0] * r[..., 1] - qp[..., 1] * r[..., 0]) / denom
+        hit = (denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        seg, _ = np.nonzero(hit)
+        if len(seg) == 0:
+            return np.empty((0, 2)), np.empty(0)
+        t = t[hit]
+        xy = coords[seg] + t[:, np.newaxis] * (coords[seg + 1] - coords[seg])
+        sta = stations[seg] + t * (stations[seg + 1] - stations[seg])
+
+        # Crossing at a floodplain or cross section vertex is found twice
+        order = np.argsort(sta, kind='mergesort')
+        xy, sta = xy[order], sta[order]
+        keep = np.concatenate([[True], np.diff(sta) > 1e-9 * max(1.0, abs(sta[-1]))])
+        return xy[keep], sta[keep]
+
+
+def polyline_stations(coords):
+    """ Returns array of cumulative distance along coords, starting at 0 """
+    seg_len = np.hypot(np.diff(coords[:, 0]), np.diff(coords[:, 1]))
+    return np.concatenate([[0.0], np.cumsum(seg_len)])
+
+
+def measure_cross_section(index, coords):
+    """
+    Measures top width at a single cross section. Mirrors the original arcpy Intersect based
+    measurement: cross section vertices and floodplain intersections are sorted by station and the
+    top width line runs from the outermost intersections, or the cross section ends if they are inside
+    the floodplain.
+
+    :param index: FloodplainIndex
+    :param coords: (n, 2) array of cross section vertices
+    :return: (top width vertices as (k, 2) array or None, status code)
+    """
+    coords = np.asarray(coords, dtype=float)
+    stations = polyline_stations(coords)
+    int_xy, int_sta = index.intersect(coords, stations)
+    if len(int_sta) == 0:
+        return None, TW_NO_INTERSECT
+
+    # Combine vertices and intersections, vertices sort first on equal station like the arcpy version
+    all_xy = np.vstack([coords, int_xy])
+    all_sta = np.concatenate([stations, int_sta])
+    is_intersect = np.concatenate([np.zeros(len(coords), bool), np.ones(len(int_sta), bool)])
+    order = np.argsort(all_sta, kind='mergesort')
+    all_xy, is_intersect = all_xy[order], is_intersect[order]
+
+    flagged = np.nonzero(is_intersect)[0]
+    left = 0 if index.contains(coords[0, 0], coords[0, 1]) else flagged[0]
+    right = len(all_xy) - 1 if index.contains(coords[-1, 0], coords[-1, 1]) else flagged[-1]
+    if left == right:
+        return None, TW_NOT_FOUND
+    return all_xy[left:right + 1], TW_OK
+
+
+# Floodplain index for the current worker process, set by _init_worker()
+_worker_index = None
+
+
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _measure_chunk(chunk):
+    return [measure_cross_section(_worker_index, coords) for coords in chunk]
+
+
+def _set_python_executable():
+    """
+    Point multiprocessing at python.exe when running inside ArcMap/ArcCatalog, otherwise workers are
+    started with the ArcGIS executable.
+    """
+    if os.name != 'nt':
+        return
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return
+    python = os.path.join(sys.exec_prefix, 'python.exe')
+    if os.path.isfile(python):
+        multiprocessing.set_executable(python)
+
+
+def measure_cross_sections(index, xs_coords, processes=1, chunk_size=None):
+    """
+    Measures top width at all cross sections, optionally in a process pool
+
+    :param index: FloodplainIndex
+    :param xs_coords: list of (n, 2) arrays of cross section vertices
+    :param processes: number of worker processes, 1 measures in the current process
+    :param chunk_size: number of cross sections per task
+    :return: list of (top width vertices or None, status code) in the same order as xs_coords
+    """
+    if processes <= 1 or len(xs_coords) < 2:
+        return [measure_cross_section(index, coords) for coords in xs_coords]
+
+    if chunk_size is None:
+        chunk_size = max(1, len(xs_coords) // (processes * CHUNKS_PER_WORKER))
+    chunks = [xs_coords[i:i + chunk_size] for i in range(0, len(xs_coords), chunk_size)]
+
+    _set_python_executable()
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(index,))
+    try:
+        results = []
+        # imap returns chunks in submission order, keeping results in cross section order
+        for chunk_results in pool.imap(_measure_chunk, chunks):
+            results.extend(chunk_results)
+    finally:
+        pool.close()
+        pool.join()
+    return results
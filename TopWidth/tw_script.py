@@ -7,23 +7,27 @@ mike.bannister@respec.com
 """
 import twcheck
 import arcpy
-import sys
-
-# update text updates
-twcheck.message = arcpy.AddMessage
-twcheck.warn = arcpy.AddWarning
-twcheck.error = arcpy.AddError
-
-fp_file = arcpy.GetParameterAsText(0)
-xsec_file = arcpy.GetParameterAsText(1)
-xs_id_field = arcpy.GetParameterAsText(2)
-out_file = arcpy.GetParameterAsText(3)
-
-# make sure we have the right version, MeasureOnLine() requires >= 10.2.1
-info = arcpy.GetInstallInfo()
-if info['Version'] < '10.2.1':
-    arcpy.AddError('Top Width Check requires ArcMap >= 10.2.1, you are using ' + info['Version'] + \
-                   ', aborting.')
-    sys.exit()
-
-twcheck.measure(fp_file, xsec_file, xs_id_field, out_file)
+
+
+def main():
+    # update text updates
+    twcheck.message = arcpy.AddMessage
+    twcheck.warn = arcpy.AddWarning
+    twcheck.error = arcpy.AddError
+
+    fp_file = arcpy.GetParameterAsText(0)
+    xsec_file = arcpy.GetParameterAsText(1)
+    xs_id_field = arcpy.GetParameterAsText(2)
+    out_file = arcpy.GetParameterAsText(3)
+
+    # Optional number of worker processes
+    processes = 1
+    if arcpy.GetArgumentCount() > 4 and arcpy.GetParameterAsText(4) != '':
+        processes = int(arcpy.GetParameterAsText(4))
+
+    twcheck.measure(fp_file, xsec_file, xs_id_field, out_file, processes=processes)
+
+
+# Guard is required for worker processes on Windows, which re-import this script
+if __name__ == '__main__':
+    main()
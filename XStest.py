@@ -7,88 +7,73 @@ mike.bannister@respec.com
 2017
 """
 import bfetool
-import os
+import gisio
+import input_cache
 
-bfetool.BFE_ELEV_FIELD = 'XS_ID'
 
 class CrossSectionTest(bfetool.CreateBFEs):
+    elev_field = 'XS_ID'
+
     def create_test_XS(self):
-        XS_points = self._create_test_XS_points()
-        self._create_test_XS_lines(XS_points)
-        self._delete_temp_file(XS_points)
+        channels = self._read_channels()
+        XS_points = self._create_test_XS_points(channels)
+        self._create_test_XS_lines(channels, XS_points)
 
-    def _create_test_XS_points(self):
-        """ Creates temporary shapefile of XS points. This is step 1 
-            Returns temporary shapefile name with full path
+    def _create_test_XS_points(self, channels):
+        """ Locates cross sections along the channel alignments. This is step 1
+            Returns list of (channel_point, river, reach, XS ID)
         """
-        arcpy.SetProgressor("default", "Preparing to create test cross sections...")
-
-        # Set up test XS point shape file
-        temp_point_file = self._temp_filename()+'.shp'
-        self._setup_shapefile(temp_point_file, 'POINT', 'Creating temporary XS point shapefile: ')
-            
-        arcpy.SetProgressor("step", "Creating temporary XS points..." , 0, 100, 10)
-        arcpy.AddMessage('Populating temporary XS points... ')
+        gisio.set_progressor("default", "Preparing to create test cross sections...")
+        gisio.set_progressor("step", "Creating XS points..." , 0, 100, 10)
+        gisio.message('Populating XS points... ')
         try:
             total_XS = self.rs.number_of_XSs()
+            XS_points = []
             num_XSs_created = 0
-            with arcpy.da.SearchCursor(self.channel_filename, ['SHAPE@', self.channel_river_field, 
-                self.channel_reach_field]) as channel_cursor:
-                with arcpy.da.InsertCursor(temp_point_file, ['SHAPE@', self.channel_river_field,
-                    self.channel_reach_field, bfetool.BFE_ELEV_FIELD, bfetool.BFE_STA_FIELD]) as XS_cursor:
-                    for channel in channel_cursor:
-                        # See if we have XSs for that reach
-                        if self.rs.reach_exists(channel[1], channel[2]):
-                            current_reach = self.rs.get_reach(channel[1], channel[2])
-                        else:
-                            continue
-                        # Got XSs, lets make some points!
-                        channel_geo = channel[0]
-                        for current_XS in current_reach.cross_sections:
-                            new_point = channel_geo.positionAlongLine(current_XS.cum_length, False)
-                            XS_cursor.insertRow([new_point, channel[1], channel[2], current_XS.ID, current_XS.cum_length])
+            for channel_geo, river, reach, channel_stations in channels:
+                # See if we have XSs for that reach
+                if self.rs.reach_exists(river, reach):
+                    current_reach = self.rs.get_reach(river, reach)
+                else:
+                    continue
+                # Got XSs, lets make some points!
+                stations = [current_XS.cum_length for current_XS in current_reach.cross_sections]
+                points = self._points_along_channel(channel_geo, channel_stations, stations)
+                for current_XS, (x, y) in zip(current_reach.cross_sections, points):
+                    XS_points.append((bfetool.channel_point(x, y, current_XS.cum_length), river, reach,
+                                      current_XS.ID))
 
-                            #Keep track of created XSs and update progress bar
-                            num_XSs_created += 1
-                            if num_XSs_created % (int(total_XS/10)) == 0:
-                                arcpy.SetProgressorPosition()
+                    #Keep track of created XSs and update progress bar
+                    num_XSs_created += 1
+                    if num_XSs_created % max(1, int(total_XS/10)) == 0:
+                        gisio.set_progressor_position()
         except Exception as detail:
-            arcpy.AddError('Error creating temporary XS points: ' + str(detail))
+            gisio.error('Error creating XS points: ' + str(detail))
             raise
 
-        arcpy.AddMessage(str(num_XSs_created)+' XSs created out of '+str(total_XS)+' total XSs.')
+        gisio.message(str(num_XSs_created)+' XSs created out of '+str(total_XS)+' total XSs.')
         if num_XSs_created > total_XS:
-            arcpy.AddWarning('Warning! More XSs were created than exist in the input file! Are there duplicate alignments?')
+            gisio.warn('Warning! More XSs were created than exist in the input file! Are there duplicate alignments?')
         if num_XSs_created < total_XS:
-            arcpy.AddWarning('Warning! Not all XSs in input file were created!')
-        return (temp_point_file)
+            gisio.warn('Warning! Not all XSs in input file were created!')
+        return XS_points
     
-    def _create_test_XS_lines(self, XS_points):
-        self._create_BFE_lines(XS_points)
+    def _create_test_XS_lines(self, channels, XS_points):
+        self._create_BFE_lines(channels, XS_points)
         
-    def _setup_shapefile(self, filename, shape, message):
-        """ Creates output/temp shapefile, adds fields, and updates the arcpy status dialog  
+    def output_fields(self):
+        """ Returns list of gisio.Field for the output shapefile
             This had to be modified to make BFE_ELEV_FIELD text
         """
-        try:
-            arcpy.AddMessage(message+filename)
-            spatial_reference = arcpy.Describe(self.channel_filename).spatialReference
-            arcpy.CreateFeatureclass_management(os.path.dirname(filename), os.path.basename(filename), 
-                                                    shape, '', '', '', spatial_reference)
-            arcpy.AddMessage('Adding fields...')
-            arcpy.AddField_management(filename, self.channel_river_field, 'TEXT', field_length = bfetool.FIELD_LENGTH)
-            arcpy.AddField_management(filename, self.channel_reach_field, 'TEXT', field_length = bfetool.FIELD_LENGTH)
-            arcpy.AddField_management(filename, bfetool.BFE_ELEV_FIELD, 'TEXT', field_length=bfetool.FIELD_LENGTH)
-            arcpy.AddField_management(filename, bfetool.BFE_STA_FIELD, 'DOUBLE')       
-        except:
-            arcpy.AddError('Unable to create '+filename+'. Is the shape file open in another program or is the workspace being edited?')
-            raise
-        else:
-            arcpy.AddMessage('Done.')
+        return [gisio.text_field(self.channel_river_field, bfetool.FIELD_LENGTH),
+                gisio.text_field(self.channel_reach_field, bfetool.FIELD_LENGTH),
+                gisio.text_field(self.elev_field, bfetool.FIELD_LENGTH),
+                gisio.double_field(bfetool.BFE_STA_FIELD)]
             
         
 def main():
-     # Process parameters
+    import arcpy
+    # Process parameters
     XS_file = arcpy.GetParameterAsText(0)
     channel_filename = arcpy.GetParameterAsText(1)
     channel_river_field = arcpy.GetParameterAsText(2)
@@ -96,26 +81,33 @@ def main():
     xs_test_length = float(arcpy.GetParameterAsText(4))
     outfilename = arcpy.GetParameterAsText(5)
     convert_to_CAD = arcpy.GetParameterAsText(6)
+    # Optional, the first profile if blank
+    profile = arcpy.GetParameterAsText(7)
     
-    # Import RAS data from csv
-    arcpy.AddMessage('Importing cross sections from '+XS_file)
-    rs = bfetool.import_BFE_from_CSV(XS_file)
-    
-    # Process RAS data and c
-    rs.sort_all()
-    arcpy.AddMessage('Done.')
+    # Run on the resident service if one is running, see fhad_service.py
+    import fhad_service
+    if not fhad_service.run_tool('xstest', {'xs_file': XS_file, 'channels': channel_filename,
+                                            'river_field': channel_river_field, 'reach_field': channel_reach_field,
+                                            'length': xs_test_length, 'outfile': outfilename,
+                                            'profile': profile}, backend=gisio.ARCPY):
+        # Import RAS data from csv
+        gisio.message('Importing cross sections from '+XS_file)
+        rs = input_cache.river_system(XS_file, profile)
 
-    # Create BFEs in GIS
-    create_XSs = CrossSectionTest(rs, channel_filename, channel_river_field, channel_reach_field, outfilename,
-            BFE_length=xs_test_length)
-    create_XSs.create_test_XS()
+        # Process RAS data and c
+        rs.sort_all()
+        gisio.message('Done.')
+
+        # Create BFEs in GIS
+        create_XSs = CrossSectionTest(rs, channel_filename, channel_river_field, channel_reach_field, outfilename,
+                BFE_length=xs_test_length)
+        create_XSs.create_test_XS()
 
     # Convert BFEs to CAD
     if convert_to_CAD == 'true':
-        arcpy.AddMessage('Exporting to CAD')
+        gisio.message('Exporting to CAD')
         arcpy.ExportCAD_conversion(outfilename, 'DWG_R2010', outfilename[:-3]+'dwg')
-    
-    time.sleep(3)
-    
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,456 @@
+"""
+Compute core for bfetool.py and XStest.py. Parses HEC-RAS output, calculates BFE locations along
+each reach, and calculates BFE line geometry from channel alignment vertices without arcpy.
+"""
+
+import collections
+import math
+import sys
+
+import numpy as np
+
+BFE = collections.namedtuple('BFE', ['elevation', 'station'])
+channel_point = collections.namedtuple('channel_point', ['X','Y','station'])
+
+
+# The following 3 functions may be overridden for use with arcpy, etc.
+def message(text):
+    print(text)
+
+
+def warn(text):
+    print(text)
+
+
+def error(text):
+    print(text)
+
+
+class BFENotFound(Exception):
+    pass
+    
+class BFE_Locations:
+    """ Used to create BFE locations for a reach. This needs to be tested extensively """
+    def __init__(self, reach):
+        self.reach = reach
+    
+    def calc_locations(self):
+        """ Determine stations for all BFEs on the reach. Returns a list of BFE named 
+            tuples sorted in ascending order.
+        """
+        # print self.reach.river_name, self.reach.reach_name
+        # print '-'*50+'\n'
+        self.BFEs = []
+        cross_sections = self.reach.cross_sections
+        self.min_BFE = math.ceil(self.reach.min_WSEL())
+        self.max_BFE = math.floor(self.reach.max_WSEL())
+        
+        for i in range(len(cross_sections)-1):
+            self.BFEs += self._calc_BFEs_between_XSs(cross_sections[i], cross_sections[i+1])
+        
+        self.BFE_checker()
+        return self.BFEs
+    
+    def BFE_checker(self):
+        """ Verify that BFE elevation and stations are always increasing and BFEs are 
+            integers. This guarantees that there are no duplicates.
+        """
+        first_lap = True
+        for test_BFE in self.BFEs:
+            if first_lap:
+                last_elevation = test_BFE.elevation
+                last_station = test_BFE.station
+                first_lap = False
+                continue
+            assert(last_elevation < test_BFE.elevation)
+            assert(last_station < test_BFE.station)
+            assert(int(last_elevation) == last_elevation)
+            last_elevation = test_BFE.elevation
+            last_station = test_BFE.station
+        
+    def _calc_BFEs_between_XSs(self, XS1, XS2):
+        """ Find all BFEs between XS1 and XS2. Checks for negative slopes.
+            Returns list of BFE named tuples sorted in ascending order.
+        """
+        BFEs = []
+        # Bail if the water surface slope backwards
+        if XS1.WSEL > XS2.WSEL:
+            return []
+        local_min_BFE = int(math.ceil(XS1.WSEL))
+        local_max_BFE = int(math.floor(XS2.WSEL))
+        # Loops through all integer elevations between XS1 and XS2
+        for current_BFE in range(local_min_BFE, local_max_BFE+1):
+            # Only one BFE of a give elevation per reach please
+            if not self._BFE_exists(current_BFE):
+                station = self._calc_BFE_location(XS1, XS2, current_BFE)
+                new_BFE = BFE(elevation=current_BFE, station=station)
+                BFEs.append(new_BFE)
+        return BFEs
+        
+    def _calc_BFE_location(self, XS1, XS2, BFE_WSEL):
+        """ Returns BFE station between cross sections """
+        # print XS1, XS2, BFE_WSEL
+        m = (XS2.WSEL - XS1.WSEL)/(XS2.cum_length - XS1.cum_length)
+        # This will only occur for integer BFEs at the start of a reach
+        if m == 0:
+            return XS1.cum_length
+        b = XS1.WSEL - m*XS1.cum_length
+        # Idiot check
+        b_test = XS2.WSEL - m*XS2.cum_length
+        assert (round(b,10) == round(b_test,10))
+        return (BFE_WSEL - b)/m
+    
+    def _BFE_exists(self, current_BFE):
+        """ Returns true if BFE already exists, else False """
+        for test_BFE in self.BFEs:
+            if test_BFE.elevation == current_BFE:
+                return True
+        return False
+        
+        
+class RiverSystem:
+    def __init__(self):
+        self.reaches = []
+        self.sorted = False
+        self.reach_lengths_calcd = False
+    
+    def __repr__(self):
+        return_str = ''
+        for reach in self.reaches:
+            return_str += repr(reach)
+        return return_str
+    
+    def get_reach(self, river_name, reach_name):
+        for reach in self.reaches:
+            if reach.river_name == river_name and reach.reach_name == reach_name:
+                return reach
+        else:
+            new_reach = Reach(river_name, reach_name)
+            self.reaches.append(new_reach)
+            return new_reach
+    
+    def reach_exists(self, river_name, reach_name):
+        for reach in self.reaches:
+            if reach.river_name == river_name and reach.reach_name == reach_name:
+                return True
+        else:
+            return False
+            
+    def sort_all(self):
+        for reach in self.reaches:
+            reach.sort_XS()
+        self.sorted = True
+            
+    ### This appears to be completely unnecessary. Oops.
+    def calc_all_reach_lengths(self):
+        if self.sorted:
+            for reach in self.reaches:
+                reach.calc_reach_lengths()
+            self.reach_lengths_calcd = True
+        else:
+            error('*'*20+'Must sort cross sections before '+\
+                    'calculating reach lengths!')
+            # This is not right but gets the job done
+            raise
+    
+    def number_of_XSs(self):
+        total_XS = 0
+        for reach in self.reaches:
+            total_XS += len(reach.cross_sections)
+        return total_XS
+    
+    def calc_all_BFEs(self):
+        if self.reach_lengths_calcd:
+            for reach in self.reaches:
+                reach.calc_BFEs()
+        else:
+            error('*'*20+'Must calculate reach lengths '+\
+                    'before calculating BFEs!')
+            # This is not right but gets the job done
+            raise
+    
+    def number_of_BFEs(self):
+        """ Return number of BFEs in all reaches """
+        number = 0
+        for reach in self.reaches:
+            number += len(reach.BFEs)
+        return number
+          
+          
+class Reach:
+    def __init__(self, river_name, reach_name):
+        self.river_name = river_name
+        self.reach_name = reach_name
+        self.cross_sections = []
+        self.BFEs = []
+            
+    def __repr__(self):
+        return_str = self.river_name+', '+self.reach_name+'\n'
+        return_str += '-'*50+'\n'
+        for xs in self.cross_sections:
+            return_str += repr(xs)
+        if self.BFEs != []:
+            return_str += 'BFEs:\n'
+            for current_BFE in self.BFEs:
+                return_str += str(current_BFE)+'\n'
+        return return_str+'\n'
+        
+    def add_XS(self, ID, profile, WSEL, cum_length):
+        # Correct HEC-RAS pretending the downstream XS has 0 length
+        if cum_length == '':
+            cum_length = 0.0
+        new_XS = CrossSection(ID, profile, WSEL, cum_length)
+        self.cross_sections.append(new_XS)
+    
+    def sort_XS(self):
+        self.cross_sections.sort(key=lambda x:x.cum_length)
+    
+    def calc_reach_lengths(self):
+        for i in range(len(self.cross_sections)):
+            if i == 0:
+                self.cross_sections[0].reach_length = self.cross_sections[0].cum_length
+            else:
+                self.cross_sections[i].reach_length = self.cross_sections[i].cum_length - \
+                        self.cross_sections[i-1].cum_length
+        
+    def max_WSEL(self):
+        max = -1
+        for xs in self.cross_sections:
+            if xs.WSEL > max:
+                max = xs.WSEL
+        return max
+    
+    def min_WSEL(self):
+        min = 999999.0
+        for xs in self.cross_sections:
+            if xs.WSEL < min:
+                min = xs.WSEL
+        return min
+        
+    def calc_BFEs(self):
+        BFE_loc = BFE_Locations(self)
+        self.BFEs = BFE_loc.calc_locations()
+
+        
+class CrossSection:
+    def __init__(self, ID, profile, WSEL, cum_length):
+        self.ID = ID
+        self.profile = profile
+        self.WSEL = float(WSEL)
+        self.cum_length = float(cum_length)
+        self.reach_length = -1.0
+        
+    def __repr__(self):
+        return self.ID+', '+self.profile+', '+str(self.WSEL)+', '+\
+                str(self.cum_length)+', '+str(self.reach_length)+'\n'
+
+
+def channel_point_list(channel_vertices):
+    """ Returns list of channel_vertices, a sequence of (x, y), in channel_point format """
+    current_station = 0
+    channel_points = []
+    first_point = True
+    for x, y in channel_vertices:
+        temp_pnt = channel_point(x, y, 0)
+        # Don't calculate channel length at first point
+        if first_point:
+            first_point = False
+        else:
+            current_station += distance(last_pnt, temp_pnt)
+        new_pnt = channel_point(temp_pnt.X, temp_pnt.Y, current_station)
+        channel_points.append(new_pnt)
+        last_pnt = new_pnt
+    return channel_points
+
+
+def distance(pnt1, pnt2):
+    """ returns distance between two points via c^2 = a^2 + b^2 """
+    csquare = (pnt1.X-pnt2.X)**2+(pnt1.Y-pnt2.Y)**2
+    return math.sqrt(csquare)
+
+
+def point_at_angle_dist(orig_pnt, theta, dist):
+    """ Returns (x, y) at angle theta and dist from orig_pnt, an (x, y) tuple """
+    return (orig_pnt[0] + dist*math.cos(theta), orig_pnt[1] + dist*math.sin(theta))
+
+
+def angle(point1, point2):
+    """ Returns angle between two points in radians """
+    if point2.X == point1.X:
+        if point2.Y > point1.Y:
+            return math.pi/2
+        else:
+            return -math.pi/2
+    else:
+        return math.atan((point2.Y-point1.Y)/(point2.X-point1.X))
+
+
+def find_channel_angle_at_BFE(BFE_pnt, channel_points):
+    """ Returns the angle of the channel at the BFE point """
+    num_chnl_pts = len(channel_points)
+    # See if BFE is between two channel vertices
+    for i in range(num_chnl_pts-1):
+        if channel_points[i].station < BFE_pnt.station and BFE_pnt.station < channel_points[i+1].station:
+                return angle(channel_points[i], channel_points[i+1])
+    # Not between vertices, see if its on a vertex
+    ####### This is not yet tested!!! #####################
+    for i in range(num_chnl_pts):
+        if channel_points[i].station == BFE_pnt.station:
+            if i != num_chnl_pts-1 and i != 0:
+                angle1 = angle(channel_points[i-1], channel_points[i])
+                angle2 = angle(channel_points[i], channel_points[i+1])
+                return (angle1+angle2)/2
+            elif i == 0:
+                # On first vertix
+                return angle(channel_points[0], channel_points[1])
+            elif i == num_chnl_pts-1:
+                # On last vertix
+                return angle(channel_points[num_chnl_pts-2], channel_points[num_chnl_pts-1])
+    # Not found
+    raise BFENotFound
+
+
+def BFE_line_coords(BFE_pnt, channel_points, BFE_length, BFE_wings=False, BFE_wing_length=0):
+    """ Returns list of (x, y) for a line perpendicular to the channel alignment at BFE_pnt """
+    BFE_xy = (BFE_pnt.X, BFE_pnt.Y)
+    theta = find_channel_angle_at_BFE(BFE_pnt, channel_points)
+    left_pnt = point_at_angle_dist(BFE_xy, theta+math.pi/2, BFE_length/2)
+    right_pnt = point_at_angle_dist(BFE_xy, theta-math.pi/2, BFE_length/2)
+    if BFE_wings:
+        # Add wings to the BFE to make delineation in CAD faster
+        left_left_pnt = point_at_angle_dist(left_pnt, theta+math.pi/2, BFE_wing_length)
+        right_right_pnt = point_at_angle_dist(right_pnt, theta-math.pi/2, BFE_wing_length)
+        return [left_left_pnt, left_pnt, right_pnt, right_right_pnt]
+    else:
+        # Only a two point line
+        return [left_pnt, right_pnt]
+
+
+def import_BFE_from_CSV(csv_filename):
+    """ Parses csv file from hec-ras in format:
+    
+        River,Reach,River Sta,Profile,W.S. Elev,Cum Ch Len
+        
+        Internal bridge sections can/should be turned on to improve BFE placement
+        at bridges. Will also accept the RAS table header. 
+        
+        Returns RiverSystem object. 
+    """
+    ### TODO - This should be modified to handle a single reach. This has been started but needs a LOT more work
+    rs = RiverSystem()
+    first_lap = True
+    river_reach = []
+    with open(csv_filename) as infile:
+        for line in infile:
+            fields = line.strip().split(',')
+            # Check for header
+            if first_lap:
+                first_lap = False
+                if fields[0] == 'River' or fields[0] == 'Reach':
+                    if not check_header(fields):
+                        warn('Header error!')
+                        csv_format_error(line)
+                    try:
+                        # Skip second line of header
+                        next(infile)
+                        continue
+                    except StopIteration:
+                        error('Error: No linefeed/only one line in file. Did you save as a Mac csv?')
+                        raise
+            # Ignore culvert/bridge lines
+            if fields[3] == '' or fields[4] == '':
+                continue
+            # Create/get reach and create cross section
+            if len(fields) == 6:
+                # River field is included
+                current_reach = rs.get_reach(fields[0], fields[1])
+                xs_id = fields[2].split()[0]
+                current_reach.add_XS(xs_id, fields[3], fields[4], fields[5])
+            elif len(fields) == 5:
+                # No river field - not supported yet
+                error('BFE csv file does not appear to have a "River" column. This is currently not' +
+                               ' supported. Please add a "River" column before the "Reach" column. Values in the ' +
+                               '"River" column must match the RiverCode in the alignment shapefile. Thank you')
+                sys.exit()
+                # current_reach = rs.get_reach(UNKNOWN, fields[0])
+                # xs_id = fields[1].split()[0]
+                # current_reach.add_XS(xs_id, fields[2], fields[3], fields[4])
+            else:
+                # Something is wrong
+                csv_format_error(line)
+    return rs
+
+
+# Columns of river_system_table()
+TABLE_COLUMNS = ('river', 'reach', 'ID', 'profile', 'WSEL', 'cum_length')
+
+
+def river_system_table(rs):
+    """
+    Returns cross sections of RiverSystem rs, as read by import_BFE_from_CSV(), as dict of TABLE_COLUMNS
+    arrays. Text columns are object arrays.
+    """
+    rows = [(reach.river_name, reach.reach_name, xs.ID, xs.profile, xs.WSEL, xs.cum_length)
+            for reach in rs.reaches for xs in reach.cross_sections]
+    columns = list(zip(*rows)) if rows else [[]] * len(TABLE_COLUMNS)
+    table = {}
+    for name, values in zip(TABLE_COLUMNS, columns):
+        table[name] = np.array(values, dtype=float if name in ('WSEL', 'cum_length') else object)
+    return table
+
+
+def profile_table(table, profile=None):
+    """
+    Returns rows of river_system_table() dict table for one profile. BFEs are interpolated along a single water
+    surface profile, with several profiles every cross section is repeated at the same cumulative length.
+
+    :param profile: profile name, defaults to the first profile in table
+    :raises ValueError: if profile isn't in table
+    """
+    profiles = np.array([str(name).strip() for name in table['profile'].tolist()], dtype=object)
+    if len(profiles) == 0:
+        return table
+    if profile is None or str(profile).strip() == '':
+        profile = profiles[0]
+        if len(set(profiles.tolist())) > 1:
+            message('Using the first profile, ' + profile)
+    keep = profiles == str(profile).strip()
+    if not keep.any():
+        error('Profile ' + str(profile) + ' not found')
+        raise ValueError('Profile ' + str(profile) + ' not found')
+    return dict((name, values[keep]) for name, values in table.items())
+
+
+def river_system_from_table(table):
+    """ Returns new RiverSystem from river_system_table() dict, reaches and cross sections keep their order """
+    rs = RiverSystem()
+    for river, reach, ID, profile, WSEL, cum_length in zip(*[table[name].tolist() for name in TABLE_COLUMNS]):
+        rs.get_reach(river, reach).add_XS(ID, profile, WSEL, cum_length)
+    return rs
+
+
+def csv_format_error(line):
+    ''' Report error in CSV header format '''
+    error('Error in line:' + line.strip() +
+        '\nInput .csv must be in format: River, Reach, River Sta, Profile, W.S. Elev, Cum Ch Len ' +
+        '- Exiting.')
+    sys.exit()
+
+def check_header(fields):
+    '''
+    Check if values in fields represent correct column headers from RAS. 
+    
+    :param fields: list of strings, first row of BFE csv file
+    :returns: True if ok, False if not
+    '''
+    if len(fields) == 6:
+        if fields[0] == 'River' and fields[1] == 'Reach' and \
+        fields[2] == 'River Sta' and fields[3] == 'Profile' and \
+        fields[4] == 'W.S. Elev' and fields[5] == 'Cum Ch Len':
+            return True
+    elif len(fields) == 5:
+        if fields[0] == 'Reach' and \
+        fields[1] == 'River Sta' and fields[2] == 'Profile' and \
+        fields[3] == 'W.S. Elev' and fields[4] == 'Cum Ch Len':
+            return True
+    return False
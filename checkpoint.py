@@ -0,0 +1,170 @@
+"""
+Checkpoints of long tool runs so a run that stopped partway, e.g. a statewide allgeo or bfe run that hit a
+locked output or a bad row, can be resumed with --resume instead of starting over.
+
+A checkpoint records the units of work that are finished (a tool output of allgeo, a chunk of cross
+sections of a review tool, a reach of bfe) and the number of features written to each output when its last
+finished unit was written. Units are recorded from gisio.BulkWriter.checkpoint() once their features are
+written, so batches are written exactly as in an uninterrupted run. On resume the output is truncated to the
+recorded features, features of unfinished units that were written anyway are dropped, and the tool skips
+finished units and appends to the output. The output is the same as that of an uninterrupted run.
+
+Checkpoints are JSON files written next to the output. A checkpoint is only resumed by a run with the same
+parameters and unchanged inputs, and it is removed when the run finishes.
+"""
+import functools
+import json
+import os
+import threading
+
+import gisio
+import gpkg
+import input_cache
+
+VERSION = 1
+SUFFIX = '.checkpoint.json'
+# Cross sections per unit of work of the review tools
+CHUNK_SIZE = 200
+# Parameters that don't change outputs
+IGNORED_PARAMS = ('resume', 'processes')
+
+
+def default_filename(outfile):
+    """ Returns name of the checkpoint of a tool writing outfile """
+    if gpkg.is_geopackage(outfile):
+        database, layer = gpkg.split_layer(outfile)
+        return os.path.splitext(database)[0] + '_' + layer + SUFFIX
+    return os.path.splitext(outfile)[0] + SUFFIX
+
+
+class Checkpoint(object):
+    """
+    Finished units of a run, e.g. 'length audit' or 'chunk 3' of an output, and the features written to each
+    output. Saved to filename after every change.
+    """
+    def __init__(self, filename, params, inputs):
+        """
+        :param params: dict of tool parameters, a checkpoint is only resumed with the same parameters
+        :param inputs: input files or feature classes, a checkpoint is only resumed while they're unchanged
+        """
+        self.filename = filename
+        params = dict((key, value) for key, value in params.items() if key not in IGNORED_PARAMS and
+                      (value is None or isinstance(value, (bool, int, float) + gisio.string_types)))
+        # Compared to the saved key after a round trip through JSON
+        self.key = json.loads(json.dumps({'params': params, 'inputs': [[name, input_cache.input_stamp([name])]
+                                                                        for name in inputs if name]}))
+        self.units = []
+        # outfile: {'features': features written, 'units': finished units}
+        self.outputs = {}
+        # Features in each output when it was opened by this run
+        self.start_features = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def open(cls, filename, params, inputs, resume=False):
+        """
+        Returns the checkpoint saved in filename if resume is true and it was saved by a run with the same
+        params and inputs, otherwise a new checkpoint
+        """
+        checkpoint = cls(filename, params, inputs)
+        if not resume:
+            return checkpoint
+        try:
+            with open(filename) as infile:
+                saved = json.load(infile)
+        except (IOError, OSError, ValueError):
+            gisio.message('No checkpoint ' + filename + ', starting from the beginning')
+            return checkpoint
+        if saved.get('version') != VERSION or saved.get('key') != checkpoint.key:
+            gisio.warn('Parameters or inputs changed since checkpoint ' + filename + ' was saved, starting from '
+                       'the beginning')
+            return checkpoint
+        checkpoint.units = saved['units']
+        checkpoint.outputs = saved['outputs']
+        gisio.message('Resuming from checkpoint ' + filename)
+        return checkpoint
+
+    def save(self):
+        # Written to a temporary file first so an interrupted save doesn't lose the checkpoint
+        temp_file = self.filename + '.tmp'
+        with open(temp_file, 'w') as outfile:
+            json.dump({'version': VERSION, 'key': self.key, 'units': self.units, 'outputs': self.outputs}, outfile)
+        gisio.replace_file(temp_file, self.filename)
+
+    def remove(self):
+        """ Deletes the checkpoint file, call when the run is finished """
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def is_done(self, unit, outfile=None):
+        """ Returns True if unit, of outfile if given, is finished """
+        if outfile is None:
+            return unit in self.units
+        return outfile in self.outputs and unit in self.outputs[outfile]['units']
+
+    def mark_done(self, unit):
+        """ Records run level unit, e.g. an output written by another tool, as finished """
+        with self.lock:
+            self.units.append(unit)
+            self.save()
+
+    def has_output(self, outfile):
+        """ Returns True if outfile was started by the run this checkpoint was resumed from """
+        return outfile in self.outputs
+
+    def resume_output(self, backend, outfile):
+        """
+        Truncates outfile to the features of its finished units. Returns True if the tool should append to
+        outfile, False if it should create it, e.g. when no features were recorded or the output can't be
+        truncated.
+        """
+        output = self.outputs.get(outfile)
+        if output is not None and backend.exists(outfile):
+            try:
+                backend.truncate(outfile, output['features'])
+            except gisio.OutputError as e:
+                gisio.warn('Unable to resume ' + outfile + ', creating it again: ' + str(e))
+                backend.delete(outfile)
+            else:
+                gisio.message('Resuming {} after {} features'.format(outfile, output['features']))
+                self.start_features[outfile] = output['features']
+                return True
+        self.outputs[outfile] = {'features': 0, 'units': []}
+        self.start_features[outfile] = 0
+        return False
+
+    def complete(self, unit, writer, outfile):
+        """ Records unit of outfile as finished once writer, a gisio.BulkWriter, has written its features """
+        writer.checkpoint(functools.partial(self._written, outfile, unit))
+
+    def _written(self, outfile, unit, features):
+        with self.lock:
+            output = self.outputs[outfile]
+            output['units'].append(unit)
+            output['features'] = self.start_features[outfile] + features
+            self.save()
+
+
+def iter_chunks(progress, items, writer, outfile, chunk_size=CHUNK_SIZE):
+    """
+    Yields items, skipping chunks of chunk_size items that are finished. A chunk is recorded as finished when
+    the item after it is requested, i.e. when the caller has given all features of the chunk to writer.
+
+    :param progress: Checkpoint, or None to yield every item
+    """
+    if progress is None:
+        for item in items:
+            yield item
+        return
+    unit = None
+    skip = False
+    for index, item in enumerate(items):
+        if index % chunk_size == 0:
+            if unit is not None and not skip:
+                progress.complete(unit, writer, outfile)
+            unit = 'chunk {}'.format(index // chunk_size)
+            skip = progress.is_done(unit, outfile)
+        if not skip:
+            yield item
+    if unit is not None and not skip:
+        progress.complete(unit, writer, outfile)
@@ -1,6 +1,6 @@
 """
 Uses HEC-RAS output to create floodplain extents as points. Includes interface to 
-ArcGIS toolbox.
+ArcGIS toolbox. This module handles GIS I/O through gisio, extents are imported and corrected in extents_core.py
 
 Mike Bannister
 mike.bannister@respec.com
@@ -8,207 +8,361 @@ mike.bannister@respec.com
 version 0.11
 """
 
-import arcpy
-import os, sys
 import collections
-import math
-path = os.path.join(os.path.dirname(__file__), '../parserasgeo')
-sys.path.insert(0, path)
-import parserasgeo as prg
-
-WS_extent = collections.namedtuple('WS_extent', ['river', 'reach', 'XS_ID', 'profile', 'left_sta', 'right_sta', 'WSEL'])
-
-def import_extents(infilename):
-    """
-    Import floodplain extents or bank stations from infilename. infilname is CSV in rasupdatesec format and may
-    start with the River column, or just the Reach column if using single reach output.
-    """
-    extents_list=[]
-    first_lap = True
-    with open(infilename) as infile:
-        for line in infile:
-            # Ignore header if it exists
-            if first_lap == True:
-                fields = line.strip().split(',')
-                if fields[0].find('River') > -1 or fields[0].find('Reach') > -1:  # Compatibility with '\xef\xbb\xbf' for UTF-8
-                    line = next(infile)
-                    line = next(infile)
-                first_lap = False
-            
-            # Process remaining lines
-            if line != '\n' and line[:6] != ',,,,,,' and line[:5] != ',,,,,':
-                fields = line.strip().split(',')
-                # Starts with 'River'
-                if len(fields) == 7:
-                    arcpy.AddMessage(str(fields))
-                    xs_id = float(fields[2].split()[0])  # Strip name from xs ID if present
-                    new_extent = WS_extent(fields[0], fields[1], xs_id, fields[3], float(fields[4]), 
-                                float(fields[5]), float(fields[6]))
-                # Starts with 'Reach'
-                elif len(fields) == 6:
-                    arcpy.AddMessage(str(fields))
-                    xs_id = float(fields[1].split()[0])  # Strip name from xs ID if present
-                    new_extent = WS_extent('Unknown', fields[0], xs_id, fields[2], float(fields[3]), 
-                            float(fields[4]), float(fields[5]))
-                else:
-                    arcpy.AddError('Error in line:' + line.strip() +
-                        '\nInput .csv must be in format: [River], Reach, XS_ID, Profile, Left Sta, Right Sta, ' +
-                        'WSEL. Exiting.')
-                    sys.exit()
-                extents_list.append(new_extent)
-    return extents_list
+import os, sys
+
+import numpy as np
+
+import gisio
+import gpkg
+import input_cache
+import rashdf
+import review_core
+import shparrays
+import extents_core
+from extents_core import WS_extent, import_extents, same_cross_section, correct_extents, import_wsel, \
+    extents_from_geometry
 
+extents_core.message = gisio.message
+extents_core.warn = gisio.warn
+extents_core.error = gisio.error
 
-def same_cross_section(XS_1, XS_2, round_stationing, round_digits):
-    """ 
-    Compare cross section ID's, possibly rounding them
-    XS_1, XS_2:     cross section ID's (float)
-    round_stationing: boolean, round yes/no?
-    round_digits:   Number of digits to round to
+EXTENT_FIELDS = [gisio.text_field('River'),
+                 gisio.text_field('Reach'),
+                 gisio.double_field('XS_ID'),
+                 gisio.text_field('Profile'),
+                 gisio.text_field('Position'),
+                 gisio.float_field('Elevation'),
+                 gisio.text_field('Layer')]
+# Number of extents written at once
+WRITE_BATCH = 10000
+
+FLOODPLAIN_FIELDS = [gisio.text_field('River'),
+                     gisio.text_field('Reach'),
+                     gisio.text_field('Profile'),
+                     gisio.double_field('Down_XS'),
+                     gisio.double_field('Up_XS'),
+                     gisio.text_field('Layer')]
+
+
+def create_WS_extents(extents_file, XSfilename, XS_ID_field, round_stationing, round_digits, geo_file, full_outfilename,
+                      backend=None, per_profile=False):
     """
-    if round_stationing:
-        if round(XS_1, round_digits) == round(XS_2, round_digits):
-            return True
-        else:
-            return False
-    else:
-        if XS_1 == XS_2:
-            return True
-        else:
-            return False
-        
-   
-def create_WS_extents(extents_file, XSfilename, XS_ID_field, round_stationing, round_digits, geo_file, full_outfilename):
-    arcpy.SetProgressor("default", "Preparing to create RAS extents...")
-    arcpy.AddMessage('Importing extents... ')
-    extents_list = import_extents(extents_file)
-
-    outfilename = os.path.basename(full_outfilename)
-    outfilepath = os.path.dirname(full_outfilename)
-    
-    try:
-        arcpy.AddMessage('Creating empty output shapefile: '+full_outfilename)
-        spatial_reference = arcpy.Describe(XSfilename).spatialReference
-        arcpy.CreateFeatureclass_management(outfilepath, outfilename, 'POINT', '', '', '', spatial_reference)
-        arcpy.AddField_management(full_outfilename, 'River', 'STRING')
-        arcpy.AddField_management(full_outfilename, 'Reach', 'STRING')
-        arcpy.AddField_management(full_outfilename, 'XS_ID', 'DOUBLE')
-        arcpy.AddField_management(full_outfilename, 'Profile', 'STRING')
-        arcpy.AddField_management(full_outfilename, 'Position', 'STRING')
-        arcpy.AddField_management(full_outfilename, 'Elevation', 'FLOAT')
-        arcpy.AddField_management(full_outfilename, 'Layer', 'STRING')
-    except:
-        arcpy.AddError('Unable to create '+full_outfilename+'. Is the shape file open in another program or is the ' + 
-            'workspace being edited?')
-        sys.exit()
+    :param extents_file: csv of HEC-RAS extents, or HEC-RAS plan results .hdf with extent stations
+    :param per_profile: write one output per profile, see profile_filename()
+    """
+    backend = gisio.get_backend(backend)
+    gisio.set_progressor("default", "Preparing to create RAS extents...")
+    gisio.message('Importing extents... ')
+    extents_list = _import_extents(extents_file)
+    outputs = _profile_outputs(extents_list, full_outfilename, per_profile)
+    for filename in outputs.values():
+        _setup_output(backend, XSfilename, filename)
 
     # Correct for skew and offset
     if geo_file != '':
         correct_extents(geo_file, extents_list, round_digits)
-        
-    arcpy.SetProgressor("step", "Creating extents points..." , 0, 100, 10)
-    arcpy.AddMessage('Populating output shapefile... ')
+    write_extents(backend, extents_list, XSfilename, XS_ID_field, round_stationing, round_digits, full_outfilename,
+                  extents_file, per_profile)
+
+
+def create_WS_extents_from_geometry(wsel_file, XSfilename, XS_ID_field, round_stationing, round_digits, geo_file,
+                                    full_outfilename, wetted=extents_core.OUTERMOST, backend=None, per_profile=False):
+    """
+    Creates extents from the RAS geometry sta/elev points and a csv of water surface elevations for any number
+    of profiles, without exporting extents from RAS
+
+    :param wsel_file: csv of HEC-RAS profile output, see extents_core.import_wsel(), or HEC-RAS plan results .hdf
+    :param wetted: extents_core.OUTERMOST or extents_core.ALL_SEGMENTS
+    :param per_profile: write one output per profile, see profile_filename()
+    """
+    backend = gisio.get_backend(backend)
+    gisio.set_progressor("default", "Preparing to create RAS extents...")
+    gisio.message('Importing water surface elevations... ')
+    if rashdf.is_plan_file(wsel_file):
+        wsel_list = input_cache.plan_results(wsel_file).ws_elevations()
+    else:
+        wsel_list = import_wsel(wsel_file)
+    outputs = _profile_outputs(wsel_list, full_outfilename, per_profile)
+    for filename in outputs.values():
+        _setup_output(backend, XSfilename, filename)
+
+    gisio.message('Calculating extents from HEC-RAS geometry... ')
+    extents_list = extents_from_geometry(geo_file, wsel_list, round_digits, wetted)
+    write_extents(backend, extents_list, XSfilename, XS_ID_field, round_stationing, round_digits, full_outfilename,
+                  wsel_file, per_profile)
+
+
+def _import_extents(extents_file):
+    """ Returns list of WS_extent from a csv of extents or the extent stations of a HEC-RAS plan results .hdf """
+    if not rashdf.is_plan_file(extents_file):
+        return import_extents(extents_file)
+    extents_list = input_cache.plan_results(extents_file).ws_extents()
+    if extents_list is None:
+        gisio.error(extents_file + ' does not have water surface extent stations, add them to the RAS output '
+                    'variables or calculate extents with the geometry file')
+        sys.exit()
+    return extents_list
+
+
+def profile_filename(full_outfilename, profile):
+    """
+    Returns output name for one profile, the profile is appended to the shapefile or GeoPackage layer name
+    with characters other than letters, numbers, '-' and '_' replaced, e.g. 'ext.shp', '1% Chance' gives
+    'ext_1_Chance.shp'
+    """
+    suffix = ''.join(char if char.isalnum() or char in '-_' else '_' for char in profile.strip())
+    suffix = '_'.join(part for part in suffix.split('_') if part)
+    if gpkg.is_geopackage(full_outfilename):
+        database, layer = gpkg.split_layer(full_outfilename)
+        return database + '/' + layer + '_' + suffix
+    base, ext = os.path.splitext(full_outfilename)
+    return base + '_' + suffix + ext
+
+
+def _profile_outputs(rows, full_outfilename, per_profile):
+    """
+    Returns OrderedDict of profile: output name for the profiles of rows in order, {None: full_outfilename}
+    if not per_profile
+    """
+    outputs = collections.OrderedDict()
+    if not per_profile:
+        outputs[None] = full_outfilename
+        return outputs
+    used = set()
+    for row in rows:
+        if row.profile in outputs:
+            continue
+        filename = profile_filename(full_outfilename, row.profile)
+        # Profiles that only differ in replaced characters
+        number = 2
+        while filename.lower() in used:
+            filename = profile_filename(full_outfilename, '{}_{}'.format(row.profile, number))
+            number += 1
+        used.add(filename.lower())
+        outputs[row.profile] = filename
+    return outputs
+
+
+def _setup_output(backend, XSfilename, full_outfilename, shape='POINT', fields=EXTENT_FIELDS):
+    try:
+        spatial_reference = backend.spatial_reference(XSfilename)
+        gisio.setup_output(backend, full_outfilename, shape, fields, spatial_reference)
+    except gisio.OutputError:
+        sys.exit()
+
+
+def _extent_key(XS_ID, round_stationing, round_digits):
+    """ Returns key matching cross section ids like same_cross_section() """
+    return round(XS_ID, round_digits) if round_stationing else XS_ID
+
+
+def _extent_arrays(extents, points):
+    """
+    Returns shparrays.FeatureArrays of EXTENT_FIELDS for extents
+    :param extents: list of WS_extent
+    :param points: (2 * len(extents), 2) array, left and right point of each extent
+    """
+    def column(values, dtype):
+        # Left and right point share the attributes of their extent
+        return np.repeat(np.array(values, dtype=dtype), 2)
+
+    offsets = np.arange(len(points) + 1, dtype=np.int64)
+    # Text columns as unicode arrays are encoded in bulk by the shapefile writer
+    profiles = column([row.profile for row in extents], 'U')
+    columns = {'River': column([row.river for row in extents], 'U'),
+               'Reach': column([row.reach for row in extents], 'U'),
+               'XS_ID': column([row.XS_ID for row in extents], float),
+               'Profile': profiles,
+               'Position': np.tile(np.array(['left', 'right'], dtype='U'), len(extents)),
+               'Elevation': column([row.WSEL for row in extents], float),
+               'Layer': profiles}
+    return shparrays.FeatureArrays(shparrays.POINT, np.asarray(points, dtype=float).reshape(-1, 2), offsets, offsets,
+                                   columns)
+
+
+def _write_pending(writers, extents, points):
+    """
+    Writes extents to their profile's writer
+    :param writers: dict of profile: gisio.BulkWriter, {None: writer} for one output
+    :param points: (2 * len(extents), 2) array of left and right points
+    """
+    if None in writers:
+        writers[None].write_arrays(_extent_arrays(extents, points))
+        return
+    by_profile = collections.OrderedDict()
+    for i, row in enumerate(extents):
+        by_profile.setdefault(row.profile, []).append(i)
+    points = points.reshape(-1, 2, 2)
+    for profile, rows in by_profile.items():
+        writers[profile].write_arrays(_extent_arrays([extents[i] for i in rows], points[rows].reshape(-1, 2)))
+
 
+def _close_writers(writers):
+    """ Closes all writers, raises the first error after all are closed """
+    first_error = None
+    for writer in writers:
+        try:
+            writer.close()
+        except Exception as e:
+            if first_error is None:
+                first_error = e
+    if first_error is not None:
+        raise first_error
+
+
+def write_extents(backend, extents_list, XSfilename, XS_ID_field, round_stationing, round_digits, full_outfilename,
+                  source_name, per_profile=False):
+    """
+    Writes left and right points of extents_list along the cross sections in XSfilename. Each cut line's
+    stationing is calculated once and all extents of the cross section are placed together.
+
+    :param per_profile: write each profile to its own output, see profile_filename(), outputs must exist.
+        The outputs are written concurrently by their bulk writers.
+    """
+    gisio.set_progressor("step", "Creating extents points..." , 0, 100, 10)
+    gisio.message('Populating output shapefile... ')
+
+    # Extents of each cross section id, in extents_list order
+    extents_by_XS = {}
+    for row in extents_list:
+        extents_by_XS.setdefault(_extent_key(row.XS_ID, round_stationing, round_digits), []).append(row)
+    outputs = _profile_outputs(extents_list, full_outfilename, per_profile)
+
+    field_names = [field.name for field in EXTENT_FIELDS]
+    writers = collections.OrderedDict()
+    XS_ID = None
     try:
         total_extents = len(extents_list)
         current_extent = 0
         extents_created = []
-        with arcpy.da.SearchCursor(XSfilename, ['SHAPE@', XS_ID_field]) as XS_cursor:
-            with arcpy.da.InsertCursor(full_outfilename, ['SHAPE@', 'River', 'Reach', 'XS_ID', 'Profile', 
-                'Position', 'Elevation', 'Layer']) as extent_cursor:
-                
-                # Loop through all XS in shapefile
-                for cross_section in XS_cursor:
-                    # loop through all extents
-                    for row in extents_list:
-                        if same_cross_section(row.XS_ID, cross_section[1], round_stationing, round_digits):
-                            #Have a match, create extents
-                            geo = cross_section[0]
-                            left_point = geo.positionAlongLine(row.left_sta, False)
-                            right_point = geo.positionAlongLine(row.right_sta, False)
-                            extent_cursor.insertRow([left_point, row.river, row.reach, row.XS_ID, row.profile, 
-                                'left', row.WSEL, row.profile])
-                            extent_cursor.insertRow([right_point, row.river, row.reach, row.XS_ID, row.profile, 
-                                'right', row.WSEL, row.profile])
-
-                            #Keep track of created extents and update progress bar
-                            extents_created.append(row.XS_ID)
-                            if current_extent % (int(total_extents/10)) == 0:
-                                arcpy.SetProgressorPosition()
-                            current_extent += 1
+        # Extents and their points not written yet
+        pending_extents, pending_points = [], []
+        for profile, filename in outputs.items():
+            writers[profile] = backend.open_bulk_writer(filename, field_names)
+        # Loop through all XS in shapefile
+        XS_arrays = input_cache.feature_arrays(backend, XSfilename, [XS_ID_field])
+        XS_stations = input_cache.line_stations(backend, XSfilename, [XS_ID_field])
+        for i, (geo, (XS_ID,)) in enumerate(XS_arrays.iter_features()):
+            matches = extents_by_XS.get(_extent_key(XS_ID, round_stationing, round_digits))
+            if not matches:
+                continue
+            coords = geo[0]
+            start = XS_arrays.part_offsets[XS_arrays.feature_offsets[i]]
+            stations = XS_stations[start:start + len(coords)]
+            # Left and right points of all extents of the cross section at once
+            points = review_core.position_along_line(coords, stations, [sta for row in matches for sta in
+                                                                        (row.left_sta, row.right_sta)])
+            pending_extents.extend(matches)
+            pending_points.append(points)
+            if len(pending_extents) >= WRITE_BATCH:
+                _write_pending(writers, pending_extents, np.vstack(pending_points))
+                pending_extents, pending_points = [], []
+
+            #Keep track of created extents and update progress bar
+            for row in matches:
+                extents_created.append(row.XS_ID)
+                if current_extent % max(1, int(total_extents/10)) == 0:
+                    gisio.set_progressor_position()
+                current_extent += 1
+        if pending_extents:
+            _write_pending(writers, pending_extents, np.vstack(pending_points))
+        # Close every writer even if one fails, the first error is raised
+        closing = list(writers.values())
+        writers.clear()
+        _close_writers(closing)
     except:
-        arcpy.AddError('Error creating water surface extents at cross section '+str(row.XS_ID)+'\n')
+        gisio.error('Error creating water surface extents at cross section '+str(XS_ID)+'\n')
+        try:
+            _close_writers(writers.values())
+        except Exception:
+            pass
         raise
 
-    arcpy.AddMessage(str(len(extents_created)) + ' extent pairs (left/right) created out of ' + str(total_extents) + 
-                    ' total extent pairs in ' + extents_file)
+    gisio.message(str(len(extents_created)) + ' extent pairs (left/right) created out of ' + str(total_extents) + 
+                    ' total extent pairs in ' + source_name)
     if current_extent < total_extents:
         # arcpy.AddWarning('totatl_extents='+str(total_extents)+', current_extent='+str(current_extent))
         missing_XS = []
+        created = set(extents_created)
         for row in extents_list:
-            if (not row.XS_ID in extents_created) and (not row.XS_ID in missing_XS):
+            if (not row.XS_ID in created) and (not row.XS_ID in missing_XS):
                 missing_XS.append(row.XS_ID)
         missing_string = ', '.join([str(XS) for XS in missing_XS])        
         # TODO - This is a hack, we should never be, but, the count in current_extent gets off when there are
         #       multiple XSs with the same name. This may be fixed by current_extent < total_extents above
         if len(missing_XS) > 0:
-            arcpy.AddWarning('Extents were listed in ' + extents_file + ' but not created for the following missing '+
+            gisio.warn('Extents were listed in ' + source_name + ' but not created for the following missing '+
                     str(len(missing_XS))+' cross sections: ' + missing_string)
 
 
-def correct_extents(geo_file, extents_list, round_digits):
-    """ 
-    Correct extents for skew and offset
-    :param geo_file: - name of RAS geometry file
-    :param extents_list: - list of extents from import_extents()
-    :param round_digits: - digits to round xs ids to
-    """   
-    ras_geo = prg.ParseRASGeo(geo_file)
-    
-    if round_digits != 0 and round_digits != '':
-        rnd = True
-    else:
-        rnd = False
+def create_floodplain_polygons(extents_filename, full_outfilename, backend=None, graph=None):
+    """
+    Stitches extents points, the output of create_WS_extents(), into a floodplain boundary polygon for every
+    river, reach, and profile. RAS reaches don't share cross sections, so without graph each reach polygon
+    ends at its last cross section and there's a gap at every junction.
 
-    for i, ex in enumerate(extents_list):
-        # Pull info from RAS geometry file
-        try:
-            if rnd:
-                geo_xs = ras_geo.return_xs_by_id(float(ex.XS_ID), rnd=rnd, digits=round_digits)
-            else:
-                geo_xs = ras_geo.return_xs_by_id(float(ex.XS_ID))
-        except prg.CrossSectionNotFound:
-            arcpy.AddWarning('Cross section '+ ex.river + '/' + ex.reach + '-' + str(ex.XS_ID) + ' is in cross ' +
-                    'section shapefile but is not in RAS geometry file. Skipping')
-            continue
+    :param extents_filename: extents point shapefile or GeoPackage layer
+    :param full_outfilename: polygon output
+    :param graph: optional reach_graph.ReachGraph, each reach polygon is extended to the upstream most cross
+        section of its downstream reach to close the junction gap. Where a reach splits, the first downstream
+        reach is used.
+    """
+    backend = gisio.get_backend(backend)
+    gisio.message('Reading extents points... ')
+    fields = ['River', 'Reach', 'XS_ID', 'Profile', 'Position']
+    points = input_cache.feature_arrays(backend, extents_filename, fields)
+    keys = list(zip(points.column('River').tolist(), points.column('Reach').tolist(),
+                    points.column('Profile').tolist()))
+    # Group number of every river/reach/profile in the order they first appear
+    group_numbers = {}
+    groups = np.array([group_numbers.setdefault(key, len(group_numbers)) for key in keys], dtype=np.int64)
+    group_keys = sorted(group_numbers, key=group_numbers.get)
+    right = np.array([str(position).strip().lower() == 'right' for position in points.column('Position').tolist()],
+                     dtype=bool)
+    # Points without geometry can't be stitched
+    has_point = np.diff(points.feature_offsets) > 0
+    coords = np.zeros((len(points), 2))
+    coords[has_point] = points.coords[points.part_offsets[points.feature_offsets[:-1][has_point]]]
+    xs_ids = points.column('XS_ID').astype(float)
+    groups, xs_ids, right, coords = groups[has_point], xs_ids[has_point], right[has_point], coords[has_point]
 
-        offset = geo_xs.sta_elev.points[0][0]
-        skew = geo_xs.skew.angle
-        
-        # if nothing changes, skip this extent
-        if offset == 0 and skew is None:
-            continue
+    if graph is not None:
+        stripped = dict(((river.strip(), reach.strip(), profile), group) for (river, reach, profile), group in
+                        group_numbers.items())
+        downstream = {}
+        for (river, reach, profile), group in stripped.items():
+            down = graph.downstream.get((river, reach))
+            if down and down[0] + (profile,) in stripped:
+                downstream[group] = stripped[down[0] + (profile,)]
+        gisio.message('Closing {} junction gaps... '.format(len(downstream)))
+        groups, xs_ids, right, coords = extents_core.junction_points(downstream, groups, xs_ids, right, coords)
 
-        left_sta = ex.left_sta
-        right_sta = ex.right_sta
+    gisio.message('Stitching floodplain boundaries... ')
+    ring_groups, offsets, ring_coords, lowest, highest = extents_core.floodplain_rings(groups, xs_ids, right, coords)
+    if len(ring_groups) < len(group_keys):
+        gisio.warn(str(len(group_keys) - len(ring_groups)) + ' river/reach/profiles have less than two cross ' +
+                   'sections with left and right extents. No polygons were created for them')
 
-        if offset != 0:
-            arcpy.AddWarning('Correcting offset of ' + str(offset) + ' at XS ' + ex.river + '/' + ex.reach + '-' +
-                    str(ex.XS_ID))
-            left_sta = left_sta - offset
-            right_sta = right_sta - offset
-        if skew is not None:
-            arcpy.AddWarning('Correcting skew of ' + str(skew) + ' at XS ' + ex.river + '/' + ex.reach + '-' +
-                    str(ex.XS_ID))
-            left_sta = left_sta/math.cos(math.radians(skew))
-            right_sta = right_sta/math.cos(math.radians(skew))
+    ring_keys = [group_keys[group] for group in ring_groups.tolist()]
+    profiles = np.array([key[2] for key in ring_keys], dtype=object)
+    columns = {'River': np.array([key[0] for key in ring_keys], dtype=object),
+               'Reach': np.array([key[1] for key in ring_keys], dtype=object),
+               'Profile': profiles,
+               'Down_XS': lowest,
+               'Up_XS': highest,
+               'Layer': profiles}
+    feature_offsets = np.arange(len(ring_groups) + 1, dtype=np.int64)
+    polygons = shparrays.FeatureArrays(shparrays.POLYGON, ring_coords, offsets, feature_offsets, columns)
 
-        # Create new, corrected extent and replace the old one
-        fixed = WS_extent(ex.river, ex.reach, ex.XS_ID, ex.profile, left_sta, right_sta, ex.WSEL)
-        extents_list[i] = fixed
+    _setup_output(backend, extents_filename, full_outfilename, 'POLYGON', FLOODPLAIN_FIELDS)
+    with backend.open_bulk_writer(full_outfilename, [field.name for field in FLOODPLAIN_FIELDS]) as writer:
+        writer.write_arrays(polygons)
+    gisio.message(str(len(ring_groups)) + ' floodplain polygons created from ' + extents_filename)
 
 
 def main():
+    import arcpy
     extents_file = arcpy.GetParameterAsText(0)
     cross_sections = arcpy.GetParameterAsText(1)
     XS_ID_field = arcpy.GetParameterAsText(2)
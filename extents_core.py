@@ -0,0 +1,374 @@
+"""
+Compute core for extents-script.py. Imports floodplain extents from HEC-RAS output and corrects them
+for cross section skew and offset without arcpy. Extents can also be calculated from the RAS geometry
+sta/elev points and a table of water surface elevations, see extents_from_geometry(). Extents points are
+stitched into floodplain boundary polygons by floodplain_rings().
+"""
+
+import collections
+import sys
+
+import numpy as np
+
+WS_extent = collections.namedtuple('WS_extent', ['river', 'reach', 'XS_ID', 'profile', 'left_sta', 'right_sta', 'WSEL'])
+WS_elevation = collections.namedtuple('WS_elevation', ['river', 'reach', 'XS_ID', 'profile', 'WSEL'])
+
+# Extents calculated from geometry: outer most water surface intercepts or every wetted segment
+OUTERMOST = 'outermost'
+ALL_SEGMENTS = 'all'
+
+
+# The following 3 functions may be overridden for use with arcpy, etc.
+def message(text):
+    print(text)
+
+
+def warn(text):
+    print(text)
+
+
+def error(text):
+    print(text)
+
+
+def import_extents(infilename):
+    """
+    Import floodplain extents or bank stations from infilename. infilname is CSV in rasupdatesec format and may
+    start with the River column, or just the Reach column if using single reach output.
+    """
+    extents_list=[]
+    first_lap = True
+    with open(infilename) as infile:
+        for line in infile:
+            # Ignore header if it exists
+            if first_lap == True:
+                fields = line.strip().split(',')
+                if fields[0].find('River') > -1 or fields[0].find('Reach') > -1:  # Compatibility with '\xef\xbb\xbf' for UTF-8
+                    line = next(infile)
+                    line = next(infile)
+                first_lap = False
+            
+            # Process remaining lines
+            if line != '\n' and line[:6] != ',,,,,,' and line[:5] != ',,,,,':
+                fields = line.strip().split(',')
+                # Starts with 'River'
+                if len(fields) == 7:
+                    message(str(fields))
+                    xs_id = float(fields[2].split()[0])  # Strip name from xs ID if present
+                    new_extent = WS_extent(fields[0], fields[1], xs_id, fields[3], float(fields[4]), 
+                                float(fields[5]), float(fields[6]))
+                # Starts with 'Reach'
+                elif len(fields) == 6:
+                    message(str(fields))
+                    xs_id = float(fields[1].split()[0])  # Strip name from xs ID if present
+                    new_extent = WS_extent('Unknown', fields[0], xs_id, fields[2], float(fields[3]), 
+                            float(fields[4]), float(fields[5]))
+                else:
+                    error('Error in line:' + line.strip() +
+                        '\nInput .csv must be in format: [River], Reach, XS_ID, Profile, Left Sta, Right Sta, ' +
+                        'WSEL. Exiting.')
+                    sys.exit()
+                extents_list.append(new_extent)
+    return extents_list
+
+
+def same_cross_section(XS_1, XS_2, round_stationing, round_digits):
+    """ 
+    Compare cross section ID's, possibly rounding them
+    XS_1, XS_2:     cross section ID's (float)
+    round_stationing: boolean, round yes/no?
+    round_digits:   Number of digits to round to
+    """
+    if round_stationing:
+        if round(XS_1, round_digits) == round(XS_2, round_digits):
+            return True
+        else:
+            return False
+    else:
+        if XS_1 == XS_2:
+            return True
+        else:
+            return False
+
+
+def correct_extents(geo_file, extents_list, round_digits):
+    """ 
+    Correct extents for skew and offset
+    :param geo_file: - name of RAS geometry file
+    :param extents_list: - list of extents from import_extents()
+    :param round_digits: - digits to round xs ids to
+    """   
+    import input_cache
+    import rasgeo
+    import skew_offset
+    ras_geo = input_cache.ras_geometry(geo_file)
+    
+    if round_digits != 0 and round_digits != '':
+        rnd = True
+    else:
+        rnd = False
+
+    # Pull info from RAS geometry file
+    cross_sections = []
+    for ex in extents_list:
+        try:
+            if rnd:
+                geo_xs = ras_geo.return_xs_by_id(float(ex.XS_ID), rnd=rnd, digits=round_digits,
+                                                 blocks=(rasgeo.STA_ELEV, rasgeo.SKEW))
+            else:
+                geo_xs = ras_geo.return_xs_by_id(float(ex.XS_ID), blocks=(rasgeo.STA_ELEV, rasgeo.SKEW))
+        except rasgeo.CrossSectionNotFound:
+            warn('Cross section '+ ex.river + '/' + ex.reach + '-' + str(ex.XS_ID) + ' is in cross ' +
+                    'section shapefile but is not in RAS geometry file. Skipping')
+            geo_xs = None
+        cross_sections.append(geo_xs)
+
+    # Correct all extents at once
+    offsets, skews = skew_offset.corrections(cross_sections)
+    stations = np.array([(ex.left_sta, ex.right_sta) for ex in extents_list], dtype=float).reshape(-1, 2)
+    corrected = skew_offset.correct_stations(stations, offsets[:, np.newaxis], skews[:, np.newaxis])
+
+    for i, ex in enumerate(extents_list):
+        # if nothing changes, skip this extent
+        if cross_sections[i] is None or (offsets[i] == 0 and skews[i] == 0):
+            continue
+
+        if offsets[i] != 0:
+            warn('Correcting offset of ' + str(offsets[i]) + ' at XS ' + ex.river + '/' + ex.reach + '-' +
+                    str(ex.XS_ID))
+        if skews[i] != 0:
+            warn('Correcting skew of ' + str(skews[i]) + ' at XS ' + ex.river + '/' + ex.reach + '-' +
+                    str(ex.XS_ID))
+
+        # Create new, corrected extent and replace the old one
+        left_sta, right_sta = corrected[i].tolist()
+        fixed = WS_extent(ex.river, ex.reach, ex.XS_ID, ex.profile, left_sta, right_sta, ex.WSEL)
+        extents_list[i] = fixed
+
+
+def import_wsel(infilename):
+    """
+    Import water surface elevations from infilename. infilename is a CSV of the HEC-RAS profile output
+    table in format: [River], Reach, River Sta, Profile, W.S. Elev, other columns are ignored. The RAS
+    table header and culvert/bridge lines without a water surface elevation are skipped.
+    """
+    wsel_list = []
+    with open(infilename) as infile:
+        lines = [line.strip() for line in infile]
+    # Only single reach output starts with the Reach column
+    has_river = not (lines and lines[0].split(',')[0].find('Reach') > -1)
+    for line in lines:
+        fields = line.split(',')
+        if not has_river:
+            fields = ['Unknown'] + fields
+        if line == '' or len(fields) < 5:
+            continue
+        try:
+            xs_id = float(fields[2].split()[0])  # Strip name from xs ID if present
+            wsel = float(fields[4])
+        except (ValueError, IndexError):
+            # Header, units, or a line without a water surface elevation
+            continue
+        wsel_list.append(WS_elevation(fields[0], fields[1], xs_id, fields[3], wsel))
+    return wsel_list
+
+
+def _intercepts(stations, elevations, wsels, first, second):
+    """ Returns station where water surface wsels crosses the ground between points first and second """
+    station = stations[first]
+    elevation = elevations[first]
+    return station + (wsels - elevation) * (stations[second] - station) / (elevations[second] - elevation)
+
+
+def wetted_segments(stations, elevations, wsels):
+    """
+    Finds the water surface intercepts of a ground profile for several water surfaces at once. Ground below
+    the water surface is wet, the water surface is extended vertically at the ends of the ground profile.
+
+    :param stations: array of ground stations
+    :param elevations: array of ground elevations
+    :param wsels: array of water surface elevations, e.g. one per profile
+    :return: (profiles, left stations, right stations) arrays with one value per wetted segment, profiles
+        is the index into wsels, segments are sorted by profile then station. Dry profiles have no segments.
+    """
+    stations = np.asarray(stations, dtype=float)
+    elevations = np.asarray(elevations, dtype=float)
+    wsels = np.asarray(wsels, dtype=float)
+    last_point = len(stations) - 1
+
+    wet = np.zeros((len(wsels), len(stations) + 2), dtype=np.int8)
+    wet[:, 1:-1] = elevations[np.newaxis, :] < wsels[:, np.newaxis]
+    change = np.diff(wet, axis=1)
+    # First wet point and last wet point + 1 of each segment, both are in profile then station order
+    profiles, first_wet = np.nonzero(change == 1)
+    last_wet = np.nonzero(change == -1)[1] - 1
+    segment_wsels = wsels[profiles]
+
+    lefts = np.full(len(profiles), stations[0] if len(stations) else np.nan)
+    inside = first_wet > 0
+    lefts[inside] = _intercepts(stations, elevations, segment_wsels[inside], first_wet[inside] - 1,
+                                first_wet[inside])
+    rights = np.full(len(profiles), stations[-1] if len(stations) else np.nan)
+    inside = last_wet < last_point
+    rights[inside] = _intercepts(stations, elevations, segment_wsels[inside], last_wet[inside],
+                                 last_wet[inside] + 1)
+    return profiles, lefts, rights
+
+
+def outermost_segments(profiles, lefts, rights):
+    """ Returns (profiles, left stations, right stations) of the outer most extents of each profile """
+    if len(profiles) == 0:
+        return profiles, lefts, rights
+    first = np.flatnonzero(np.concatenate([[True], profiles[1:] != profiles[:-1]]))
+    last = np.concatenate([first[1:] - 1, [len(profiles) - 1]])
+    return profiles[first], lefts[first], rights[last]
+
+
+def extents_from_geometry(geo_file, wsel_list, round_digits, wetted=OUTERMOST):
+    """
+    Calculates extents for water surface elevations in wsel_list from the RAS geometry, all profiles of a
+    cross section are calculated together. Stations are corrected for skew and offset.
+
+    :param geo_file: name of RAS geometry file
+    :param wsel_list: list of WS_elevation from import_wsel()
+    :param round_digits: digits to round xs ids to, 0 or '' to not round
+    :param wetted: OUTERMOST for one extent per profile, ALL_SEGMENTS for one extent per wetted segment
+    :return: list of WS_extent
+    """
+    import input_cache
+    import rasgeo
+    import skew_offset
+    ras_geo = input_cache.ras_geometry(geo_file)
+    rnd = round_digits != 0 and round_digits != ''
+    blocks = (rasgeo.STA_ELEV, rasgeo.SKEW)
+
+    # Group profiles by cross section, keeping the table order
+    cross_sections = collections.OrderedDict()
+    for row in wsel_list:
+        cross_sections.setdefault((row.river, row.reach, row.XS_ID), []).append(row)
+
+    extents_list = []
+    dry = 0
+    for (river, reach, xs_id), rows in cross_sections.items():
+        try:
+            if river == 'Unknown':
+                geo_xs = ras_geo.return_xs_by_id(xs_id, rnd=rnd, digits=round_digits, blocks=blocks)
+            else:
+                geo_xs = ras_geo.return_xs(xs_id, river, reach, rnd=rnd, digits=round_digits, blocks=blocks)
+        except rasgeo.CrossSectionNotFound:
+            warn('Cross section ' + river + '/' + reach + '-' + str(xs_id) + ' is in the water surface ' +
+                 'elevation table but is not in RAS geometry file. Skipping')
+            continue
+        points = np.array(geo_xs.sta_elev.points if geo_xs.sta_elev is not None else [], dtype=float)
+        if len(points) == 0:
+            warn('Cross section ' + river + '/' + reach + '-' + str(xs_id) + ' has no station/elevation ' +
+                 'points. Skipping')
+            continue
+
+        profiles, lefts, rights = wetted_segments(points[:, 0], points[:, 1], [row.WSEL for row in rows])
+        if wetted == OUTERMOST:
+            profiles, lefts, rights = outermost_segments(profiles, lefts, rights)
+        dry += len(rows) - len(np.unique(profiles))
+        stations = skew_offset.correct_xs_stations(np.column_stack([lefts, rights]), geo_xs,
+                                                   float(points[0, 0]))
+        for profile, (left_sta, right_sta) in zip(profiles.tolist(), stations.tolist()):
+            row = rows[profile]
+            extents_list.append(WS_extent(row.river, row.reach, row.XS_ID, row.profile, left_sta, right_sta,
+                                          row.WSEL))
+    if dry:
+        warn(str(dry) + ' profiles are below the ground at every station of their cross section. No extents ' +
+             'were created for them')
+    return extents_list
+
+
+def _group_starts(groups):
+    """ Returns index of the first element of each run of equal values in sorted groups """
+    if len(groups) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+
+
+def floodplain_rings(groups, xs_ids, right, coords):
+    """
+    Stitches extents points into one floodplain boundary ring per group, e.g. per river, reach, and profile.
+    Each ring runs up the left extents in cross section id order and back down the right extents. Where a
+    cross section has more than one extent per side (wetted segments) the first left and last right point
+    are used. Cross sections without both a left and right point are skipped, groups need at least two
+    cross sections for a ring.
+
+    :param groups: int array, group of each point
+    :param xs_ids: float array, cross section id of each point
+    :param right: bool array, True for right extents, False for left
+    :param coords: (number of points, 2) array of point coordinates
+    :return: (ring groups, ring offsets, ring coordinates, lowest xs id, highest xs id), ring i is
+        ring_coordinates[ring_offsets[i]:ring_offsets[i + 1]], not closed. Infinite xs ids are left out of the
+        lowest and highest ids.
+    """
+    groups = np.asarray(groups)
+    xs_ids = np.asarray(xs_ids, dtype=float)
+    right = np.asarray(right, dtype=bool)
+    index = np.arange(len(xs_ids))
+
+    # One point per group, side, and cross section: first left point and last right point
+    order = np.lexsort((np.where(right, -index, index), xs_ids, right, groups))
+    g, s, x = groups[order], right[order], xs_ids[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (g[1:] != g[:-1]) | (s[1:] != s[:-1]) | (x[1:] != x[:-1])
+    keep = order[first]
+
+    # Cross sections with both a left and right point
+    g, s, x = groups[keep], right[keep], xs_ids[keep]
+    by_xs = np.lexsort((s, x, g))
+    pair = (g[by_xs][1:] == g[by_xs][:-1]) & (x[by_xs][1:] == x[by_xs][:-1])
+    both = np.zeros(len(keep), dtype=bool)
+    both[by_xs[1:][pair]] = True
+    both[by_xs[:-1][pair]] = True
+    keep, g, s, x = keep[both], g[both], s[both], x[both]
+
+    # Ring order: left side up, right side down
+    ring_order = np.lexsort((np.where(s, -x, x), s, g))
+    keep, g, x = keep[ring_order], g[ring_order], x[ring_order]
+    # Two points per cross section, at least two cross sections per ring
+    starts = _group_starts(g)
+    counts = np.diff(np.concatenate([starts, [len(g)]]))
+    full = np.repeat(counts >= 4, counts)
+    keep, g, x = keep[full], g[full], x[full]
+
+    starts = _group_starts(g)
+    offsets = np.concatenate([starts, [len(keep)]]).astype(np.int64)
+    # Ids of points copied from another reach, e.g. by junction_points(), aren't ids of the ring's reach
+    x = np.where(np.isinf(x), np.nan, x)
+    lowest = np.fmin.reduceat(x, starts) if len(starts) else np.zeros(0)
+    highest = np.fmax.reduceat(x, starts) if len(starts) else np.zeros(0)
+    return g[starts], offsets, np.asarray(coords, dtype=float)[keep], lowest, highest
+
+
+def junction_points(downstream, groups, xs_ids, right, coords):
+    """
+    Returns (groups, xs_ids, right, coords) with the extents of the upstream most cross section of each
+    downstream reach copied to the reach flowing into it, so floodplain_rings() closes the gap between
+    reaches at a junction. Copies get xs id -inf, the downstream end of the upstream reach's ring. Rings of
+    connected reaches overlap over the junction.
+
+    :param downstream: dict of group: group of the downstream reach of the same profile, e.g. from
+        reach_graph.ReachGraph.downstream
+    :param groups, xs_ids, right, coords: extents points, see floodplain_rings()
+    """
+    groups = np.asarray(groups)
+    xs_ids = np.asarray(xs_ids, dtype=float)
+    right = np.asarray(right, dtype=bool)
+    coords = np.asarray(coords, dtype=float)
+    copies = []
+    copy_groups = []
+    for group, down in sorted(downstream.items()):
+        in_down = np.flatnonzero(groups == down)
+        if len(in_down) == 0:
+            continue
+        top = in_down[xs_ids[in_down] == xs_ids[in_down].max()]
+        copies.append(top)
+        copy_groups.append(np.full(len(top), group, dtype=groups.dtype))
+    if not copies:
+        return groups, xs_ids, right, coords
+    copies = np.concatenate(copies)
+    return (np.concatenate([groups] + copy_groups), np.concatenate([xs_ids, np.full(len(copies), -np.inf)]),
+            np.concatenate([right, right[copies]]), np.vstack([coords, coords[copies]]))
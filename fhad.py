@@ -0,0 +1,671 @@
+"""
+Command line interface for the FHAD tools. Each toolbox tool has a subcommand, 'jobs' runs a job file
+listing many projects and tool runs across a pool of worker processes.
+
+    python fhad.py nvalue model.g01 xs.shp XS_ID River Reach n_value.shp
+    python fhad.py lengths model.g01 xs.shp XS_ID River Reach length_audit.csv
+    python fhad.py stations model.g01 station_check.csv
+    python fhad.py allgeo model.g01 xs.shp XS_ID River Reach review_dir
+    python fhad.py allgeo model.g02 xs.shp XS_ID River Reach review_dir --old-geofile model.g01
+    python fhad.py jobs watershed.json --workers 4
+    python fhad.py --project-db boulder.fhaddb bfe bfe.csv channel.shp River Reach bfe.shp
+    python fhad.py grid bfe.shp dem.flt boulder_100yr --river-field River --reach-field Reach --processes 4
+    python fhad.py extents extents.csv xs.shp XS_ID extents.parquet
+
+Any output ending with .parquet is written as a Parquet table with WKB geometry (parquet.py).
+
+allgeo, bfe, and the review tools record finished work in a checkpoint next to their output, a run that
+stopped partway continues where it left off with --resume (checkpoint.py).
+
+Job files are JSON. Keys of a project, other than 'name' and 'jobs', are defaults for each of its jobs.
+Job keys are the long option/argument names of the subcommand with '-' replaced by '_':
+
+    {"workers": 4,
+     "backend": "python",
+     "projects": [
+        {"name": "Boulder Creek",
+         "geofile": "boulder/boulder.g01",
+         "cross_sections": "boulder/xs.shp",
+         "xs_id_field": "XS_ID", "river_field": "River", "reach_field": "Reach",
+         "jobs": [
+            {"tool": "allgeo", "out_dir": "boulder/review"},
+            {"tool": "topwidth", "floodplain": "boulder/fp.shp", "outfile": "boulder/review/tw.shp"},
+            {"tool": "bfe", "bfe_file": "boulder/bfe.csv", "channels": "boulder/channel.shp",
+             "outfile": "boulder/review/bfe.shp"}]}]}
+
+All jobs of a project run in order in the same worker so parsed geometry and cross sections are shared
+(input_cache.py). With --project-db, or a 'project_db' job key, parsed inputs and top widths are also stored
+in a project database file (projectdb.py) and reused by later runs while the input files are unchanged,
+e.g. running bfe, xstest, extents, and allgeo back to back. Each job's messages are written to a log file
+and the status and run time of every job are written to a csv report.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+import checkpoint
+import gisio
+import input_cache
+import projectdb
+import rashdf
+
+OK = 'ok'
+FAILED = 'failed'
+REPORT_FIELDS = ['project', 'job', 'tool', 'status', 'seconds', 'started', 'log', 'error']
+OVER_WRITE = True
+# Parameters naming the input files of checkpointed runs, a checkpoint is only resumed while they're unchanged
+REVIEW_INPUTS = ('geofile', 'cross_sections')
+ALLGEO_INPUTS = ('geofile', 'cross_sections', 'old_geofile')
+BFE_INPUTS = ('bfe_file', 'channels')
+LENGTH_AUDIT = 'length audit'
+
+# Tool modules are loaded on first use, some live in folders with spaces or have hyphenated names
+TOOL_MODULES = {'n_value_review': 'N-value Review/n_value_review.py',
+                'iefa_review': 'IEFA Review/iefa_review.py',
+                'blocked_review': 'Block Obs Review/blocked_review.py',
+                'twcheck': 'TopWidth/twcheck.py',
+                'bfetool': 'bfetool.py',
+                'XStest': 'XStest.py',
+                'extents_script': 'extents-script.py'}
+
+
+def load_tool(name):
+    """ Imports tool module name from TOOL_MODULES """
+    if name in sys.modules:
+        return sys.modules[name]
+    filename = os.path.join(ROOT, TOOL_MODULES[name])
+    folder = os.path.dirname(filename)
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        return imp.load_source(name, filename)
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def file_check(backend, outfile):
+    """
+    Checks if outfile exists and deletes it if OVER_WRITE is true
+    """
+    if backend.exists(outfile):
+        if OVER_WRITE:
+            gisio.warn(outfile + ' exists. Deleting.')
+            backend.delete(outfile)
+        else:
+            gisio.error(outfile + ' exists and over write is turned off!')
+            raise gisio.OutputError(outfile + ' exists and overwrite is turned off')
+
+
+def simplify_tolerance(params):
+    """ Returns the 'simplify' tolerance of params as a float, None if output isn't simplified """
+    return float(params['simplify']) if params.get('simplify') else None
+
+
+def open_checkpoint(params, filename, inputs):
+    """
+    Returns checkpoint.Checkpoint of a run with params, resumed from filename if params has 'resume'
+    :param inputs: names of the parameters that are input files
+    """
+    return checkpoint.Checkpoint.open(filename, params, [params.get(name) for name in inputs],
+                                      bool(params.get('resume')))
+
+
+# ------------------------------------- Tools -------------------------------------
+# Each tool takes a dict of parameters, named like the subcommand arguments, and a gisio backend
+def _run_review(module_name, review_name, params, backend, progress=None, **kwargs):
+    """
+    Runs review function review_name of tool module_name. Progress is recorded in a checkpoint next to the
+    output, or in progress, the checkpoint of an allgeo run.
+    """
+    review_progress = progress or open_checkpoint(params, checkpoint.default_filename(params['outfile']),
+                                                  REVIEW_INPUTS)
+    if not review_progress.has_output(params['outfile']):
+        file_check(backend, params['outfile'])
+    review = getattr(load_tool(module_name), review_name)
+    review(params['geofile'], params['cross_sections'], params['xs_id_field'], params['river_field'],
+           params['reach_field'], params['outfile'], backend=backend, simplify_tolerance=simplify_tolerance(params),
+           progress=review_progress, **kwargs)
+    if progress is None:
+        review_progress.remove()
+
+
+def run_nvalue(params, backend, progress=None):
+    _run_review('n_value_review', 'n_value_review', params, backend, progress, qa_file=params.get('qa_file'))
+
+
+def run_iefa(params, backend, progress=None):
+    _run_review('iefa_review', 'iefa_review', params, backend, progress)
+
+
+def run_blocked(params, backend, progress=None):
+    _run_review('blocked_review', 'obstruction_review', params, backend, progress)
+
+
+def run_lengths(params, backend):
+    import length_audit
+    gisio.message('Auditing cross section lengths...')
+    mismatches = length_audit.audit(params['geofile'], params['cross_sections'], params['xs_id_field'],
+                                    params['river_field'], params['reach_field'],
+                                    float(params.get('tolerance') or length_audit.TOLERANCE), backend=backend)
+    for status, count in length_audit.summary(mismatches).items():
+        if count:
+            gisio.warn('{} cross sections: {}'.format(status, count))
+    length_audit.write_audit(mismatches, params['outfile'])
+
+
+def run_stations(params, backend):
+    import station_index
+    gisio.message('Checking n-value, IEFA, and obstruction stations...')
+    findings = station_index.check_geometry(params['geofile'])
+    for rule, count in station_index.summary(findings).items():
+        if count:
+            gisio.warn('{} findings: {}'.format(rule, count))
+    station_index.write_findings(findings, params['outfile'])
+
+
+def run_allgeo(params, backend):
+    """
+    Cross section length audit, then n-value, IEFA, and obstruction review, same output names as all-geo.py.
+    With old_geofile, existing outputs are updated for the cross sections that changed since old_geofile,
+    see geodiff.py. Finished steps and review chunks are recorded in <prefix>.checkpoint.json, with resume a
+    run that stopped continues from there.
+    """
+    prefix = params.get('prefix')
+    if not prefix:
+        prefix = os.path.splitext(os.path.basename(params['geofile']))[0]
+    if not os.path.exists(params['out_dir']):
+        os.makedirs(params['out_dir'])
+    qa_file = os.path.join(params['out_dir'], prefix + '_n_value_qa.csv')
+    progress = open_checkpoint(params, os.path.join(params['out_dir'], prefix + checkpoint.SUFFIX), ALLGEO_INPUTS)
+
+    if progress.is_done(LENGTH_AUDIT):
+        gisio.message('\n' + '*' * 20 + ' Length audit finished by an earlier run, skipping')
+    else:
+        gisio.message('\n' + '*' * 20 + ' Length audit')
+        audit_params = dict(params)
+        audit_params['outfile'] = os.path.join(params['out_dir'], prefix + '_length_audit.csv')
+        run_lengths(audit_params, backend)
+        progress.mark_done(LENGTH_AUDIT)
+
+    geo_diff = None
+    if params.get('old_geofile'):
+        import geodiff
+        geo_diff = geodiff.GeometryDiff(params['old_geofile'], params['geofile'])
+        report = params.get('change_report') or os.path.join(params['out_dir'], prefix + '_changes.csv')
+        geodiff.write_report(geo_diff, report)
+
+    tools = ((run_nvalue, 'n_value_review', 'n_value_review', '_n_value.shp', {'qa_file': qa_file}),
+             (run_iefa, 'iefa_review', 'iefa_review', '_iefa.shp', {}),
+             (run_blocked, 'blocked_review', 'obstruction_review', '_blocked.shp', {}))
+    simplify = simplify_tolerance(params)
+    for tool, module_name, review_name, suffix, kwargs in tools:
+        tool_params = dict(params)
+        tool_params['outfile'] = os.path.join(params['out_dir'], prefix + suffix)
+        if params.get('output_ext'):
+            tool_params['outfile'] = os.path.splitext(tool_params['outfile'])[0] + params['output_ext']
+        tool_params.update(kwargs)
+        if progress.is_done(tool_params['outfile']):
+            gisio.message('\n' + '*' * 20 + ' ' + tool_params['outfile'] + ' finished by an earlier run, skipping')
+            continue
+        # Outputs started by an interrupted run are resumed, not updated
+        if geo_diff is not None and backend.exists(tool_params['outfile']) and \
+                not progress.has_output(tool_params['outfile']):
+            gisio.message('\n' + '*' * 20 + ' Updating ' + tool_params['outfile'])
+            module = load_tool(module_name)
+            geodiff.update_review(getattr(module, review_name),
+                                  module.output_fields(params['xs_id_field'], params['river_field'],
+                                                       params['reach_field']),
+                                  module.RAS_BLOCKS, geo_diff, params['cross_sections'], params['xs_id_field'],
+                                  params['river_field'], params['reach_field'], tool_params['outfile'],
+                                  backend=backend, simplify_tolerance=simplify, **kwargs)
+        else:
+            gisio.message('\n' + '*' * 20 + ' Creating ' + tool_params['outfile'])
+            tool(tool_params, backend, progress)
+        progress.mark_done(tool_params['outfile'])
+    progress.remove()
+
+
+def run_topwidth(params, backend):
+    file_check(backend, params['outfile'])
+    load_tool('twcheck').measure(params['floodplain'], params['cross_sections'], params['xs_id_field'],
+                                 params['outfile'], processes=int(params.get('processes') or 1), backend=backend,
+                                 simplify_tolerance=simplify_tolerance(params))
+
+
+def run_bfe(params, backend):
+    bfetool = load_tool('bfetool')
+    progress = open_checkpoint(params, checkpoint.default_filename(params['outfile']), BFE_INPUTS)
+    if not progress.has_output(params['outfile']):
+        file_check(backend, params['outfile'])
+    gisio.message('Importing BFEs from ' + params['bfe_file'])
+    rs = input_cache.river_system(params['bfe_file'], params.get('profile'))
+    gisio.message('Calculating BFE locations...')
+    rs.sort_all()
+    rs.calc_all_reach_lengths()
+    rs.calc_all_BFEs()
+    create_BFEs = bfetool.CreateBFEs(rs, params['channels'], params['river_field'], params['reach_field'],
+                                     params['outfile'], backend=backend, progress=progress)
+    create_BFEs.set_BFE_dimensions(float(params.get('length') or 50), not params.get('no_wings'),
+                                   float(params.get('wing_length') or 25))
+    create_BFEs.create_BFEs()
+    progress.remove()
+
+
+def run_xstest(params, backend):
+    XStest = load_tool('XStest')
+    file_check(backend, params['outfile'])
+    gisio.message('Importing cross sections from ' + params['xs_file'])
+    rs = input_cache.river_system(params['xs_file'], params.get('profile'))
+    rs.sort_all()
+    create_XSs = XStest.CrossSectionTest(rs, params['channels'], params['river_field'], params['reach_field'],
+                                         params['outfile'], BFE_length=float(params['length']), backend=backend)
+    create_XSs.create_test_XS()
+
+
+def run_extents(params, backend):
+    file_check(backend, params['outfile'])
+    round_digits = params.get('round_digits')
+    round_stationing = round_digits is not None and round_digits != ''
+    round_digits = int(round_digits) if round_stationing else ''
+    extents_script = load_tool('extents_script')
+    if params.get('wsel'):
+        if not params.get('geofile'):
+            gisio.error('A HEC-RAS geometry file is required to calculate extents from water surface elevations')
+            sys.exit()
+        wetted = extents_script.extents_core.ALL_SEGMENTS if params.get('all_segments') else \
+            extents_script.extents_core.OUTERMOST
+        extents_script.create_WS_extents_from_geometry(params['extents_file'], params['cross_sections'],
+                                                       params['xs_id_field'], round_stationing, round_digits,
+                                                       params['geofile'], params['outfile'], wetted=wetted,
+                                                       backend=backend, per_profile=params.get('per_profile', False))
+        return
+    extents_script.create_WS_extents(params['extents_file'], params['cross_sections'], params['xs_id_field'],
+                                     round_stationing, round_digits, params.get('geofile') or '', params['outfile'],
+                                     backend=backend, per_profile=params.get('per_profile', False))
+
+
+def run_floodplain(params, backend):
+    file_check(backend, params['outfile'])
+    graph = None
+    if params.get('geofile') or params.get('channels'):
+        graph = build_reach_graph(params, backend)
+    load_tool('extents_script').create_floodplain_polygons(params['extents'], params['outfile'], backend=backend,
+                                                           graph=graph)
+
+
+def run_grid(params, backend):
+    import wsgrid
+    if params.get('wsel'):
+        extents_core = load_tool('extents_script').extents_core
+        if rashdf.is_plan_file(params['wsel']):
+            wsel_list = input_cache.plan_results(params['wsel']).ws_elevations()
+        else:
+            wsel_list = extents_core.import_wsel(params['wsel'])
+        profile = params.get('profile') or (wsel_list[0].profile if wsel_list else '')
+        lines = wsgrid.lines_from_cross_sections(backend, params['lines'], params.get('xs_id_field') or 'XS_ID',
+                                                 params.get('river_field') or 'River',
+                                                 params.get('reach_field') or 'Reach', wsel_list, profile,
+                                                 params.get('round_digits'))
+    else:
+        group_fields = [field for field in (params.get('river_field'), params.get('reach_field')) if field]
+        lines = wsgrid.lines_from_features(backend, params['lines'], params.get('elev_field') or 'Elevation',
+                                           group_fields)
+    wet = wsgrid.rasterize(lines, params['dem'], params['out_prefix'],
+                           float(params.get('max_distance') or wsgrid.MAX_DISTANCE),
+                           int(params.get('tile_size') or wsgrid.TILE_SIZE), int(params.get('processes') or 1))
+    gisio.message('{} inundated cells written to {}'.format(wet, ', '.join(
+        sorted(wsgrid.output_names(params['out_prefix']).values()))))
+
+
+def build_reach_graph(params, backend):
+    """ Returns reach_graph.ReachGraph from the 'geofile', or 'channels' and 'tolerance' of params """
+    import reach_graph
+    if params.get('geofile'):
+        return reach_graph.ReachGraph.from_geometry(params['geofile'])
+    if params.get('channels'):
+        return reach_graph.ReachGraph.from_alignments(backend, params['channels'], params.get('river_field') or 'River',
+                                                      params.get('reach_field') or 'Reach',
+                                                      float(params.get('tolerance') or reach_graph.SNAP_TOLERANCE))
+    gisio.error('A geometry file or channel alignments are required')
+    sys.exit()
+
+
+def run_reaches(params, backend):
+    import reach_graph
+    reach_graph.write_graph(build_reach_graph(params, backend), params['outfile'])
+
+
+TOOLS = {'nvalue': run_nvalue,
+         'iefa': run_iefa,
+         'blocked': run_blocked,
+         'allgeo': run_allgeo,
+         'lengths': run_lengths,
+         'stations': run_stations,
+         'topwidth': run_topwidth,
+         'bfe': run_bfe,
+         'xstest': run_xstest,
+         'extents': run_extents,
+         'floodplain': run_floodplain,
+         'grid': run_grid,
+         'reaches': run_reaches}
+
+
+# ------------------------------------- Jobs -------------------------------------
+def read_job_file(filename):
+    """
+    Returns (settings, projects) from JSON job file. Each project is (name, list of job parameter dicts),
+    project defaults are merged into its jobs. Relative paths are left relative to the current directory.
+    """
+    with open(filename) as infile:
+        settings = json.load(infile)
+    projects = []
+    for i, project in enumerate(settings.get('projects', [])):
+        name = project.get('name', 'project' + str(i + 1))
+        defaults = dict((key, value) for key, value in project.items() if key not in ('name', 'jobs'))
+        jobs = []
+        for job in project.get('jobs', []):
+            params = dict(defaults)
+            params.update(job)
+            if params.get('tool') not in TOOLS:
+                raise ValueError('Unknown tool ' + str(params.get('tool')) + ' in project ' + name)
+            jobs.append(params)
+        projects.append((name, jobs))
+    return settings, projects
+
+
+class _Tee(object):
+    """ Copies writes to a log file and, optionally, the original stream """
+    def __init__(self, log, stream=None):
+        self.log = log
+        self.stream = stream
+
+    def write(self, text):
+        self.log.write(text)
+        if self.stream is not None:
+            self.stream.write(text)
+
+    def flush(self):
+        self.log.flush()
+        if self.stream is not None:
+            self.stream.flush()
+
+
+def run_job(project, index, params, backend_name, log_dir, echo=False):
+    """
+    Runs one job, messages are written to a log file in log_dir
+    :return: dict of REPORT_FIELDS
+    """
+    tool = params['tool']
+    job = '{}-{}-{}'.format(project, index + 1, tool)
+    log_name = os.path.join(log_dir, ''.join(c if c.isalnum() or c in '-_' else '_' for c in job) + '.log')
+    result = {'project': project, 'job': index + 1, 'tool': tool, 'status': OK, 'log': log_name, 'error': '',
+              'started': time.strftime('%Y-%m-%d %H:%M:%S')}
+    start = time.time()
+    stdout = sys.stdout
+    with open(log_name, 'w') as log:
+        sys.stdout = _Tee(log, stdout if echo else None)
+        try:
+            input_cache.set_project_db(params.get('project_db') or os.environ.get(projectdb.ENV_VAR))
+            TOOLS[tool](params, gisio.get_backend(backend_name))
+        except BaseException as e:
+            # Tools call sys.exit() after reporting an error
+            if isinstance(e, KeyboardInterrupt):
+                raise
+            result['status'] = FAILED
+            result['error'] = '{}: {}'.format(type(e).__name__, e)
+            traceback.print_exc(file=log)
+        finally:
+            sys.stdout = stdout
+    result['seconds'] = round(time.time() - start, 2)
+    return result
+
+
+def run_project(task):
+    """ Runs all jobs for one project in order, returns list of results """
+    project, jobs, backend_name, log_dir, echo = task
+    return [run_job(project, i, params, backend_name, log_dir, echo) for i, params in enumerate(jobs)]
+
+
+def run_jobs(projects, workers=1, backend_name=None, log_dir='.', report=None):
+    """
+    Runs projects from read_job_file() on a pool of worker processes, one project per task
+
+    :param workers: number of worker processes, 1 runs in this process
+    :param backend_name: gisio backend name, None to auto-select
+    :param log_dir: directory for per job log files
+    :param report: name of csv report, None for no report
+    :return: list of results from run_job()
+    """
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    workers = max(1, min(workers, len(projects)))
+    if workers > 1:
+        # Worker processes are daemons and can't start their own pools
+        for _, jobs in projects:
+            for params in jobs:
+                if params['tool'] in ('topwidth', 'grid') and int(params.get('processes') or 1) > 1:
+                    gisio.warn('Top width and grid jobs run with 1 process when workers > 1')
+                    params['processes'] = 1
+    tasks = [(name, jobs, backend_name, log_dir, workers == 1) for name, jobs in projects]
+    total_jobs = sum(len(jobs) for _, jobs in projects)
+
+    results = []
+    start = time.time()
+    if workers == 1:
+        project_results = (run_project(task) for task in tasks)
+        pool = None
+    else:
+        # Each worker is replaced after a project so cached inputs are released
+        pool = multiprocessing.Pool(workers, maxtasksperchild=1)
+        project_results = pool.imap_unordered(run_project, tasks)
+    try:
+        for project_result in project_results:
+            for result in project_result:
+                results.append(result)
+                gisio.message('[{}/{}] {} job {} {}: {} in {}s'.format(len(results), total_jobs, result['project'],
+                                                                      result['job'], result['tool'],
+                                                                      result['status'], result['seconds']))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    failed = [result for result in results if result['status'] != OK]
+    gisio.message('{} jobs finished in {:.1f}s, {} failed.'.format(len(results), time.time() - start, len(failed)))
+    for result in failed:
+        gisio.warn('Failed: {} job {} {}: {} (see {})'.format(result['project'], result['job'], result['tool'],
+                                                              result['error'], result['log']))
+    if report is not None:
+        write_report(report, results)
+    return results
+
+
+def write_report(filename, results):
+    results = sorted(results, key=lambda result: (result['project'], result['job']))
+    with gisio.open_csv(filename) as outfile:
+        writer = csv.DictWriter(outfile, REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+    gisio.message('Report written to ' + filename)
+
+
+# ------------------------------------- Command line -------------------------------------
+def _add_review_arguments(parser):
+    parser.add_argument('geofile', help='HEC-RAS geometry file')
+    parser.add_argument('cross_sections', help='cross section shapefile or GeoPackage layer')
+    parser.add_argument('xs_id_field')
+    parser.add_argument('river_field')
+    parser.add_argument('reach_field')
+
+
+def _add_resume_argument(parser):
+    parser.add_argument('--resume', action='store_true', help='continue a run that stopped from its checkpoint, '
+                                                              'finished work is skipped')
+
+
+def _add_simplify_argument(parser):
+    parser.add_argument('--simplify', type=float, help='simplify output lines, vertices within this distance of '
+                                                       'the simplified line are dropped (map units)')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='FHAD tools without ArcMap')
+    parser.add_argument('--backend', choices=[gisio.PYTHON, gisio.ARCPY], help='GIS I/O backend')
+    parser.add_argument('--project-db', help='project database file to reuse parsed inputs between runs')
+    subparsers = parser.add_subparsers(dest='tool')
+    subparsers.required = True
+
+    for tool, text in (('nvalue', "Manning's n review lines"), ('iefa', 'ineffective flow area review lines'),
+                       ('blocked', 'blocked obstruction review lines')):
+        sub = subparsers.add_parser(tool, help=text)
+        _add_review_arguments(sub)
+        sub.add_argument('outfile')
+        _add_simplify_argument(sub)
+        _add_resume_argument(sub)
+        if tool == 'nvalue':
+            sub.add_argument('--qa-file', help='csv for n-value QA findings, defaults to messages')
+
+    sub = subparsers.add_parser('allgeo', help='n-value, IEFA, and obstruction review lines')
+    _add_review_arguments(sub)
+    sub.add_argument('out_dir')
+    sub.add_argument('--prefix', help='output name prefix, defaults to the geometry file name')
+    sub.add_argument('--old-geofile', help='previous geometry file, only cross sections that changed since it '
+                                           'are updated in existing outputs')
+    sub.add_argument('--change-report', help='csv of changed cross sections, defaults to <prefix>_changes.csv')
+    sub.add_argument('--output-ext', help="review output extension, '.shp' (default) or '.parquet'")
+    _add_simplify_argument(sub)
+    _add_resume_argument(sub)
+
+    sub = subparsers.add_parser('lengths', help='cut line length vs RAS cross section width audit')
+    _add_review_arguments(sub)
+    sub.add_argument('outfile', help='csv of mismatched cross sections, largest difference first')
+    sub.add_argument('--tolerance', type=float, help='ignored length difference, defaults to 1')
+
+    sub = subparsers.add_parser('stations', help='overlapping and out of order n-value, IEFA, and obstruction '
+                                                 'stations')
+    sub.add_argument('geofile', help='HEC-RAS geometry file')
+    sub.add_argument('outfile', help='csv of findings')
+
+    sub = subparsers.add_parser('topwidth', help='floodplain top width check')
+    sub.add_argument('floodplain')
+    sub.add_argument('cross_sections')
+    sub.add_argument('xs_id_field')
+    sub.add_argument('outfile')
+    sub.add_argument('--processes', type=int, default=1)
+    _add_simplify_argument(sub)
+
+    sub = subparsers.add_parser('bfe', help='BFE lines from HEC-RAS output')
+    sub.add_argument('bfe_file', help='csv of HEC-RAS output or plan results .p##.hdf')
+    sub.add_argument('channels', help='channel alignments')
+    sub.add_argument('river_field')
+    sub.add_argument('reach_field')
+    sub.add_argument('outfile')
+    sub.add_argument('--length', type=float, default=50)
+    sub.add_argument('--wing-length', type=float, default=25)
+    sub.add_argument('--no-wings', action='store_true')
+    sub.add_argument('--profile', help='profile to place BFEs on, defaults to the first profile')
+    _add_resume_argument(sub)
+
+    sub = subparsers.add_parser('xstest', help='test cross sections along the channel alignment')
+    sub.add_argument('xs_file', help='csv of HEC-RAS output or plan results .p##.hdf')
+    sub.add_argument('channels', help='channel alignments')
+    sub.add_argument('river_field')
+    sub.add_argument('reach_field')
+    sub.add_argument('length', type=float)
+    sub.add_argument('outfile')
+    sub.add_argument('--profile', help='profile to test, defaults to the first profile')
+
+    sub = subparsers.add_parser('extents', help='floodplain extents points')
+    sub.add_argument('extents_file', help='csv of HEC-RAS extents or plan results .p##.hdf')
+    sub.add_argument('cross_sections')
+    sub.add_argument('xs_id_field')
+    sub.add_argument('outfile')
+    sub.add_argument('--geofile', help='HEC-RAS geometry file to correct skew and offset')
+    sub.add_argument('--round-digits', type=int, help='round cross section ids to digits')
+    sub.add_argument('--wsel', action='store_true', help='extents_file is a HEC-RAS profile table of water surface '
+                                                         'elevations, extents are calculated from --geofile')
+    sub.add_argument('--all-segments', action='store_true', help='with --wsel, create extents for every wetted '
+                                                                 'segment instead of the outer most extents')
+    sub.add_argument('--per-profile', action='store_true', help='write each profile to its own output named after '
+                                                                'outfile and the profile')
+
+    sub = subparsers.add_parser('floodplain', help='floodplain boundary polygons from extents points')
+    sub.add_argument('extents', help='extents points created by the extents tool')
+    sub.add_argument('outfile')
+    sub.add_argument('--geofile', help='HEC-RAS geometry file, polygons of reaches are joined at its junctions, '
+                                       'without it or --channels there is a gap at every junction')
+    sub.add_argument('--channels', help='channel alignments digitized downstream to upstream, used without '
+                                        '--geofile to join reaches at junctions')
+    sub.add_argument('--river-field', default='River', help='with --channels')
+    sub.add_argument('--reach-field', default='Reach', help='with --channels')
+    sub.add_argument('--tolerance', type=float, help='with --channels, alignment end point snapping distance, '
+                                                     'defaults to 1')
+
+    sub = subparsers.add_parser('grid', help='water surface elevation, depth, and inundation grids')
+    sub.add_argument('lines', help='BFE lines, or cross section cut lines with --wsel')
+    sub.add_argument('dem', help='DEM as an ESRI float grid (.flt)')
+    sub.add_argument('out_prefix', help='outputs are <out_prefix>_wsel.flt, _depth.flt, and _mask.flt')
+    sub.add_argument('--elev-field', default='Elevation', help='water surface elevation field of BFE lines')
+    sub.add_argument('--river-field', help="lines are only interpolated with lines of the same river and reach, "
+                                           "with --wsel cut lines are matched by river, reach, and id, defaults "
+                                           "to 'River'")
+    sub.add_argument('--reach-field', help="with --wsel, defaults to 'Reach'")
+    sub.add_argument('--wsel', help='csv of HEC-RAS profile output or plan results .p##.hdf, lines are cross '
+                                    'sections')
+    sub.add_argument('--profile', help='with --wsel, profile to grid, defaults to the first profile')
+    sub.add_argument('--xs-id-field', default='XS_ID', help='with --wsel, cross section id field')
+    sub.add_argument('--round-digits', type=int, help='with --wsel, round cross section ids to digits')
+    sub.add_argument('--max-distance', type=float, help='cells farther from every line are dry, defaults to 500')
+    sub.add_argument('--tile-size', type=int, help='tile rows and columns, defaults to 512')
+    sub.add_argument('--processes', type=int, default=1)
+
+    sub = subparsers.add_parser('reaches', help='reach connectivity and processing order')
+    sub.add_argument('outfile', help='csv of reaches, their level, and downstream reaches')
+    sub.add_argument('--geofile', help='HEC-RAS geometry file, reaches are connected by its junctions')
+    sub.add_argument('--channels', help='channel alignments digitized downstream to upstream, used without '
+                                        '--geofile')
+    sub.add_argument('--river-field', default='River')
+    sub.add_argument('--reach-field', default='Reach')
+    sub.add_argument('--tolerance', type=float, help='alignment end point snapping distance, defaults to 1')
+
+    sub = subparsers.add_parser('jobs', help='run a job file')
+    sub.add_argument('job_file')
+    sub.add_argument('--workers', type=int, help='worker processes, overrides the job file')
+    sub.add_argument('--report', help='csv report, defaults to <job file>_report.csv')
+    sub.add_argument('--log-dir', help='job log directory, defaults to <job file>_logs')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.project_db:
+        # Environment variable so job worker processes use it too
+        os.environ[projectdb.ENV_VAR] = args.project_db
+        input_cache.set_project_db(args.project_db)
+    if args.tool != 'jobs':
+        TOOLS[args.tool](vars(args), gisio.get_backend(args.backend))
+        return 0
+
+    settings, projects = read_job_file(args.job_file)
+    base = os.path.splitext(args.job_file)[0]
+    workers = args.workers or settings.get('workers') or 1
+    results = run_jobs(projects, workers=int(workers), backend_name=args.backend or settings.get('backend'),
+                       log_dir=args.log_dir or base + '_logs', report=args.report or base + '_report.csv')
+    return 1 if any(result['status'] != OK for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
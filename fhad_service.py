@@ -0,0 +1,269 @@
+"""
+Optional resident service that keeps parsed inputs in memory between tool runs. Toolbox scripts start cold
+every time, with the service running they send their parameters to it instead and repeated runs on the same
+project reuse the geometry indexes, cut lines, alignment stationing, and profile tables parsed by earlier
+runs (input_cache.py). The least recently used inputs are dropped once max_entries are cached.
+
+    python fhad_service.py start [--address localhost:6487 | --socket /tmp/fhad.sock] [--max-entries 32]
+    python fhad_service.py status
+    python fhad_service.py clear
+    python fhad_service.py stop
+
+The service listens on localhost by default, clients authenticate with a random key written to SERVICE_FILE
+when the service starts. Tools run one at a time with the fhad.py tool functions, their
+messages are sent back to the client. Requests the service can't run, e.g. for the arcpy backend in a python
+without arcpy, are answered 'not served' and the client runs the tool itself. Set FHAD_SERVICE=off to always
+run tools in the calling process.
+"""
+import argparse
+import binascii
+import json
+import os
+import sys
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+import gisio
+import input_cache
+
+SERVICE_FILE = os.path.join(os.path.expanduser('~'), '.fhad', 'service.json')
+ENV_VAR = 'FHAD_SERVICE'
+OFF = 'off'
+DEFAULT_ADDRESS = ('localhost', 6487)
+MAX_ENTRIES = 32
+
+RUN = 'run'
+STATUS = 'status'
+CLEAR = 'clear'
+STOP = 'stop'
+OK = 'ok'
+FAILED = 'failed'
+# The service can't run the request, e.g. it has no arcpy for an arcpy backend, the client runs the tool itself
+NOT_SERVED = 'not served'
+
+
+class ServiceError(Exception):
+    pass
+
+
+class _Capture(object):
+    """ Collects text written to stdout during a request """
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def flush(self):
+        pass
+
+    def lines(self):
+        return ''.join(self.parts).splitlines()
+
+
+# Messages are JSON so python 2 toolbox scripts can use a python 3 service and the other way around
+def _send(connection, message):
+    connection.send_bytes(json.dumps(message).encode('utf-8'))
+
+
+def _receive(connection):
+    return json.loads(connection.recv_bytes().decode('utf-8'))
+
+
+# ------------------------------------- Service -------------------------------------
+def _write_service_file(family, address, authkey):
+    directory = os.path.dirname(SERVICE_FILE)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(SERVICE_FILE, 'w') as outfile:
+        json.dump({'family': family, 'address': address, 'authkey': binascii.hexlify(authkey).decode('ascii'),
+                   'pid': os.getpid()}, outfile)
+    # The key lets clients run tools as this user
+    os.chmod(SERVICE_FILE, 0o600)
+
+
+def _remove_service_file():
+    try:
+        os.remove(SERVICE_FILE)
+    except OSError:
+        pass
+
+
+def _run_tool(request):
+    """ Runs an fhad.py tool, returns response dict with the tool's messages """
+    import fhad
+    tool = request.get('tool')
+    if tool not in fhad.TOOLS:
+        return {'status': FAILED, 'error': 'Unknown tool ' + str(tool), 'messages': []}
+    try:
+        backend = gisio.get_backend(request.get('backend'))
+    except (ImportError, ValueError) as e:
+        return {'status': NOT_SERVED, 'error': 'Backend {} is not available: {}'.format(request.get('backend'), e),
+                'messages': []}
+    response = {'status': OK, 'error': ''}
+    capture = _Capture()
+    stdout = sys.stdout
+    cwd = os.getcwd()
+    start = time.time()
+    sys.stdout = capture
+    try:
+        if request.get('cwd'):
+            os.chdir(request['cwd'])
+        fhad.TOOLS[tool](request.get('params', {}), backend)
+    except BaseException as e:
+        # Tools call sys.exit() after reporting an error, like fhad.run_job()
+        if isinstance(e, KeyboardInterrupt):
+            raise
+        response['status'] = FAILED
+        response['error'] = '{}: {}'.format(type(e).__name__, e)
+        traceback.print_exc(file=capture)
+    finally:
+        sys.stdout = stdout
+        os.chdir(cwd)
+    response['messages'] = capture.lines()
+    response['seconds'] = round(time.time() - start, 3)
+    return response
+
+
+def handle(request):
+    """ Returns response dict for request dict """
+    command = request.get('command', RUN)
+    if command == RUN:
+        return _run_tool(request)
+    if command == STATUS:
+        return {'status': OK, 'pid': os.getpid(), 'entries': input_cache.cached_keys(),
+                'max_entries': input_cache.MAX_ENTRIES}
+    if command == CLEAR:
+        input_cache.clear()
+        return {'status': OK}
+    if command == STOP:
+        return {'status': OK}
+    return {'status': FAILED, 'error': 'Unknown command ' + str(command)}
+
+
+def serve(address=DEFAULT_ADDRESS, family='AF_INET', max_entries=MAX_ENTRIES):
+    """
+    Serves requests until a stop request
+    :param address: (host, port) for AF_INET or a socket path for AF_UNIX
+    """
+    input_cache.MAX_ENTRIES = max_entries
+    authkey = os.urandom(16)
+    listener = Listener(address, family, authkey=authkey)
+    _write_service_file(family, listener.address, authkey)
+    gisio.message('FHAD service listening on {}'.format(listener.address))
+    try:
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                # Failed authentication or a client that went away
+                gisio.warn('Rejected connection: ' + str(e))
+                continue
+            try:
+                message = _receive(connection)
+                response = handle(message)
+                _send(connection, response)
+            except (EOFError, IOError, OSError):
+                continue
+            finally:
+                connection.close()
+            if message.get('command') == STOP:
+                break
+            if message.get('command', RUN) == RUN and response['status'] == NOT_SERVED:
+                gisio.message('{} not served: {}'.format(message.get('tool'), response['error']))
+            elif message.get('command', RUN) == RUN:
+                gisio.message('{} {} in {} s'.format(message.get('tool'), response['status'],
+                                                     response.get('seconds')))
+    finally:
+        listener.close()
+        _remove_service_file()
+
+
+# ------------------------------------- Client -------------------------------------
+def _read_service_file():
+    try:
+        with open(SERVICE_FILE) as infile:
+            return json.load(infile)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def request(message):
+    """ Sends message dict to the service, returns the response or None if no service is running """
+    if os.environ.get(ENV_VAR, '').lower() == OFF:
+        return None
+    info = _read_service_file()
+    if info is None:
+        return None
+    # json gives unicode on python 2, which multiprocessing doesn't accept as an address
+    if info['family'] == 'AF_INET':
+        address = (str(info['address'][0]), int(info['address'][1]))
+    else:
+        address = str(info['address'])
+    try:
+        connection = Client(address, str(info['family']), authkey=binascii.unhexlify(info['authkey'].encode('ascii')))
+    except Exception:
+        # Service file left by a service that didn't shut down cleanly
+        return None
+    try:
+        _send(connection, message)
+        return _receive(connection)
+    except (EOFError, IOError, OSError):
+        return None
+    finally:
+        connection.close()
+
+
+def run_tool(tool, params, backend=None):
+    """
+    Runs fhad.py tool with params dict on the service, messages are reported with gisio.message()
+    :param backend: backend name the tool must use, toolbox scripts pass 'arcpy' as their paths may be feature
+        classes only arcpy can read. None uses the service's default backend.
+    :return: False if no service is running or it can't serve the request, the caller should run the tool itself
+    """
+    response = request({'command': RUN, 'tool': tool, 'params': params, 'backend': backend, 'cwd': os.getcwd()})
+    if response is None:
+        return False
+    if response['status'] == NOT_SERVED:
+        gisio.message('FHAD service not used: ' + response['error'])
+        return False
+    for line in response['messages']:
+        gisio.message(line)
+    if response['status'] != OK:
+        gisio.error(response['error'])
+        raise ServiceError(response['error'])
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Resident FHAD tool service')
+    parser.add_argument('command', choices=['start', STATUS, CLEAR, STOP])
+    parser.add_argument('--address', help='host:port to listen on, defaults to localhost:6487')
+    parser.add_argument('--socket', help='Unix socket path to listen on instead of --address')
+    parser.add_argument('--max-entries', type=int, default=MAX_ENTRIES, help='parsed inputs kept in memory')
+    args = parser.parse_args(argv)
+
+    if args.command == 'start':
+        if args.socket:
+            serve(args.socket, 'AF_UNIX', args.max_entries)
+        else:
+            host, port = args.address.rsplit(':', 1) if args.address else DEFAULT_ADDRESS
+            serve((host, int(port)), 'AF_INET', args.max_entries)
+        return 0
+    response = request({'command': args.command})
+    if response is None:
+        gisio.error('FHAD service is not running')
+        return 1
+    if args.command == STATUS:
+        gisio.message('FHAD service pid {}, {} of {} inputs cached'.format(
+            response['pid'], len(response['entries']), response['max_entries']))
+        for entry in response['entries']:
+            gisio.message('    ' + entry)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+Compares two revisions of a HEC-RAS geometry file and updates existing review lines for the cross sections
+that changed. Each cross section's blocks are fingerprinted separately so every review tool only reacts to
+changes in the blocks it uses, e.g. a new n-value doesn't regenerate the IEFA review lines.
+
+Only the RAS geometry is compared. Review lines must be fully regenerated if the cross section layer changed.
+"""
+import csv
+import hashlib
+import os
+
+import gisio
+import rasgeo
+
+CHANGED = 'changed'
+ADDED = 'added'
+REMOVED = 'removed'
+REPORT_FIELDS = ['river', 'reach', 'xs_id', 'status', 'blocks']
+
+
+def fingerprints(geofile, blocks=rasgeo.ALL_BLOCKS):
+    """
+    Fingerprints blocks of every cross section in geofile
+    :return: dict of (river, reach, xs_id): {block: digest}
+    """
+    prints = {}
+    for geo_xs in rasgeo.iter_cross_sections(geofile, blocks):
+        header = geo_xs.header
+        prints[(header.river, header.reach, header.xs_id)] = dict(
+            (block, hashlib.sha1(repr(rasgeo.block_value(geo_xs, block)).encode('utf-8')).hexdigest())
+            for block in blocks)
+    return prints
+
+
+class GeometryDiff(object):
+    """ Differences between the cross sections of two geometry files """
+    def __init__(self, old_geofile, new_geofile, blocks=rasgeo.ALL_BLOCKS):
+        self.old_geofile = old_geofile
+        self.new_geofile = new_geofile
+        self.old = fingerprints(old_geofile, blocks)
+        self.new = fingerprints(new_geofile, blocks)
+        self.added = set(self.new) - set(self.old)
+        self.removed = set(self.old) - set(self.new)
+
+    def changed_blocks(self, key):
+        """ Returns list of blocks of cross section key that differ between the files """
+        old, new = self.old[key], self.new[key]
+        return [block for block in new if old[block] != new[block]]
+
+    def changed(self, blocks=rasgeo.ALL_BLOCKS):
+        """ Returns set of cross section keys in both files where any of blocks differ """
+        return set(key for key in self.new if key in self.old and
+                   any(self.old[key][block] != self.new[key][block] for block in blocks))
+
+    def report_rows(self):
+        """ Returns list of dicts for write_report(), sorted by river, reach, and xs_id """
+        rows = []
+        for key in self.changed():
+            rows.append((key, CHANGED, ';'.join(self.changed_blocks(key))))
+        rows.extend((key, ADDED, '') for key in self.added)
+        rows.extend((key, REMOVED, '') for key in self.removed)
+        rows.sort()
+        return [dict(zip(REPORT_FIELDS, key + (status, blocks))) for key, status, blocks in rows]
+
+
+def write_report(geo_diff, filename):
+    """ Writes cross sections that changed, were added, or were removed to csv filename """
+    with gisio.open_csv(filename) as outfile:
+        writer = csv.DictWriter(outfile, REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(geo_diff.report_rows())
+    gisio.message('Change report written to ' + filename)
+
+
+def _temp_name(filename):
+    """ Returns name for a temporary feature class next to filename """
+    base, ext = os.path.splitext(filename)
+    return base + '_update' + ext
+
+
+def _row_key(row):
+    """ Returns (river, reach, xs_id) of review line row, rows start with xs id, river, and reach """
+    xs_id, river, reach = row[:3]
+    return str(river).strip(), str(reach).strip(), float(xs_id)
+
+
+def update_review(review, fields, blocks, geo_diff, xs_shape_file, xs_id_field, river_field, reach_field, outfile,
+                  backend=None, **kwargs):
+    """
+    Updates existing review lines in outfile for cross sections whose blocks changed in geo_diff. Lines of
+    changed and removed cross sections are dropped, lines of changed and added cross sections are created
+    with review and added. Other lines are copied unchanged.
+
+    :param review: review function, e.g. n_value_review.n_value_review, must accept xs_keys
+    :param fields: list of gisio.Field of the review output
+    :param blocks: geometry blocks used by review, e.g. n_value_review.RAS_BLOCKS
+    :param geo_diff: GeometryDiff
+    :param kwargs: passed to review
+    :return: number of cross sections updated
+    """
+    backend = gisio.get_backend(backend)
+    changed = geo_diff.changed(blocks)
+    regenerate = changed | geo_diff.added
+    drop = changed | geo_diff.removed
+    if not regenerate and not drop:
+        gisio.message('No changes to ' + outfile)
+        return 0
+
+    field_names = [field.name for field in fields]
+    kept = [row for row in backend.read_features(outfile, field_names) if _row_key(row[1]) not in drop]
+    gisio.message('Updating {} changed, {} added, and {} removed cross sections in {}'.format(
+        len(changed), len(geo_diff.added & regenerate), len(geo_diff.removed), outfile))
+
+    temp_file = _temp_name(outfile)
+    if backend.exists(temp_file):
+        backend.delete(temp_file)
+    created = []
+    if regenerate:
+        review(geo_diff.new_geofile, xs_shape_file, xs_id_field, river_field, reach_field, temp_file,
+               backend=backend, xs_keys=regenerate, **kwargs)
+        created = list(backend.read_features(temp_file, field_names))
+        backend.delete(temp_file)
+
+    spatial_reference = backend.spatial_reference(outfile)
+    backend.delete(outfile)
+    backend.create_output(outfile, 'POLYLINE', fields, spatial_reference)
+    backend.write_features(outfile, field_names, kept + created)
+    return len(regenerate | drop)
@@ -0,0 +1,648 @@
+"""
+GIS I/O backends. All tools read features, create outputs, and write features through a backend so
+they can run inside ArcGIS (ArcpyBackend) or headless without arcpy (PythonBackend, which reads and writes
+shapefiles and GeoPackages directly). Both backends read and write .parquet tables with parquet.py.
+
+Geometry is passed to and from backends as (x, y) tuples for points and as lists of (n, 2) numpy
+arrays of vertices (one per part or ring) for polylines and polygons.
+
+The backend is chosen by get_backend(). The default is the FHAD_GIS_BACKEND environment variable, or
+arcpy if it is already imported or importable, otherwise the pure python backend.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy as np
+
+import gpkg
+import parquet
+import shparrays
+import shpfile
+import simplify
+
+Field = collections.namedtuple('Field', ['name', 'type', 'length'])
+# Field types are the arcpy AddField_management() types
+TEXT = 'TEXT'
+FLOAT = 'FLOAT'
+DOUBLE = 'DOUBLE'
+SHORT = 'SHORT'
+LONG = 'LONG'
+
+ARCPY = 'arcpy'
+PYTHON = 'python'
+BACKEND_ENV = 'FHAD_GIS_BACKEND'
+
+# Features buffered by BulkWriter before a batch is handed to the writer thread
+BULK_BATCH_SIZE = 5000
+# Batches waiting to be written before BulkWriter blocks the caller
+MAX_QUEUED_BATCHES = 4
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    string_types = (str,)
+
+
+class OutputError(Exception):
+    """ Raised when an output can't be created or written """
+    pass
+
+
+# Messages go to the ArcGIS geoprocessing window when running under arcpy, otherwise to stdout
+def message(text):
+    arcpy = sys.modules.get('arcpy')
+    if arcpy is not None:
+        arcpy.AddMessage(text)
+    else:
+        print(text)
+
+
+def warn(text):
+    arcpy = sys.modules.get('arcpy')
+    if arcpy is not None:
+        arcpy.AddWarning(text)
+    else:
+        print(text)
+
+
+def error(text):
+    arcpy = sys.modules.get('arcpy')
+    if arcpy is not None:
+        arcpy.AddError(text)
+    else:
+        print(text)
+
+
+def open_csv(filename):
+    """ Returns filename opened for csv.writer(), csv needs binary files on python 2 and newline='' on 3 """
+    if sys.version_info[0] < 3:
+        return open(filename, 'wb')
+    return open(filename, 'w', newline='')
+
+
+def replace_file(source, destination):
+    """ Renames file source to destination, replacing destination if it exists """
+    try:
+        os.replace(source, destination)
+    except AttributeError:
+        # Python 2 can't rename over an existing file on Windows
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+def set_progressor(progressor_type, label, min_range=0, max_range=100, step=1):
+    """ Sets the ArcGIS progress dialog, does nothing outside of arcpy """
+    arcpy = sys.modules.get('arcpy')
+    if arcpy is not None:
+        arcpy.SetProgressor(progressor_type, label, min_range, max_range, step)
+
+
+def set_progressor_position():
+    """ Steps the ArcGIS progress dialog, does nothing outside of arcpy """
+    arcpy = sys.modules.get('arcpy')
+    if arcpy is not None:
+        arcpy.SetProgressorPosition()
+
+
+def text_field(name, length=None):
+    return Field(name, TEXT, length)
+
+
+def float_field(name):
+    return Field(name, FLOAT, None)
+
+
+def double_field(name):
+    return Field(name, DOUBLE, None)
+
+
+def first_part(geometry):
+    """ Returns (first part of polyline/polygon as (n, 2) array, True if multipart) """
+    return geometry[0], len(geometry) > 1
+
+
+class Backend(object):
+    """
+    Interface for GIS I/O. Subclasses implement all methods.
+    """
+    name = None
+
+    def read_features(self, filename, field_names):
+        """ Yields (geometry, [values of field_names]) for each feature in filename """
+        raise NotImplementedError
+
+    def read_arrays(self, filename, field_names):
+        """ Returns shparrays.FeatureArrays of all features in filename """
+        return shparrays.FeatureArrays.from_features(self.shape_type(filename),
+                                                     self.read_features(filename, field_names), field_names)
+
+    def shape_type(self, filename):
+        """ Returns 'POINT', 'POLYLINE', or 'POLYGON' """
+        raise NotImplementedError
+
+    def spatial_reference(self, filename):
+        """ Returns spatial reference of filename in the format used by create_output() """
+        raise NotImplementedError
+
+    def create_output(self, filename, shape_type, fields, spatial_reference):
+        """
+        Creates an empty feature class, raises OutputError on failure
+        :param shape_type: 'POINT', 'POLYLINE', or 'POLYGON'
+        :param fields: list of Field
+        """
+        raise NotImplementedError
+
+    def open_writer(self, filename, field_names):
+        """ Returns writer with write_features(rows) and close(), usable as a context manager """
+        raise NotImplementedError
+
+    def open_bulk_writer(self, filename, field_names, batch_size=BULK_BATCH_SIZE, simplify_tolerance=None):
+        """
+        Returns BulkWriter, features are written in batches on a background thread
+        :param simplify_tolerance: polylines are simplified with this tolerance before they're written, see
+            simplify.py
+        """
+        return BulkWriter(self, filename, field_names, batch_size, simplify_tolerance=simplify_tolerance)
+
+    def write_features(self, filename, field_names, rows):
+        """ Writes all rows, iterable of (geometry, [values of field_names]), to filename """
+        with self.open_writer(filename, field_names) as writer:
+            writer.write_features(rows)
+
+    def exists(self, filename):
+        raise NotImplementedError
+
+    def delete(self, filename):
+        raise NotImplementedError
+
+    def truncate(self, filename, count):
+        """
+        Deletes features after the first count features, writers opened afterwards append to the rest. Raises
+        OutputError if filename has fewer features or can't be truncated.
+        """
+        raise NotImplementedError
+
+
+def setup_output(backend, filename, shape_type, fields, spatial_reference):
+    """
+    Creates output feature class with the standard messages. Raises OutputError if it can't be created.
+    """
+    message('Creating output shapefile: ' + filename)
+    try:
+        backend.create_output(filename, shape_type, fields, spatial_reference)
+    except Exception as e:
+        error(str(e))
+        error('Unable to create ' + filename +
+              '. Is the shape file open in another program or is the workspace being edited?')
+        raise OutputError(filename)
+    message('Done.')
+
+
+def _wkt(spatial_reference):
+    """ Returns WKT of spatial_reference, which may be an arcpy spatial reference object """
+    if spatial_reference is not None and not isinstance(spatial_reference, string_types):
+        return spatial_reference.exportToString().split(';')[0]
+    return spatial_reference
+
+
+class PythonBackend(Backend):
+    """ Reads and writes shapefiles and GeoPackages without arcpy """
+    name = PYTHON
+
+    def read_features(self, filename, field_names):
+        if gpkg.is_geopackage(filename):
+            return gpkg.iter_features(filename, field_names)
+        if parquet.is_parquet(filename):
+            return parquet.iter_features(filename, field_names)
+        return self.read_arrays(filename, field_names).iter_features(field_names)
+
+    def read_arrays(self, filename, field_names):
+        if gpkg.is_geopackage(filename) or parquet.is_parquet(filename):
+            return Backend.read_arrays(self, filename, field_names)
+        return shparrays.read_shapefile(filename, field_names)
+
+    def shape_type(self, filename):
+        if gpkg.is_geopackage(filename):
+            return gpkg.shape_type(filename)
+        if parquet.is_parquet(filename):
+            return parquet.shape_type(filename)
+        return shparrays.SHAPE_NAMES[shpfile.shape_type(filename)]
+
+    def spatial_reference(self, filename):
+        if gpkg.is_geopackage(filename):
+            return gpkg.spatial_reference(filename)
+        if parquet.is_parquet(filename):
+            return parquet.spatial_reference(filename)
+        return shpfile.read_prj(filename)
+
+    def create_output(self, filename, shape_type, fields, spatial_reference):
+        spatial_reference = _wkt(spatial_reference)
+        directory = os.path.dirname(filename)
+        if gpkg.is_geopackage(filename):
+            directory = os.path.dirname(gpkg.split_layer(filename)[0])
+        if directory != '' and not os.path.isdir(directory):
+            raise OutputError('Directory ' + directory + ' does not exist')
+        if gpkg.is_geopackage(filename):
+            gpkg.create(filename, shape_type, fields, spatial_reference)
+        elif parquet.is_parquet(filename):
+            parquet.create(filename, shape_type, fields, spatial_reference)
+        else:
+            shpfile.create(filename, shape_type, fields, spatial_reference)
+
+    def open_writer(self, filename, field_names):
+        if gpkg.is_geopackage(filename):
+            return gpkg.GeoPackageWriter(filename, field_names)
+        if parquet.is_parquet(filename):
+            return parquet.ParquetWriter(filename, field_names)
+        return shpfile.ShapefileWriter(filename, field_names)
+
+    def exists(self, filename):
+        if gpkg.is_geopackage(filename):
+            return gpkg.exists(filename)
+        if parquet.is_parquet(filename):
+            return parquet.exists(filename)
+        return os.path.isfile(shpfile.base_name(filename) + '.shp')
+
+    def delete(self, filename):
+        if gpkg.is_geopackage(filename):
+            gpkg.delete(filename)
+        elif parquet.is_parquet(filename):
+            parquet.delete(filename)
+        else:
+            shpfile.delete(filename)
+
+    def truncate(self, filename, count):
+        try:
+            if gpkg.is_geopackage(filename):
+                gpkg.truncate(filename, count)
+            elif parquet.is_parquet(filename):
+                parquet.truncate(filename, count)
+            else:
+                shpfile.truncate(filename, count)
+        except (gpkg.GeoPackageError, parquet.ParquetError, shpfile.ShapefileError, IOError, OSError) as e:
+            raise OutputError(str(e))
+
+
+class BulkWriter(object):
+    """
+    Buffers features and writes them in batches of batch_size with the backend writer's write_arrays().
+    Batches are written on a background thread so geometry calculation continues while earlier batches
+    are encoded and written. At most max_batches batches wait in the queue, write_features() blocks when
+    the queue is full. Errors on the writer thread are raised by the next call to write_features(),
+    write_arrays(), or close().
+
+    The arcpy backend writes on the calling thread, arcpy cursors should stay on the thread that made them.
+
+    With simplify_tolerance, polyline batches are simplified before they're written (on the writer thread) and
+    the vertex reduction is reported by close().
+
+    checkpoint() registers a callback that is called once the features given so far are written, so progress
+    can be recorded without flushing partial batches (checkpoint.py).
+    """
+    def __init__(self, backend, filename, field_names, batch_size=BULK_BATCH_SIZE, max_batches=MAX_QUEUED_BATCHES,
+                 threaded=None, simplify_tolerance=None):
+        self.backend = backend
+        self.stats = simplify.SimplifyStats(simplify_tolerance) if simplify_tolerance else None
+        self.filename = filename
+        self.field_names = list(field_names)
+        self.batch_size = batch_size
+        self.shape_type = backend.shape_type(filename)
+        self.rows = []
+        # Features passed to the writer thread, and (features, callback) waiting for the next batch
+        self.features = 0
+        self.marks = []
+        self.error = None
+        if threaded is None:
+            threaded = backend.name != ARCPY
+        if threaded:
+            self.writer = None
+            self.queue = queue.Queue(max_batches)
+            self.thread = threading.Thread(target=self._write_batches)
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self.writer = backend.open_writer(filename, self.field_names)
+            self.queue = None
+            self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't hide the original exception
+            try:
+                self.close()
+            except OutputError:
+                pass
+
+    def write_features(self, rows):
+        """
+        :param rows: iterable of (geometry, [values of field_names])
+        """
+        for row in rows:
+            self.rows.append(row)
+            if len(self.rows) >= self.batch_size:
+                self._flush_rows()
+
+    def write_arrays(self, arrays, keep=None):
+        """
+        :param arrays: shparrays.FeatureArrays with a column for each of field_names
+        :param keep: optional boolean array of vertices of arrays.coords that simplification must keep
+        """
+        self._flush_rows()
+        self._put((arrays, keep))
+
+    def checkpoint(self, callback):
+        """
+        Calls callback(features) once every feature given to this writer so far is written to the output,
+        features is their number. Callbacks run on the writer thread after the batch holding the last of
+        those features, or when the writer is closed.
+        """
+        self.marks.append((self.features + len(self.rows), callback))
+
+    def _flush_rows(self):
+        if self.rows:
+            arrays = shparrays.FeatureArrays.from_features(self.shape_type, self.rows, self.field_names)
+            self.rows = []
+            self._put((arrays, None))
+
+    def _write(self, writer, batch):
+        arrays, keep, marks = batch
+        if arrays is not None:
+            if self.stats is None:
+                writer.write_arrays(arrays)
+            else:
+                arrays = self.stats.simplify(arrays, keep)
+                start = time.time()
+                writer.write_arrays(arrays)
+                self.stats.write_seconds += time.time() - start
+        if marks:
+            writer.flush()
+            for features, callback in marks:
+                callback(features)
+
+    def _put(self, batch):
+        self._check_error()
+        # Checkpoints ride with the batch that completes them
+        arrays, keep = batch
+        if arrays is not None:
+            self.features += len(arrays)
+        batch = (arrays, keep, self.marks)
+        self.marks = []
+        if self.thread is None:
+            self._write(self.writer, batch)
+            return
+        # Time out periodically so a dead writer thread doesn't block the caller forever
+        while True:
+            try:
+                self.queue.put(batch, timeout=1.0)
+                return
+            except queue.Full:
+                self._check_error()
+
+    def _write_batches(self):
+        # Writer is opened on this thread, sqlite connections can't be shared across threads
+        try:
+            writer = self.backend.open_writer(self.filename, self.field_names)
+        except Exception as e:
+            self.error = e
+            writer = None
+        try:
+            while True:
+                batch = self.queue.get()
+                if batch is None:
+                    break
+                if self.error is None:
+                    try:
+                        self._write(writer, batch)
+                    except Exception as e:
+                        self.error = e
+        finally:
+            if writer is not None:
+                try:
+                    writer.close()
+                except Exception as e:
+                    if self.error is None:
+                        self.error = e
+
+    def _check_error(self):
+        if self.error is not None:
+            raise OutputError('Error writing ' + self.filename + ': ' + str(self.error))
+
+    def close(self):
+        """ Writes remaining features, waits for the writer thread, and closes the output """
+        if self.thread is None:
+            if self.writer is not None:
+                try:
+                    self._flush_rows()
+                    self._flush_marks()
+                finally:
+                    self.writer.close()
+                    self.writer = None
+                self._report()
+            return
+        if not self.thread.is_alive():
+            self._check_error()
+            return
+        try:
+            self._flush_rows()
+            self._flush_marks()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+        self._check_error()
+        self._report()
+
+    def _flush_marks(self):
+        if self.marks:
+            self._put((None, None))
+
+    def _report(self):
+        if self.stats is not None and self.stats.vertices_in:
+            message(self.stats.summary(self.filename))
+
+
+class ArcpyBackend(Backend):
+    """ Reads and writes any feature class supported by arcpy, and Parquet tables which arcpy can't write """
+    name = ARCPY
+
+    def __init__(self):
+        import arcpy
+        self.arcpy = arcpy
+
+    def read_features(self, filename, field_names):
+        if parquet.is_parquet(filename):
+            return parquet.iter_features(filename, field_names)
+        return self._read_cursor(filename, field_names)
+
+    def _read_cursor(self, filename, field_names):
+        with self.arcpy.da.SearchCursor(filename, ['SHAPE@'] + list(field_names)) as cursor:
+            for row in cursor:
+                yield self._from_arcpy(row[0]), list(row[1:])
+
+    def _from_arcpy(self, geo):
+        if geo is None:
+            return None
+        if geo.type == 'point':
+            point = geo.firstPoint
+            return (point.X, point.Y)
+        parts = []
+        for part in geo:
+            # Interior rings are separated from the exterior ring by None
+            ring = []
+            for point in part:
+                if point is None:
+                    parts.append(np.array(ring, dtype=float))
+                    ring = []
+                else:
+                    ring.append((point.X, point.Y))
+            parts.append(np.array(ring, dtype=float))
+        return parts
+
+    def _to_arcpy(self, shape_type, geometry, spatial_reference):
+        arcpy = self.arcpy
+        if geometry is None:
+            return None
+        if shape_type == 'POINT':
+            return arcpy.PointGeometry(arcpy.Point(geometry[0], geometry[1]), spatial_reference)
+        parts = arcpy.Array()
+        for part in geometry:
+            parts.add(arcpy.Array([arcpy.Point(x, y) for x, y in part]))
+        if shape_type == 'POLYGON':
+            return arcpy.Polygon(parts, spatial_reference)
+        return arcpy.Polyline(parts, spatial_reference)
+
+    def shape_type(self, filename):
+        if parquet.is_parquet(filename):
+            return parquet.shape_type(filename)
+        return self.arcpy.Describe(filename).shapeType.upper()
+
+    def spatial_reference(self, filename):
+        if parquet.is_parquet(filename):
+            return parquet.spatial_reference(filename)
+        return self.arcpy.Describe(filename).spatialReference
+
+    def create_output(self, filename, shape_type, fields, spatial_reference):
+        if parquet.is_parquet(filename):
+            parquet.create(filename, shape_type, fields, _wkt(spatial_reference))
+            return
+        arcpy = self.arcpy
+        if isinstance(spatial_reference, string_types):
+            spatial_reference = arcpy.SpatialReference(text=spatial_reference)
+        arcpy.CreateFeatureclass_management(os.path.dirname(filename), os.path.basename(filename),
+                                            shape_type, '', '', '', spatial_reference)
+        message('Adding fields...')
+        for field in fields:
+            if field.length is not None:
+                arcpy.AddField_management(filename, field.name, field.type, field_length=field.length)
+            else:
+                arcpy.AddField_management(filename, field.name, field.type)
+
+    def open_writer(self, filename, field_names):
+        if parquet.is_parquet(filename):
+            return parquet.ParquetWriter(filename, field_names)
+        return _ArcpyWriter(self, filename, field_names)
+
+    def exists(self, filename):
+        if parquet.is_parquet(filename):
+            return parquet.exists(filename)
+        return self.arcpy.Exists(filename)
+
+    def delete(self, filename):
+        if parquet.is_parquet(filename):
+            parquet.delete(filename)
+        else:
+            self.arcpy.Delete_management(filename)
+
+    def truncate(self, filename, count):
+        if parquet.is_parquet(filename):
+            try:
+                parquet.truncate(filename, count)
+            except parquet.ParquetError as e:
+                raise OutputError(str(e))
+            return
+        if int(self.arcpy.GetCount_management(filename).getOutput(0)) < count:
+            raise OutputError('{} has fewer than {} features'.format(filename, count))
+        # Cursors return features in insert order
+        with self.arcpy.da.UpdateCursor(filename, ['OID@']) as cursor:
+            for i, _ in enumerate(cursor):
+                if i >= count:
+                    cursor.deleteRow()
+
+
+class _ArcpyWriter(object):
+    def __init__(self, backend, filename, field_names):
+        self.backend = backend
+        self.field_names = list(field_names)
+        describe = backend.arcpy.Describe(filename)
+        self.shape_type = describe.shapeType.upper()
+        self.spatial_reference = describe.spatialReference
+        self.filename = filename
+        self.cursor = backend.arcpy.da.InsertCursor(filename, ['SHAPE@'] + list(field_names))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_features(self, rows):
+        for geometry, values in rows:
+            shape = self.backend._to_arcpy(self.shape_type, geometry, self.spatial_reference)
+            self.cursor.insertRow([shape] + list(values))
+
+    def write_arrays(self, arrays):
+        self.write_features(arrays.iter_features(self.field_names))
+
+    def flush(self):
+        """ Rows are committed when the cursor is closed, so the cursor is closed and opened again """
+        self.close()
+        self.cursor = self.backend.arcpy.da.InsertCursor(self.filename, ['SHAPE@'] + self.field_names)
+
+    def close(self):
+        if self.cursor is not None:
+            del self.cursor
+            self.cursor = None
+
+
+_backends = {}
+
+
+def get_backend(backend=None):
+    """
+    Returns a backend instance
+    :param backend: None, 'arcpy', 'python', or a Backend instance
+    """
+    if isinstance(backend, Backend):
+        return backend
+    if backend is None:
+        backend = os.environ.get(BACKEND_ENV)
+    if backend is None:
+        if 'arcpy' in sys.modules:
+            backend = ARCPY
+        else:
+            try:
+                import arcpy
+                backend = ARCPY
+            except ImportError:
+                backend = PYTHON
+    if backend not in _backends:
+        if backend == ARCPY:
+            _backends[backend] = ArcpyBackend()
+        elif backend == PYTHON:
+            _backends[backend] = PythonBackend()
+        else:
+            raise ValueError('Unknown GIS backend: ' + str(backend))
+    return _backends[backend]
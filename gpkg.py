@@ -0,0 +1,434 @@
+"""
+Pure python OGC GeoPackage feature table reader and writer using sqlite3. Geometry uses the same
+formats as shpfile.py: (x, y) tuples for points, lists of (n, 2) numpy arrays for polylines and polygons.
+Polylines are stored as MULTILINESTRING and polygons as MULTIPOLYGON with one polygon per exterior ring and
+its holes, rings are exteriors or holes by containment (shpfile.ring_parents()).
+
+Layers are addressed like feature classes in a file geodatabase: 'C:\\project\\results.gpkg\\bfe_lines'
+"""
+import os
+import sqlite3
+import struct
+
+import numpy as np
+
+import shpfile
+
+APPLICATION_ID = 0x47504B47  # 'GPKG'
+USER_VERSION = 10200
+GEOMETRY_COLUMN = 'geom'
+# First srs_id used for spatial references that come with only a WKT definition
+CUSTOM_SRS_ID = 100000
+# Seconds a writer waits for another writer of the same GeoPackage
+WRITE_TIMEOUT = 60
+
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON = 6
+
+GEOMETRY_TYPE_NAMES = {'POINT': 'POINT', 'POLYLINE': 'MULTILINESTRING', 'POLYGON': 'MULTIPOLYGON'}
+SQL_TYPES = {'TEXT': 'TEXT', 'FLOAT': 'REAL', 'DOUBLE': 'REAL', 'SHORT': 'INTEGER', 'LONG': 'INTEGER'}
+
+# Envelope sizes in bytes, by envelope indicator in the geometry header flags
+ENVELOPE_SIZES = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+METADATA_TABLES = [
+    """CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+        srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY, organization TEXT NOT NULL,
+        organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)""",
+    """CREATE TABLE IF NOT EXISTS gpkg_contents (
+        table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+        description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+        min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+        CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))""",
+    """CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+        table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+        srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+        CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name))""",
+]
+
+DEFAULT_SRS = [
+    ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+    ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+    ('WGS 84 geodetic', 4326, 'EPSG', 4326,
+     'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+     'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,'
+     'AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]', 'longitude/latitude coordinates in WGS 84'),
+]
+
+
+class GeoPackageError(Exception):
+    pass
+
+
+def is_geopackage(filename):
+    """ Returns True if filename is a layer in a GeoPackage """
+    return '.gpkg' in filename.lower()
+
+
+def split_layer(filename):
+    """
+    Splits 'path/to/file.gpkg/layer' into ('path/to/file.gpkg', 'layer'). The layer defaults to the
+    GeoPackage name without extension.
+    """
+    index = filename.lower().index('.gpkg') + len('.gpkg')
+    database = filename[:index]
+    layer = filename[index:].lstrip('/\\')
+    if layer == '':
+        layer = os.path.splitext(os.path.basename(database))[0]
+    return database, layer
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def connect(database):
+    connection = sqlite3.connect(database)
+    connection.execute('PRAGMA application_id = {}'.format(APPLICATION_ID))
+    connection.execute('PRAGMA user_version = {}'.format(USER_VERSION))
+    for statement in METADATA_TABLES:
+        connection.execute(statement)
+    connection.executemany('INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', DEFAULT_SRS)
+    return connection
+
+
+def _srs_id(connection, spatial_reference):
+    """ Returns srs_id for WKT spatial_reference, adding it to gpkg_spatial_ref_sys if needed """
+    if not spatial_reference:
+        return -1
+    row = connection.execute('SELECT srs_id FROM gpkg_spatial_ref_sys WHERE definition = ?',
+                             (spatial_reference,)).fetchone()
+    if row is not None:
+        return row[0]
+    srs_id = max(CUSTOM_SRS_ID, connection.execute('SELECT MAX(srs_id) FROM gpkg_spatial_ref_sys').fetchone()[0] + 1)
+    name = spatial_reference.split('"')[1] if '"' in spatial_reference else 'Custom'
+    connection.execute('INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)',
+                       (name, srs_id, 'NONE', srs_id, spatial_reference, ''))
+    return srs_id
+
+
+# ------------------------------------- Geometry -------------------------------------
+def _ring_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * np.sum(x[:-1] * y[1:] - x[1:] * y[:-1])
+
+
+def _close(ring):
+    if ring[0, 0] != ring[-1, 0] or ring[0, 1] != ring[-1, 1]:
+        return np.vstack([ring, ring[:1]])
+    return ring
+
+
+def wkb(shape_type_name, geometry):
+    """ Returns (WKB of geometry, (min x, max x, min y, max y)), also used for Parquet output """
+    if shape_type_name == 'POINT':
+        x, y = geometry
+        return struct.pack('<BI2d', 1, WKB_POINT, x, y), (x, x, y, y)
+    parts = [np.ascontiguousarray(part, dtype='<f8').reshape(-1, 2) for part in geometry]
+    if shape_type_name == 'POLYLINE':
+        chunks = [struct.pack('<BII', 1, WKB_MULTILINESTRING, len(parts))]
+        for part in parts:
+            chunks.append(struct.pack('<BII', 1, WKB_LINESTRING, len(part)))
+            chunks.append(part.tobytes())
+    else:
+        # WKB exterior rings are counter clockwise, holes are clockwise
+        rings = [_close(part) for part in parts]
+        parents = shpfile.ring_parents(rings)
+        rings = [ring[::-1] if (_ring_area(ring) < 0) == (parent is None) else ring
+                 for ring, parent in zip(rings, parents)]
+        # One polygon per exterior ring, followed by its holes
+        exteriors = [i for i, parent in enumerate(parents) if parent is None]
+        chunks = [struct.pack('<BII', 1, WKB_MULTIPOLYGON, len(exteriors))]
+        for exterior in exteriors:
+            polygon = [rings[exterior]] + [ring for ring, parent in zip(rings, parents) if parent == exterior]
+            chunks.append(struct.pack('<BII', 1, WKB_POLYGON, len(polygon)))
+            for ring in polygon:
+                chunks.append(struct.pack('<I', len(ring)))
+                chunks.append(ring.tobytes())
+    points = np.vstack(parts)
+    return b''.join(chunks), (points[:, 0].min(), points[:, 0].max(), points[:, 1].min(), points[:, 1].max())
+
+
+def encode(shape_type_name, geometry, srs_id):
+    """ Returns GeoPackage binary geometry, None geometry is stored as NULL """
+    if geometry is None:
+        return None
+    geometry_wkb, envelope = wkb(shape_type_name, geometry)
+    # flags: little endian, xy envelope
+    return b'GP' + struct.pack('<BBi4d', 0, 0x03, srs_id, *envelope) + geometry_wkb
+
+
+def decode(blob):
+    """ Returns geometry from GeoPackage binary geometry """
+    blob = bytes(blob)
+    flags = bytearray(blob[3:4])[0]
+    if flags & 0x10:
+        return None
+    envelope_size = ENVELOPE_SIZES[(flags >> 1) & 0x07]
+    geometry, _ = _parse_wkb(blob, 8 + envelope_size)
+    return geometry
+
+
+def decode_wkb(geometry_wkb):
+    """ Returns geometry from WKB """
+    geometry, _ = _parse_wkb(bytes(geometry_wkb), 0)
+    return geometry
+
+
+def _parse_wkb(wkb, offset):
+    """ Returns (geometry, offset after geometry). Z and M values are dropped """
+    order = '<' if bytearray(wkb[offset:offset + 1])[0] == 1 else '>'
+    wkb_type, = struct.unpack(order + 'I', wkb[offset + 1:offset + 5])
+    offset += 5
+    # ISO WKB adds 1000 for Z, 2000 for M, 3000 for ZM. EWKB uses the high bits instead
+    dims = 2 + (0, 1, 1, 2)[(wkb_type & 0x0FFFFFFF) // 1000]
+    dims += bool(wkb_type & 0x80000000) + bool(wkb_type & 0x40000000)
+    base_type = (wkb_type & 0x0FFFFFFF) % 1000
+    dtype = np.dtype(order + 'f8')
+
+    if base_type == WKB_POINT:
+        x, y = struct.unpack(order + '2d', wkb[offset:offset + 16])
+        return (x, y), offset + 8 * dims
+    if base_type == WKB_LINESTRING:
+        count, = struct.unpack(order + 'I', wkb[offset:offset + 4])
+        points = np.frombuffer(wkb, dtype, count * dims, offset + 4).reshape(-1, dims)[:, :2]
+        return [points.astype(float)], offset + 4 + 8 * dims * count
+    if base_type == WKB_POLYGON:
+        num_rings, = struct.unpack(order + 'I', wkb[offset:offset + 4])
+        offset += 4
+        rings = []
+        for _ in range(num_rings):
+            count, = struct.unpack(order + 'I', wkb[offset:offset + 4])
+            ring = np.frombuffer(wkb, dtype, count * dims, offset + 4).reshape(-1, dims)[:, :2]
+            rings.append(ring.astype(float))
+            offset += 4 + 8 * dims * count
+        return rings, offset
+    if base_type in (4, WKB_MULTILINESTRING, WKB_MULTIPOLYGON, 7):
+        num_geometries, = struct.unpack(order + 'I', wkb[offset:offset + 4])
+        offset += 4
+        parts = []
+        for _ in range(num_geometries):
+            geometry, offset = _parse_wkb(wkb, offset)
+            if base_type == 4:
+                parts.append(np.array([geometry], dtype=float))
+            else:
+                parts.extend(geometry)
+        return parts, offset
+    raise GeoPackageError('Unsupported WKB geometry type ' + str(wkb_type))
+
+
+# ------------------------------------- Layers -------------------------------------
+def create(filename, shape_type_name, fields, spatial_reference=None):
+    """
+    Creates an empty feature table, replacing the table if it exists
+    :param filename: GeoPackage layer, see split_layer()
+    :param shape_type_name: 'POINT', 'POLYLINE', or 'POLYGON'
+    :param fields: list of gisio.Field
+    :param spatial_reference: WKT definition or None
+    """
+    database, layer = split_layer(filename)
+    connection = connect(database)
+    try:
+        delete_layer(connection, layer)
+        srs_id = _srs_id(connection, spatial_reference)
+        columns = ['fid INTEGER PRIMARY KEY AUTOINCREMENT', GEOMETRY_COLUMN + ' ' + GEOMETRY_TYPE_NAMES[shape_type_name]]
+        columns += [_quote(field.name) + ' ' + SQL_TYPES[field.type] for field in fields]
+        connection.execute('CREATE TABLE ' + _quote(layer) + ' (' + ', '.join(columns) + ')')
+        connection.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, ?, ?, ?)',
+                           (layer, 'features', layer, srs_id))
+        connection.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, 0, 0)',
+                           (layer, GEOMETRY_COLUMN, GEOMETRY_TYPE_NAMES[shape_type_name], srs_id))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def delete_layer(connection, layer):
+    connection.execute('DROP TABLE IF EXISTS ' + _quote(layer))
+    connection.execute('DELETE FROM gpkg_contents WHERE table_name = ?', (layer,))
+    connection.execute('DELETE FROM gpkg_geometry_columns WHERE table_name = ?', (layer,))
+
+
+def delete(filename):
+    """ Deletes layer from its GeoPackage """
+    database, layer = split_layer(filename)
+    connection = connect(database)
+    try:
+        delete_layer(connection, layer)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def truncate(filename, num_records):
+    """
+    Deletes the features after the first num_records, e.g. features written after the last checkpoint of an
+    interrupted run (checkpoint.py). The fid sequence and layer extent are reset so features written next
+    are stored like in an uninterrupted run. Raises GeoPackageError if the layer has fewer features.
+    """
+    database, layer = split_layer(filename)
+    connection = sqlite3.connect(database, timeout=WRITE_TIMEOUT)
+    try:
+        table = _quote(layer)
+        count = connection.execute('SELECT count(*) FROM ' + table).fetchone()[0]
+        if count < num_records:
+            raise GeoPackageError('{} has fewer than {} features'.format(filename, num_records))
+        with connection:
+            connection.execute('DELETE FROM {0} WHERE fid NOT IN (SELECT fid FROM {0} ORDER BY fid LIMIT ?)'.format(
+                table), (num_records,))
+            connection.execute('UPDATE sqlite_sequence SET seq = (SELECT coalesce(max(fid), 0) FROM {}) '
+                               'WHERE name = ?'.format(table), (layer,))
+            bbox = [None] * 4
+            for blob, in connection.execute('SELECT {} FROM {} WHERE {} IS NOT NULL'.format(
+                    GEOMETRY_COLUMN, table, GEOMETRY_COLUMN)):
+                min_x, max_x, min_y, max_y = struct.unpack('<4d', bytes(blob[8:40]))
+                if bbox[0] is None:
+                    bbox = [min_x, min_y, max_x, max_y]
+                else:
+                    bbox = [min(bbox[0], min_x), min(bbox[1], min_y), max(bbox[2], max_x), max(bbox[3], max_y)]
+            connection.execute('UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, max_y = ? '
+                               'WHERE table_name = ?', bbox + [layer])
+    finally:
+        connection.close()
+
+
+def exists(filename):
+    database, layer = split_layer(filename)
+    if not os.path.isfile(database):
+        return False
+    connection = sqlite3.connect(database)
+    try:
+        row = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (layer,)).fetchone()
+    finally:
+        connection.close()
+    return row is not None
+
+
+def _layer_info(connection, layer):
+    row = connection.execute('SELECT geometry_type_name, srs_id FROM gpkg_geometry_columns WHERE table_name = ?',
+                             (layer,)).fetchone()
+    if row is None:
+        raise GeoPackageError('Layer ' + layer + ' not found')
+    shape_type_name = {'POINT': 'POINT', 'MULTIPOINT': 'POINT', 'LINESTRING': 'POLYLINE',
+                       'MULTILINESTRING': 'POLYLINE', 'POLYGON': 'POLYGON', 'MULTIPOLYGON': 'POLYGON'}[row[0].upper()]
+    return shape_type_name, row[1]
+
+
+def _column_names(connection, layer, field_names):
+    """ Matches field_names to table columns, case insensitive like ArcGIS """
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(' + _quote(layer) + ')')]
+    lookup = dict((column.upper(), column) for column in columns)
+    try:
+        return [lookup[name.upper()] for name in field_names]
+    except KeyError as e:
+        raise GeoPackageError('Field ' + str(e) + ' not found in ' + layer)
+
+
+def iter_features(filename, field_names):
+    """ Yields (geometry, [values]) for every feature in the layer """
+    database, layer = split_layer(filename)
+    connection = sqlite3.connect(database)
+    try:
+        columns = [GEOMETRY_COLUMN] + _column_names(connection, layer, field_names)
+        cursor = connection.execute('SELECT ' + ', '.join(_quote(c) for c in columns) + ' FROM ' + _quote(layer) +
+                                    ' ORDER BY fid')
+        for row in cursor:
+            geometry = decode(row[0]) if row[0] is not None else None
+            yield geometry, list(row[1:])
+    finally:
+        connection.close()
+
+
+def shape_type(filename):
+    database, layer = split_layer(filename)
+    connection = sqlite3.connect(database)
+    try:
+        return _layer_info(connection, layer)[0]
+    finally:
+        connection.close()
+
+
+def spatial_reference(filename):
+    """ Returns WKT of layer spatial reference or None """
+    database, layer = split_layer(filename)
+    connection = sqlite3.connect(database)
+    try:
+        _, srs_id = _layer_info(connection, layer)
+        row = connection.execute('SELECT definition FROM gpkg_spatial_ref_sys WHERE srs_id = ?', (srs_id,)).fetchone()
+    finally:
+        connection.close()
+    if row is None or row[0] == 'undefined':
+        return None
+    return row[0]
+
+
+class GeoPackageWriter(object):
+    """ Appends features to an existing layer. Each call to write_features() is one transaction """
+    def __init__(self, filename, field_names):
+        database, self.layer = split_layer(filename)
+        self.field_names = list(field_names)
+        # Layers of one GeoPackage may be written by concurrent writers
+        self.connection = sqlite3.connect(database, timeout=WRITE_TIMEOUT)
+        self.shape_type_name, self.srs_id = _layer_info(self.connection, self.layer)
+        columns = [GEOMETRY_COLUMN] + _column_names(self.connection, self.layer, field_names)
+        self.insert = 'INSERT INTO ' + _quote(self.layer) + ' (' + ', '.join(_quote(c) for c in columns) + \
+            ') VALUES (' + ', '.join('?' * len(columns)) + ')'
+        self.bbox = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_features(self, rows):
+        """
+        :param rows: iterable of (geometry, [values of field_names])
+        """
+        records = []
+        for geometry, values in rows:
+            blob = encode(self.shape_type_name, geometry, self.srs_id)
+            if blob is None:
+                records.append([None] + list(values))
+            else:
+                records.append([sqlite3.Binary(blob)] + list(values))
+                self._extend_bbox(blob)
+        with self.connection:
+            self.connection.executemany(self.insert, records)
+
+    def write_arrays(self, arrays):
+        """
+        :param arrays: shparrays.FeatureArrays with a column for each of field_names
+        """
+        self.write_features(arrays.iter_features(self.field_names))
+
+    def _extend_bbox(self, blob):
+        min_x, max_x, min_y, max_y = struct.unpack('<4d', blob[8:40])
+        if self.bbox is None:
+            self.bbox = [min_x, min_y, max_x, max_y]
+        else:
+            self.bbox = [min(self.bbox[0], min_x), min(self.bbox[1], min_y),
+                         max(self.bbox[2], max_x), max(self.bbox[3], max_y)]
+
+    def flush(self):
+        """ Features are committed by each write """
+        pass
+
+    def close(self):
+        if self.connection is None:
+            return
+        if self.bbox is not None:
+            with self.connection:
+                old = self.connection.execute('SELECT min_x, min_y, max_x, max_y FROM gpkg_contents '
+                                              'WHERE table_name = ?', (self.layer,)).fetchone()
+                bbox = self.bbox
+                if old is not None and old[0] is not None:
+                    bbox = [min(old[0], bbox[0]), min(old[1], bbox[1]), max(old[2], bbox[2]), max(old[3], bbox[3])]
+                self.connection.execute("UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, max_y = ?, "
+                                        "last_change = strftime('%Y-%m-%dT%H:%M:%fZ','now') WHERE table_name = ?",
+                                        bbox + [self.layer])
+        self.connection.close()
+        self.connection = None
@@ -0,0 +1,58 @@
+"""
+Times importing each arcpy free compute core in a fresh interpreter and verifies arcpy is not
+imported along the way.
+
+usage: python import_benchmark.py [--repeat 5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# (directory relative to ROOT, module name)
+CORE_MODULES = [
+    ('', 'review_core'),
+    ('', 'bfe_core'),
+    ('', 'extents_core'),
+    ('TopWidth', 'tw_core'),
+    ('N-value Review', 'n_value_core'),
+    ('IEFA Review', 'iefa_core'),
+    ('Block Obs Review', 'blocked_core'),
+]
+
+# numpy is imported first so its one time cost isn't charged to the first core
+TIMER = """
+import sys, time
+sys.path.insert(0, {path!r})
+import numpy
+start = time.time()
+import {module}
+elapsed = time.time() - start
+print('{{:.6f}} {{}}'.format(elapsed, 'arcpy' in sys.modules))
+"""
+
+
+def time_import(directory, module):
+    """ Returns (seconds, arcpy imported) for importing module in a new interpreter """
+    code = TIMER.format(path=os.path.join(ROOT, directory), module=module)
+    output = subprocess.check_output([sys.executable, '-c', code]).decode().split()
+    return float(output[0]), output[1] == 'True'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark compute core import times')
+    parser.add_argument('--repeat', type=int, default=5, help='imports per module, best time is reported')
+    args = parser.parse_args()
+
+    print('{:<16} {:>10} {:>8}'.format('module', 'ms', 'arcpy'))
+    for directory, module in CORE_MODULES:
+        results = [time_import(directory, module) for _ in range(args.repeat)]
+        best = min(seconds for seconds, _ in results)
+        arcpy_imported = any(imported for _, imported in results)
+        print('{:<16} {:>10.1f} {:>8}'.format(module, best * 1000, 'yes' if arcpy_imported else 'no'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""
+Per process cache of parsed inputs. Parsing a HEC-RAS geometry file or reading a cross section layer is
+the slowest part of most tools, this lets several tools run on the same model (all-geo, fhad.py jobs)
+share one parse. Entries are keyed by file name and modification time so edited inputs are re-read,
+only the MAX_ENTRIES most recently used entries are kept.
+
+When a project database is set with set_project_db() or FHAD_PROJECT_DB, entries are also stored in the
+database (projectdb.py) so separate tool runs on the same project reuse parsed geometry, cut lines,
+alignment stationing, BFE tables, plan results, and top widths. Database entries are fingerprinted with the
+modification time and size of their source files like in-process entries.
+"""
+import collections
+import os
+import sqlite3
+
+import numpy as np
+
+import projectdb
+
+MAX_ENTRIES = 4
+# str and unicode on python 2
+_TEXT_TYPES = (str, type(u''))
+
+_cache = collections.OrderedDict()
+# [ProjectDB or None] once set_project_db() was called
+_project_db = []
+
+
+def set_project_db(filename):
+    """ Also stores entries in the project database filename, None to only cache in this process """
+    del _project_db[:]
+    _project_db.append(projectdb.ProjectDB(filename) if filename else None)
+
+
+def project_db():
+    """ Returns ProjectDB set with set_project_db() or FHAD_PROJECT_DB, None if not set """
+    if not _project_db:
+        set_project_db(os.environ.get(projectdb.ENV_VAR))
+    return _project_db[0]
+
+
+def _file_stamp(filenames):
+    """ Returns tuple of (mtime, size) for filenames, or None if any isn't a file (e.g. geodatabase) """
+    stamp = []
+    for filename in filenames:
+        if not os.path.isfile(filename):
+            return None
+        stat = os.stat(filename)
+        stamp.append((stat.st_mtime, stat.st_size))
+    return tuple(stamp)
+
+
+def _source_files(filename):
+    """ Returns files that hold feature class filename """
+    lower = filename.lower()
+    if '.gpkg' in lower:
+        return [filename[:lower.index('.gpkg') + 5]]
+    if lower.endswith('.shp'):
+        base = filename[:-4]
+        return [base + '.shp', base + '.dbf']
+    return [filename]
+
+
+def _cached(key, stamp, load, persist=None):
+    """
+    :param persist: optional (to_arrays, from_arrays) functions converting the value to and from a dict of
+        numpy arrays for the project database, to_arrays returns None if the value can't be stored
+    """
+    if stamp is None:
+        return load()
+    entry = _cache.pop(key, None)
+    if entry is not None and entry[0] == stamp:
+        _cache[key] = entry
+        return entry[1]
+    value = _load_stored(key, stamp, load, persist)
+    _cache[key] = (stamp, value)
+    while len(_cache) > MAX_ENTRIES:
+        _cache.popitem(last=False)
+    return value
+
+
+def _load_stored(key, stamp, load, persist):
+    """ Returns value of key from the project database, calls load() and stores the value if not found """
+    db = project_db()
+    if db is None or persist is None:
+        return load()
+    to_arrays, from_arrays = persist
+    kind, name, db_stamp = key[0], repr(key[1:]), repr(stamp)
+    try:
+        arrays = db.get(kind, name, db_stamp)
+    except sqlite3.Error:
+        # The database is an optimization, a locked or damaged database shouldn't stop the tool
+        arrays = None
+    if arrays is not None:
+        return from_arrays(arrays)
+    value = load()
+    arrays = to_arrays(value)
+    if arrays is not None:
+        try:
+            db.put(kind, name, db_stamp, arrays)
+        except sqlite3.Error:
+            pass
+    return value
+
+
+def _text_array(values):
+    """ Returns values as a numpy unicode array, None if any value isn't text """
+    if not all(isinstance(value, _TEXT_TYPES) for value in values):
+        return None
+    try:
+        return np.array(values, dtype='U').reshape(-1)
+    except UnicodeDecodeError:
+        return None
+
+
+# ------------------------------ Project database conversions ------------------------------
+def _index_to_arrays(ras_geo):
+    """ Returns index of rasgeo.RASGeometry as dict of arrays """
+    index = ras_geo.index
+    rivers = _text_array([entry[0] for entry in index])
+    reaches = _text_array([entry[1] for entry in index])
+    if rivers is None or reaches is None:
+        return None
+    return {'rivers': rivers,
+            'reaches': reaches,
+            'xs_ids': np.array([entry[2] for entry in index], dtype=float),
+            'interpolated': np.array([entry[3] for entry in index], dtype=bool),
+            'offsets': np.array([entry[4:6] for entry in index], dtype=np.int64).reshape(-1, 2)}
+
+
+def _index_from_arrays(arrays):
+    offsets = arrays['offsets'].tolist()
+    return [(river, reach, xs_id, interpolated, start, end) for river, reach, xs_id, interpolated, (start, end) in
+            zip(arrays['rivers'].tolist(), arrays['reaches'].tolist(), arrays['xs_ids'].tolist(),
+                arrays['interpolated'].tolist(), offsets)]
+
+
+def _features_to_arrays(features):
+    """ Returns shparrays.FeatureArrays as dict of arrays, None if a text column holds other values """
+    names = list(features.columns)
+    arrays = {'shape_type': np.array(features.shape_type, dtype='U'),
+              'coords': features.coords,
+              'part_offsets': features.part_offsets,
+              'feature_offsets': features.feature_offsets,
+              'column_names': np.array(names, dtype='U').reshape(-1),
+              'object_columns': np.zeros(len(names), dtype=bool)}
+    for i, name in enumerate(names):
+        column = features.columns[name]
+        if column.dtype == object:
+            column = _text_array(column.tolist())
+            if column is None:
+                return None
+            arrays['object_columns'][i] = True
+        arrays['column_{}'.format(i)] = column
+    return arrays
+
+
+def _features_from_arrays(arrays):
+    import shparrays
+    columns = {}
+    for i, name in enumerate(arrays['column_names'].tolist()):
+        column = arrays['column_{}'.format(i)]
+        columns[str(name)] = column.astype(object) if arrays['object_columns'][i] else column
+    return shparrays.FeatureArrays(str(arrays['shape_type']), arrays['coords'], arrays['part_offsets'],
+                                   arrays['feature_offsets'], columns)
+
+
+def _table_to_arrays(table):
+    """ Returns dict of arrays with object columns as unicode arrays, None if an object column isn't text """
+    arrays = {}
+    for name, column in table.items():
+        if column.dtype == object:
+            column = _text_array(column.tolist())
+            if column is None:
+                return None
+        arrays[name] = column
+    return arrays
+
+
+def _table_from_arrays(arrays):
+    return dict((name, column.astype(object) if column.dtype.kind == 'U' else column)
+                for name, column in arrays.items())
+
+
+# ------------------------------------- Cached inputs -------------------------------------
+def ras_geometry(geofile):
+    """
+    Returns rasgeo.RASGeometry(geofile), indexed once per process while geofile is unchanged. Cross
+    sections are parsed when requested so only the index is cached.
+    """
+    import rasgeo
+    key = ('ras_geometry', os.path.abspath(geofile))
+    return _cached(key, _file_stamp([geofile]), lambda: rasgeo.RASGeometry(geofile),
+                   (_index_to_arrays, lambda arrays: rasgeo.RASGeometry(geofile, index=_index_from_arrays(arrays))))
+
+
+def feature_arrays(backend, filename, field_names):
+    """ Returns backend.read_arrays(filename, field_names), read once per process while unchanged """
+    key = ('feature_arrays', backend.name, os.path.abspath(filename), tuple(field_names))
+    return _cached(key, _file_stamp(_source_files(filename)),
+                   lambda: backend.read_arrays(filename, field_names),
+                   (_features_to_arrays, _features_from_arrays))
+
+
+def line_stations(backend, filename, field_names):
+    """
+    Returns stationing index of polyline feature class filename, the distance of each vertex from the start
+    of its part as one array aligned with feature_arrays(backend, filename, field_names).coords
+    """
+    import review_core
+
+    def load():
+        features = feature_arrays(backend, filename, field_names)
+        stations = np.zeros(len(features.coords))
+        offsets = features.part_offsets.tolist()
+        for first, last in zip(offsets[:-1], offsets[1:]):
+            if last > first:
+                stations[first:last] = review_core.line_stations(features.coords[first:last])
+        return stations
+
+    key = ('line_stations', backend.name, os.path.abspath(filename))
+    return _cached(key, _file_stamp(_source_files(filename)), load,
+                   (lambda stations: {'stations': stations}, lambda arrays: arrays['stations']))
+
+
+def _plan_to_arrays(plan):
+    rivers, reaches, xs_ids, profiles = (_text_array(values) for values in
+                                         (plan.rivers, plan.reaches, plan.xs_ids, plan.profiles))
+    if rivers is None or reaches is None or xs_ids is None or profiles is None:
+        return None
+    arrays = {'rivers': rivers, 'reaches': reaches, 'xs_ids': xs_ids, 'profiles': profiles,
+              'cum_length': plan.cum_length, 'wsel': plan.wsel}
+    for name in ('top_width', 'left_sta', 'right_sta'):
+        if getattr(plan, name) is not None:
+            arrays[name] = getattr(plan, name)
+    return arrays
+
+
+def _plan_from_arrays(arrays):
+    import rashdf
+    return rashdf.PlanResults(arrays['rivers'].tolist(), arrays['reaches'].tolist(), arrays['xs_ids'].tolist(),
+                              arrays['profiles'].tolist(), arrays['cum_length'], arrays['wsel'],
+                              arrays.get('top_width'), arrays.get('left_sta'), arrays.get('right_sta'))
+
+
+def plan_results(hdf_filename):
+    """ Returns rashdf.PlanResults of all profiles in HEC-RAS plan results file hdf_filename """
+    import rashdf
+    key = ('plan_results', os.path.abspath(hdf_filename))
+    return _cached(key, _file_stamp([hdf_filename]), lambda: rashdf.read_plan_results(hdf_filename),
+                   (_plan_to_arrays, _plan_from_arrays))
+
+
+def river_system(csv_filename, profile=None):
+    """
+    Returns bfe_core.RiverSystem of one profile of HEC-RAS profile table csv_filename, or of a plan results .hdf
+    file. The table is parsed once while unchanged, every call returns a new RiverSystem as tools sort it and
+    calculate BFEs in place.
+
+    :param profile: profile name, defaults to the first profile
+    """
+    import bfe_core
+    import rashdf
+    if rashdf.is_plan_file(csv_filename):
+        return bfe_core.river_system_from_table(plan_results(csv_filename).river_system_table(profile))
+    key = ('river_system', os.path.abspath(csv_filename))
+    table = _cached(key, _file_stamp([csv_filename]),
+                    lambda: bfe_core.river_system_table(bfe_core.import_BFE_from_CSV(csv_filename)),
+                    (_table_to_arrays, _table_from_arrays))
+    return bfe_core.river_system_from_table(bfe_core.profile_table(table, profile))
+
+
+def cached_result(kind, name, filenames, load, persist=None):
+    """
+    Returns result of load(), computed once per process, and once per project database if persist is
+    given, while the input files are unchanged
+
+    :param kind: type of result, e.g. 'top_widths'
+    :param name: tuple of values identifying the result, e.g. input file names and fields
+    :param filenames: input files or feature classes the result is computed from
+    :param load: function returning the result
+    :param persist: optional (to_arrays, from_arrays) functions converting the result to and from a dict of
+        numpy arrays
+    """
+    return _cached((kind,) + tuple(name), input_stamp(filenames), load, persist)
+
+
+def input_stamp(filenames):
+    """
+    Returns (mtime, size) of the files holding files or feature classes filenames, None if any isn't a file.
+    Used to check that inputs are unchanged, e.g. when resuming a run (checkpoint.py).
+    """
+    return _file_stamp([source for filename in filenames for source in _source_files(filename)])
+
+
+def cached_keys():
+    """ Returns descriptions of the entries in this process, least recently used first """
+    return [' '.join(str(part) for part in key) for key in _cache]
+
+
+def clear():
+    _cache.clear()
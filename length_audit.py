@@ -0,0 +1,154 @@
+"""
+Audits cross section cut line lengths against HEC-RAS cross section widths for a whole model before the
+review tools run. The review tools skip a cross section with a warning when its RAS stationing is longer
+than the cut line, this finds all of them at once along with cut lines that are much longer than the RAS
+cross section and cut lines without a RAS cross section.
+
+RAS widths are the last minus the first sta/elev station, corrected for skew like the review tools. Cut
+line lengths are the length of the first part. Both are compared as arrays in one pass.
+"""
+import collections
+import csv
+
+import numpy as np
+
+import gisio
+import input_cache
+import rasgeo
+import review_core
+import skew_offset
+
+# Differences up to TOLERANCE are ignored, n-value review ignores changes within 1 of the cut line end
+TOLERANCE = 1.0
+RAS_LONGER = 'ras_longer'
+GIS_LONGER = 'gis_longer'
+NOT_IN_RAS = 'not_in_ras'
+NOT_IN_GIS = 'not_in_gis'
+
+Mismatch = collections.namedtuple('Mismatch', ['river', 'reach', 'xs_id', 'gis_length', 'ras_length',
+                                               'difference', 'status'])
+
+
+class RASWidths(object):
+    """ Skew corrected widths of all cross sections in a geometry file, one value per cross section """
+    def __init__(self, rivers, reaches, xs_ids, widths):
+        self.rivers = rivers
+        self.reaches = reaches
+        self.xs_ids = xs_ids
+        self.widths = widths
+
+    def __len__(self):
+        return len(self.xs_ids)
+
+    @classmethod
+    def from_cross_sections(cls, cross_sections):
+        """ Builds widths from rasgeo.CrossSection objects with sta_elev and skew blocks """
+        rivers, reaches, xs_ids, first, last, skews = [], [], [], [], [], []
+        for geo_xs in cross_sections:
+            rivers.append(geo_xs.header.river)
+            reaches.append(geo_xs.header.reach)
+            xs_ids.append(geo_xs.header.xs_id)
+            points = geo_xs.sta_elev.points if geo_xs.sta_elev is not None else []
+            first.append(points[0][0] if points else np.nan)
+            last.append(points[-1][0] if points else np.nan)
+            skews.append(skew_offset.skew_angle(geo_xs))
+        widths = skew_offset.correct_stations(np.array(last, dtype=float), np.array(first, dtype=float),
+                                              np.array(skews, dtype=float))
+        return cls(rivers, reaches, np.array(xs_ids, dtype=float), widths)
+
+
+def read_ras_widths(geofile):
+    """ Returns RASWidths of every cross section in geofile, only sta/elev and skew are parsed """
+    return RASWidths.from_cross_sections(rasgeo.iter_cross_sections(geofile, (rasgeo.STA_ELEV, rasgeo.SKEW)))
+
+
+def cut_line_lengths(features):
+    """
+    Returns length of the first part of every feature
+    :param features: shparrays.FeatureArrays of cross section cut lines
+    :return: array with one value per feature, nan for features without geometry
+    """
+    lengths = review_core.part_lengths(features.coords, features.part_offsets)
+    first_parts = features.feature_offsets[:-1]
+    has_parts = features.feature_offsets[1:] > first_parts
+    result = np.full(len(first_parts), np.nan)
+    result[has_parts] = lengths[first_parts[has_parts]]
+    return result
+
+
+def compare(ras_widths, gis_keys, gis_lengths, tolerance=TOLERANCE):
+    """
+    Compares cut line lengths to RAS widths
+    :param ras_widths: RASWidths
+    :param gis_keys: list of (river, reach, xs_id) of the cut lines
+    :param gis_lengths: array of cut line lengths, same order as gis_keys
+    :param tolerance: differences up to tolerance are not reported
+    :return: list of Mismatch, length mismatches ranked by the size of the difference then missing cross sections
+    """
+    ras_index = dict(((river, reach, xs_id), i) for i, (river, reach, xs_id) in
+                     enumerate(zip(ras_widths.rivers, ras_widths.reaches, ras_widths.xs_ids.tolist())))
+    # RAS cross section of each cut line, -1 if not in the geometry
+    matches = np.array([ras_index.get(key, -1) for key in gis_keys], dtype=np.int64)
+    found = matches >= 0
+    ras_lengths = np.full(len(gis_keys), np.nan)
+    ras_lengths[found] = ras_widths.widths[matches[found]]
+    difference = ras_lengths - gis_lengths
+
+    with np.errstate(invalid='ignore'):
+        mismatched = found & (np.abs(difference) > tolerance)
+    # Largest differences first
+    ranked = np.flatnonzero(mismatched)
+    ranked = ranked[np.argsort(-np.abs(difference[ranked]), kind='mergesort')]
+
+    mismatches = []
+    for i in ranked.tolist():
+        river, reach, xs_id = gis_keys[i]
+        status = RAS_LONGER if difference[i] > 0 else GIS_LONGER
+        mismatches.append(Mismatch(river, reach, xs_id, float(gis_lengths[i]), float(ras_lengths[i]),
+                                   float(difference[i]), status))
+    for i in np.flatnonzero(~found).tolist():
+        river, reach, xs_id = gis_keys[i]
+        mismatches.append(Mismatch(river, reach, xs_id, float(gis_lengths[i]), '', '', NOT_IN_RAS))
+    in_gis = np.zeros(len(ras_widths), dtype=bool)
+    in_gis[matches[found]] = True
+    for i in np.flatnonzero(~in_gis).tolist():
+        mismatches.append(Mismatch(ras_widths.rivers[i], ras_widths.reaches[i], float(ras_widths.xs_ids[i]), '',
+                                   float(ras_widths.widths[i]), '', NOT_IN_GIS))
+    return mismatches
+
+
+def audit(geofile, xs_shape_file, xs_id_field, river_field, reach_field, tolerance=TOLERANCE, backend=None):
+    """
+    Compares all cut line lengths in xs_shape_file to the cross section widths in geofile
+    :return: list of Mismatch, see compare()
+    """
+    backend = gisio.get_backend(backend)
+    features = input_cache.feature_arrays(backend, xs_shape_file, [xs_id_field, river_field, reach_field])
+    xs_ids = features.column(xs_id_field)
+    try:
+        xs_ids = xs_ids.astype(float)
+    except ValueError:
+        gisio.error('Unable to convert cross section ids in ' + xs_id_field + ' to numbers')
+        raise
+    rivers = [river.strip() for river in features.column(river_field).tolist()]
+    reaches = [reach.strip() for reach in features.column(reach_field).tolist()]
+    gis_keys = list(zip(rivers, reaches, xs_ids.tolist()))
+    return compare(read_ras_widths(geofile), gis_keys, cut_line_lengths(features), tolerance)
+
+
+def summary(mismatches):
+    """ Returns OrderedDict of status: number of mismatches """
+    counts = collections.OrderedDict((status, 0) for status in (RAS_LONGER, GIS_LONGER, NOT_IN_RAS, NOT_IN_GIS))
+    for mismatch in mismatches:
+        counts[mismatch.status] += 1
+    return counts
+
+
+def write_audit(mismatches, filename):
+    """ Writes mismatches to csv filename """
+    with gisio.open_csv(filename) as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(Mismatch._fields)
+        for mismatch in mismatches:
+            writer.writerow(mismatch)
+    gisio.message('Length audit written to ' + filename)
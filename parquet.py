@@ -0,0 +1,259 @@
+"""
+Apache Parquet feature table reader and writer, a columnar alternative to shapefiles for tool outputs that
+are analyzed in bulk. Any tool writes Parquet when its output name ends with .parquet, e.g. BFE lines,
+extents, top width checks, and review segments. Field names aren't truncated to 10 characters and there is
+no 2 GB limit.
+
+Geometry is stored as WKB in a 'geometry' column with GeoParquet metadata (polylines as MULTILINESTRING,
+polygons as MULTIPOLYGON like gpkg.py). The spatial reference is stored as WKT in the 'fhad' metadata,
+GeoParquet only accepts PROJJSON so its crs is left undefined. Each batch written by gisio.BulkWriter is a
+row group, so features are written as they are produced and readers can scan row groups independently.
+
+create() writes an empty table with the schema, the writer rewrites it with the same schema, the row groups
+already in it, and the new features. Tables are only readable once the writer is closed, a resumed run
+(checkpoint.py) can continue a table whose writer was closed after an error but not one left by a process
+that was killed. pyarrow is only required to read and write .parquet files.
+"""
+import json
+import os
+
+import numpy as np
+
+import gpkg
+
+EXTENSION = '.parquet'
+GEOMETRY_COLUMN = 'geometry'
+GEO_METADATA = b'geo'
+FHAD_METADATA = b'fhad'
+GEOPARQUET_VERSION = '1.0.0'
+
+GEOMETRY_TYPE_NAMES = {'POINT': 'Point', 'POLYLINE': 'MultiLineString', 'POLYGON': 'MultiPolygon'}
+# Features read at once by iter_features()
+READ_BATCH_SIZE = 5000
+
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+
+class ParquetError(Exception):
+    pass
+
+
+def is_parquet(filename):
+    """ Returns True if filename is a Parquet table """
+    return filename.lower().endswith(EXTENSION)
+
+
+def _pyarrow(filename):
+    """ Returns (pyarrow, pyarrow.parquet), raises ParquetError if pyarrow isn't installed """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ParquetError('pyarrow is required for Parquet table ' + filename +
+                           ', write a shapefile or GeoPackage instead')
+    return pyarrow, pyarrow.parquet
+
+
+def _arrow_types(pa):
+    """ Returns dict of gisio field type: arrow type """
+    # FLOAT fields hold cross section ids, which need more digits than a float32 has
+    return {'TEXT': pa.string(), 'FLOAT': pa.float64(), 'DOUBLE': pa.float64(), 'SHORT': pa.int16(),
+            'LONG': pa.int32()}
+
+
+def create(filename, shape_type_name, fields, spatial_reference=None):
+    """
+    Creates an empty table, replacing the file if it exists
+    :param shape_type_name: 'POINT', 'POLYLINE', or 'POLYGON'
+    :param fields: list of gisio.Field
+    :param spatial_reference: WKT definition or None
+    """
+    pa, pq = _pyarrow(filename)
+    types = _arrow_types(pa)
+    geo = {'version': GEOPARQUET_VERSION, 'primary_column': GEOMETRY_COLUMN,
+           'columns': {GEOMETRY_COLUMN: {'encoding': 'WKB', 'geometry_types': [GEOMETRY_TYPE_NAMES[shape_type_name]],
+                                         'crs': None}}}
+    fhad = {'shape_type': shape_type_name, 'spatial_reference': spatial_reference or None}
+    schema = pa.schema([pa.field(GEOMETRY_COLUMN, pa.binary())] + [pa.field(field.name, types[field.type])
+                                                                    for field in fields],
+                       metadata={GEO_METADATA: json.dumps(geo).encode('utf-8'),
+                                 FHAD_METADATA: json.dumps(fhad).encode('utf-8')})
+    pq.write_table(schema.empty_table(), filename)
+
+
+def exists(filename):
+    return os.path.isfile(filename)
+
+
+def delete(filename):
+    os.remove(filename)
+
+
+def _schema(filename):
+    _, pq = _pyarrow(filename)
+    return pq.read_schema(filename)
+
+
+def _fhad_metadata(schema, filename):
+    metadata = schema.metadata or {}
+    if FHAD_METADATA not in metadata:
+        raise ParquetError(filename + ' was not created by the FHAD tools')
+    return json.loads(metadata[FHAD_METADATA].decode('utf-8'))
+
+
+def shape_type(filename):
+    return _fhad_metadata(_schema(filename), filename)['shape_type']
+
+
+def spatial_reference(filename):
+    """ Returns WKT of the table spatial reference or None """
+    return _fhad_metadata(_schema(filename), filename)['spatial_reference']
+
+
+def _column_names(schema, field_names, filename):
+    """ Matches field_names to table columns, case insensitive like ArcGIS """
+    lookup = dict((name.upper(), name) for name in schema.names)
+    try:
+        return [lookup[name.upper()] for name in field_names]
+    except KeyError as e:
+        raise ParquetError('Field ' + str(e) + ' not found in ' + filename)
+
+
+def _row_groups(filename):
+    """ Returns list of pyarrow tables, the non-empty row groups of filename """
+    _, pq = _pyarrow(filename)
+    try:
+        with open(filename, 'rb') as infile:
+            table = pq.ParquetFile(infile)
+            groups = [table.read_row_group(i) for i in range(table.num_row_groups)]
+    except (IOError, OSError, ValueError) as e:
+        # pyarrow.ArrowInvalid is a ValueError, e.g. for a table without a footer
+        raise ParquetError('Unable to read ' + filename + ': ' + str(e))
+    return [group for group in groups if group.num_rows]
+
+
+def truncate(filename, num_records):
+    """
+    Removes the rows after the first num_records, row groups are kept as they were written. Raises
+    ParquetError if the table has fewer rows or can't be read.
+    """
+    _, pq = _pyarrow(filename)
+    groups = _row_groups(filename)
+    schema = _schema(filename)
+    kept = []
+    remaining = num_records
+    for group in groups:
+        if remaining <= 0:
+            break
+        kept.append(group.slice(0, remaining))
+        remaining -= kept[-1].num_rows
+    if remaining > 0:
+        raise ParquetError('{} has fewer than {} rows'.format(filename, num_records))
+    writer = pq.ParquetWriter(filename, schema)
+    try:
+        if not kept:
+            writer.write_table(schema.empty_table())
+        for group in kept:
+            writer.write_table(group)
+    finally:
+        writer.close()
+
+
+def iter_features(filename, field_names):
+    """ Yields (geometry, [values]) for every feature in the table """
+    _, pq = _pyarrow(filename)
+    table = pq.ParquetFile(filename)
+    columns = [GEOMETRY_COLUMN] + _column_names(table.schema_arrow, field_names, filename)
+    for batch in table.iter_batches(READ_BATCH_SIZE, columns=columns):
+        values = [batch.column(i).to_pylist() for i in range(len(columns))]
+        for row in zip(*values):
+            geometry = gpkg.decode_wkb(row[0]) if row[0] is not None else None
+            yield geometry, list(row[1:])
+
+
+class ParquetWriter(object):
+    """
+    Appends features to a table made by create(), each call to write_arrays() is one row group. The table
+    is rewritten, rows already in it are copied first.
+    """
+    def __init__(self, filename, field_names):
+        self.pa, pq = _pyarrow(filename)
+        schema = _schema(filename)
+        self.shape_type_name = _fhad_metadata(schema, filename)['shape_type']
+        self.columns = _column_names(schema, field_names, filename)
+        self.field_names = list(field_names)
+        self.schema = schema
+        existing = _row_groups(filename)
+        # Columns not written by the caller are null
+        self.writer = pq.ParquetWriter(filename, schema)
+        for group in existing:
+            self.writer.write_table(group)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_features(self, rows):
+        """
+        :param rows: iterable of (geometry, [values of field_names])
+        """
+        geometries = []
+        values = [[] for _ in self.field_names]
+        for geometry, row in rows:
+            geometries.append(geometry)
+            for column, value in zip(values, row):
+                column.append(value)
+        self._write([self._wkb(geometry) for geometry in geometries], values)
+
+    def write_arrays(self, arrays):
+        """
+        :param arrays: shparrays.FeatureArrays with a column for each of field_names
+        """
+        values = []
+        for name in self.field_names:
+            column = arrays.column(name)
+            if column.dtype.kind == 'f':
+                # Missing numbers are nan in FeatureArrays, null in the table
+                column = np.where(np.isnan(column), None, column.astype(object))
+            values.append(column.tolist())
+        self._write([self._wkb(arrays.geometry(i)) for i in range(len(arrays))], values)
+
+    def _wkb(self, geometry):
+        if geometry is None:
+            return None
+        return gpkg.wkb(self.shape_type_name, geometry)[0]
+
+    def _write(self, geometries, values):
+        if not geometries:
+            return
+        pa = self.pa
+        arrays = []
+        for field in self.schema:
+            if field.name == GEOMETRY_COLUMN:
+                arrays.append(pa.array(geometries, pa.binary()))
+            elif field.name in self.columns:
+                column = values[self.columns.index(field.name)]
+                if field.type == pa.string():
+                    # Text fields take any value like a shapefile, e.g. elevations in XStest
+                    column = [value if value is None or isinstance(value, STRING_TYPES)
+                              else u'{}'.format(value)
+                              for value in column]
+                arrays.append(pa.array(column, field.type))
+            else:
+                arrays.append(pa.nulls(len(geometries), field.type))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def flush(self):
+        """ Tables are written when the writer is closed """
+        pass
+
+    def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
@@ -0,0 +1,89 @@
+"""
+Persistent project database of parsed inputs and intermediate results. Values are stored in one SQLite file
+as numpy .npz blobs together with a fingerprint of the source files they were computed from, an entry is
+only returned while its source files are unchanged. input_cache.py uses the database, when one is set,
+behind its in-process cache so back to back tool runs on a project (bfetool, XStest, extents, all-geo)
+reuse parsed geometry, cut lines, alignment stationing, BFE tables, and top widths.
+"""
+import io
+import os
+import sqlite3
+
+import numpy as np
+
+# Seconds to wait for another process writing to the database
+TIMEOUT = 60
+ENV_VAR = 'FHAD_PROJECT_DB'
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    stamp TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (kind, name))"""
+
+
+def pack(arrays):
+    """ Returns dict of name: numpy array as .npz bytes """
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    return buf.getvalue()
+
+
+def unpack(data):
+    """ Returns dict of name: numpy array from pack() bytes """
+    with np.load(io.BytesIO(bytes(data)), allow_pickle=False) as npz:
+        return dict((name, npz[name]) for name in npz.files)
+
+
+class ProjectDB(object):
+    """ SQLite store of numpy arrays keyed by (kind, name) and validated by a source file stamp """
+    def __init__(self, filename):
+        self.filename = filename
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # sqlite connections can't be shared with forked worker processes
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.filename, timeout=TIMEOUT)
+            self._connection.execute(_SCHEMA)
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, kind, name, stamp):
+        """ Returns dict of arrays stored for kind and name, None if missing or stored for another stamp """
+        row = self._connect().execute('SELECT stamp, data FROM entries WHERE kind = ? AND name = ?',
+                                      (kind, name)).fetchone()
+        if row is None or row[0] != stamp:
+            return None
+        try:
+            return unpack(row[1])
+        except (IOError, ValueError):
+            return None
+
+    def put(self, kind, name, stamp, arrays):
+        """ Stores dict of arrays for kind and name, replacing entries for older stamps """
+        connection = self._connect()
+        connection.execute('INSERT OR REPLACE INTO entries (kind, name, stamp, data) VALUES (?, ?, ?, ?)',
+                           (kind, name, stamp, sqlite3.Binary(pack(arrays))))
+        connection.commit()
+
+    def delete(self, kind=None):
+        """ Deletes all entries, or all entries of kind """
+        connection = self._connect()
+        if kind is None:
+            connection.execute('DELETE FROM entries')
+        else:
+            connection.execute('DELETE FROM entries WHERE kind = ?', (kind,))
+        connection.commit()
+
+    def kinds(self):
+        """ Returns dict of kind: number of entries """
+        return dict(self._connect().execute('SELECT kind, COUNT(*) FROM entries GROUP BY kind').fetchall())
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
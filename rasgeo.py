@@ -0,0 +1,366 @@
+"""
+Streaming HEC-RAS geometry (.g##) reader. Only the cross section blocks a tool asks for are parsed
+(sta_elev, mannings_n, iefa, obstruct, skew, bank_sta), everything else is skipped line by line.
+
+iter_cross_sections() yields cross sections as they are read. RASGeometry scans the file once for the
+location of every cross section and parses a cross section only when it's requested with return_xs(),
+so memory is proportional to the index plus one cross section rather than the whole model. Cross
+sections are returned with the same attribute layout as parserasgeo CrossSection objects.
+"""
+ENCODING = 'latin-1'
+
+STA_ELEV = 'sta_elev'
+MANNINGS_N = 'mannings_n'
+IEFA = 'iefa'
+OBSTRUCT = 'obstruct'
+SKEW = 'skew'
+BANK_STA = 'bank_sta'
+ALL_BLOCKS = (STA_ELEV, MANNINGS_N, IEFA, OBSTRUCT, SKEW, BANK_STA)
+
+RIVER_REACH = 'River Reach='
+NODE = 'Type RM Length L Ch R ='
+XS_NODE_TYPE = 1
+FIELD_WIDTH = 8
+
+# Block keyword: (block name, values per item, values per line)
+_BLOCK_KEYS = (('#Sta/Elev=', STA_ELEV, 2, 10),
+               ('#Mann=', MANNINGS_N, 3, 9),
+               ('#XS Ineff=', IEFA, 3, 9),
+               ('#Block Obstruct=', OBSTRUCT, 3, 9),
+               ('Skew Angle=', SKEW, 0, 0),
+               ('Bank Sta=', BANK_STA, 0, 0))
+
+
+class CrossSectionNotFound(Exception):
+    pass
+
+
+class Header(object):
+    def __init__(self, river, reach, xs_id, interpolated=False):
+        self.river = river
+        self.reach = reach
+        self.xs_id = xs_id
+        self.interpolated = interpolated
+
+    def __repr__(self):
+        return 'Header({}, {}, {})'.format(self.river, self.reach, self.xs_id)
+
+
+class StaElev(object):
+    def __init__(self, points):
+        # list of (station, elevation)
+        self.points = points
+
+
+class ManningsN(object):
+    def __init__(self, values):
+        # list of (station, n-value, 0)
+        self.values = values
+
+    def check_for_duplicate_n_values(self):
+        """ Returns list of stations with more than one n-value, or None """
+        stations = [self.values[i][0] for i in range(1, len(self.values)) if self.values[i][0] == self.values[i - 1][0]]
+        return stations if stations else None
+
+    def check_for_redundant_n_values(self):
+        """ Returns list of stations where the n-value doesn't change, or None """
+        stations = [self.values[i][0] for i in range(1, len(self.values)) if self.values[i][1] == self.values[i - 1][1]]
+        return stations if stations else None
+
+
+class Ineffective(object):
+    def __init__(self, num_iefa=None, iefa_type=None, iefa_list=None):
+        self.num_iefa = num_iefa
+        # -1 is blocked ineffective flow areas, 0 is normal
+        self.type = iefa_type
+        # list of (start station, end station, elevation), blank values are ''
+        self.iefa_list = iefa_list if iefa_list is not None else []
+
+
+class Obstruct(object):
+    def __init__(self, num_blocked=None, blocked_type=None, blocked=None):
+        self.num_blocked = num_blocked
+        # -1 is blocked obstructions, 0 is normal
+        self.blocked_type = blocked_type
+        # list of (start station, end station, elevation), blank values are ''
+        self.blocked = blocked if blocked is not None else []
+
+
+class Skew(object):
+    def __init__(self, angle=None):
+        self.angle = angle
+
+
+class CrossSection(object):
+    """ Cross section from a geometry file, blocks that weren't requested are None """
+    def __init__(self, header):
+        self.header = header
+        self.sta_elev = None
+        self.mannings_n = None
+        self.iefa = None
+        self.obstruct = None
+        self.skew = None
+        self.bank_sta = None
+
+    def __repr__(self):
+        return 'CrossSection({}, {}, {})'.format(self.header.river, self.header.reach, self.header.xs_id)
+
+
+def block_value(geo_xs, block):
+    """ Returns comparable value of block of CrossSection, e.g. for fingerprinting """
+    if block == STA_ELEV:
+        return geo_xs.sta_elev.points if geo_xs.sta_elev is not None else None
+    if block == MANNINGS_N:
+        return geo_xs.mannings_n.values if geo_xs.mannings_n is not None else None
+    if block == IEFA:
+        return geo_xs.iefa.num_iefa, geo_xs.iefa.type, geo_xs.iefa.iefa_list
+    if block == OBSTRUCT:
+        return geo_xs.obstruct.num_blocked, geo_xs.obstruct.blocked_type, geo_xs.obstruct.blocked
+    if block == SKEW:
+        return geo_xs.skew.angle
+    if block == BANK_STA:
+        return geo_xs.bank_sta
+    raise ValueError('Unknown block ' + str(block))
+
+
+# ------------------------------------- Parsing -------------------------------------
+def _number(text):
+    text = text.strip()
+    if text == '':
+        return ''
+    return float(text)
+
+
+def _header_numbers(line, key):
+    """ Returns comma separated integers after key, e.g. '#Mann= 3 ,-1 , 0' """
+    return [int(value) for value in line[len(key):].split(',') if value.strip() != '']
+
+
+def _fixed_width_values(lines, start, count, per_line):
+    """
+    Reads count fixed width values from lines starting at index start. Trailing blank fields are
+    often trimmed by RAS, lines are padded with '' up to per_line values.
+    :return: (list of values, index of next line)
+    """
+    values = []
+    i = start
+    while len(values) < count and i < len(lines):
+        line = lines[i].rstrip('\r\n')
+        fields = [line[j:j + FIELD_WIDTH] for j in range(0, len(line), FIELD_WIDTH)]
+        fields += [''] * (min(per_line, count - len(values)) - len(fields))
+        values.extend(_number(field) for field in fields)
+        i += 1
+    return values[:count], i
+
+
+def _group(values, size):
+    return [tuple(values[i:i + size]) for i in range(0, len(values), size)]
+
+
+def parse_node_header(line):
+    """ Returns (node type, xs id, interpolated) from 'Type RM Length L Ch R =' line """
+    fields = line[len(NODE):].split(',')
+    node_type = int(fields[0])
+    xs_text = fields[1].strip()
+    interpolated = xs_text.endswith('*')
+    return node_type, float(xs_text.rstrip('*')), interpolated
+
+
+def parse_river_reach(line):
+    """ Returns (river, reach) from 'River Reach=' line, names are stripped """
+    fields = line[len(RIVER_REACH):].split(',')
+    return fields[0].strip(), fields[1].strip() if len(fields) > 1 else ''
+
+
+def parse_cross_section(header, lines, blocks=ALL_BLOCKS):
+    """
+    Parses requested blocks of a cross section
+    :param header: Header
+    :param lines: lines of the cross section, after the 'Type RM Length L Ch R =' line
+    :param blocks: names of blocks to parse
+    :return: CrossSection
+    """
+    xs = CrossSection(header)
+    if SKEW in blocks:
+        xs.skew = Skew()
+    if IEFA in blocks:
+        xs.iefa = Ineffective()
+    if OBSTRUCT in blocks:
+        xs.obstruct = Obstruct()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        for key, block, per_item, per_line in _BLOCK_KEYS:
+            if not line.startswith(key):
+                continue
+            if block not in blocks:
+                break
+            if block == SKEW:
+                xs.skew = Skew(float(line[len(key):]))
+                break
+            if block == BANK_STA:
+                xs.bank_sta = tuple(float(value) for value in line[len(key):].split(','))
+                break
+            numbers = _header_numbers(line, key)
+            values, i = _fixed_width_values(lines, i, numbers[0] * per_item, per_line)
+            items = _group(values, per_item)
+            if block == STA_ELEV:
+                xs.sta_elev = StaElev(items)
+            elif block == MANNINGS_N:
+                xs.mannings_n = ManningsN(items)
+            elif block == IEFA:
+                xs.iefa = Ineffective(numbers[0], numbers[1] if len(numbers) > 1 else 0, items)
+            elif block == OBSTRUCT:
+                xs.obstruct = Obstruct(numbers[0], numbers[1] if len(numbers) > 1 else 0, items)
+            break
+    return xs
+
+
+def _keep_lines(body, keep):
+    """ Returns function that flags body to be kept and returns it """
+    def lines():
+        keep[0] = True
+        return body
+    return lines
+
+
+def _iter_nodes(infile):
+    """
+    Yields (river, reach, node header line, offset of next line, lines) for each node in open binary file.
+    lines is a function returning the node's lines, it must be called before the next node is requested,
+    nodes whose lines aren't requested are skipped without being kept in memory.
+    """
+    river = reach = None
+    offset = 0
+    line = infile.readline()
+    while line:
+        text = line.decode(ENCODING)
+        offset += len(line)
+        if text.startswith(RIVER_REACH):
+            river, reach = parse_river_reach(text)
+            line = infile.readline()
+            continue
+        if not text.startswith(NODE):
+            line = infile.readline()
+            continue
+
+        body = []
+        keep = [False]
+
+        # Caller decides whether to keep the lines before they're read
+        yield river, reach, text, offset, _keep_lines(body, keep)
+        line = infile.readline()
+        while line:
+            text = line.decode(ENCODING)
+            if text.startswith(NODE) or text.startswith(RIVER_REACH):
+                break
+            if keep[0]:
+                body.append(text)
+            offset += len(line)
+            line = infile.readline()
+
+
+def iter_cross_sections(geofile, blocks=ALL_BLOCKS, wanted=None):
+    """
+    Yields CrossSection objects as they are read from geofile
+
+    :param blocks: names of blocks to parse
+    :param wanted: optional function(river, reach, xs_id) returning False for cross sections to skip
+    """
+    with open(geofile, 'rb') as infile:
+        pending = None
+        for river, reach, node_line, _, lines in _iter_nodes(infile):
+            # Lines of the previous cross section are complete once the next node starts
+            if pending is not None:
+                yield parse_cross_section(pending[0], pending[1](), blocks)
+                pending = None
+            node_type, xs_id, interpolated = parse_node_header(node_line)
+            if node_type != XS_NODE_TYPE:
+                continue
+            if wanted is not None and not wanted(river, reach, xs_id):
+                continue
+            lines()
+            pending = (Header(river, reach, xs_id, interpolated), lines)
+        if pending is not None:
+            yield parse_cross_section(pending[0], pending[1](), blocks)
+
+
+class RASGeometry(object):
+    """
+    Index of cross section locations in a geometry file. Cross sections are read and parsed when
+    requested, compatible with the parserasgeo ParseRASGeo methods used by the tools.
+    """
+    def __init__(self, geofile, blocks=ALL_BLOCKS, index=None):
+        """
+        :param index: index from an earlier RASGeometry of the unchanged file, geofile is scanned if None
+        """
+        self.geofile = geofile
+        self.blocks = blocks
+        self._lookups = {}
+        # list of (river, reach, xs_id, interpolated, start offset, end offset)
+        self.index = index
+        if index is None:
+            self.index = self._scan()
+
+    def _scan(self):
+        index = []
+        with open(self.geofile, 'rb') as infile:
+            last = None
+            for river, reach, node_line, start, _ in _iter_nodes(infile):
+                if last is not None:
+                    index.append(last + (start - len(node_line.encode(ENCODING)),))
+                    last = None
+                node_type, xs_id, interpolated = parse_node_header(node_line)
+                if node_type == XS_NODE_TYPE:
+                    last = (river, reach, xs_id, interpolated, start)
+            if last is not None:
+                infile.seek(0, 2)
+                index.append(last + (infile.tell(),))
+        return index
+
+    def number_xs(self):
+        return len(self.index)
+
+    def _lookup(self, by_reach, digits):
+        """ Returns dict of (river, reach, xs_id) or xs_id to index entry, first entry wins """
+        key = (by_reach, digits)
+        if key not in self._lookups:
+            lookup = {}
+            for entry in self.index:
+                xs_id = entry[2] if digits is None else round(entry[2], digits)
+                lookup.setdefault((entry[0], entry[1], xs_id) if by_reach else xs_id, entry)
+            self._lookups[key] = lookup
+        return self._lookups[key]
+
+    def _read(self, entry, blocks):
+        with open(self.geofile, 'rb') as infile:
+            infile.seek(entry[4])
+            text = infile.read(entry[5] - entry[4]).decode(ENCODING)
+        lines = text.splitlines(True)
+        return parse_cross_section(Header(entry[0], entry[1], entry[2], entry[3]), lines, blocks)
+
+    def return_xs(self, xs_id, river, reach, strip=True, rnd=False, digits=0, blocks=None):
+        """
+        Returns CrossSection, raises CrossSectionNotFound. River and reach names are always compared
+        stripped, strip is accepted for parserasgeo compatibility.
+        """
+        digits = int(digits) if rnd else None
+        xs_id = float(xs_id) if digits is None else round(float(xs_id), digits)
+        entry = self._lookup(True, digits).get((river.strip(), reach.strip(), xs_id))
+        if entry is None:
+            raise CrossSectionNotFound
+        return self._read(entry, self.blocks if blocks is None else blocks)
+
+    def return_xs_by_id(self, xs_id, rnd=False, digits=0, blocks=None):
+        """ Returns first CrossSection with xs_id in any river/reach, raises CrossSectionNotFound """
+        digits = int(digits) if rnd else None
+        xs_id = float(xs_id) if digits is None else round(float(xs_id), digits)
+        entry = self._lookup(False, digits).get(xs_id)
+        if entry is None:
+            raise CrossSectionNotFound
+        return self._read(entry, self.blocks if blocks is None else blocks)
+
+    def iter_cross_sections(self, blocks=None, wanted=None):
+        return iter_cross_sections(self.geofile, self.blocks if blocks is None else blocks, wanted)
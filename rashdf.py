@@ -0,0 +1,218 @@
+"""
+Reads steady flow results directly from a HEC-RAS plan results file (.p##.hdf) so bfetool, XStest, and the
+extents tools don't need a profile table exported to csv from the RAS GUI. Water surface elevations, top
+widths, and water surface extent stations are read for all profiles and cross sections as (profiles, cross
+sections) arrays, cumulative channel lengths are calculated from the cross section downstream reach lengths.
+
+Top width and extent stations are only in the plan file when they were selected as additional output
+variables in RAS, they are None when missing. h5py is only required to read plan files.
+"""
+import numpy as np
+
+import gisio
+
+EXTENSION = '.hdf'
+XS_ATTRIBUTES = 'Geometry/Cross Sections/Attributes'
+STEADY_PROFILES = 'Results/Steady/Output/Output Blocks/Base Output/Steady Profiles'
+PROFILE_NAMES = STEADY_PROFILES + '/Profile Names'
+XS_RESULTS = STEADY_PROFILES + '/Cross Sections'
+ADDITIONAL_RESULTS = XS_RESULTS + '/Additional Variables'
+
+# Dataset names of each result in XS_RESULTS or ADDITIONAL_RESULTS, the first one found is used. Names
+# differ between RAS versions.
+WSEL = ('Water Surface',)
+TOP_WIDTH = ('Top Width', 'Top Width Total')
+LEFT_STA = ('Left Sta WS', 'Sta WS Lft', 'Sta W.S. Lft')
+RIGHT_STA = ('Right Sta WS', 'Sta WS Rgt', 'Sta W.S. Rgt')
+
+# Profiles read at once from datasets that aren't chunked
+READ_ROWS = 64
+
+
+def is_plan_file(filename):
+    """ Returns True if filename is a HEC-RAS plan results file rather than a csv """
+    return filename.lower().endswith(EXTENSION)
+
+
+def _text(values):
+    """ Returns list of str from an array of fixed width bytes """
+    return [value.decode('utf-8').strip() if isinstance(value, bytes) and not isinstance(value, str)
+            else value.strip() for value in values.tolist()]
+
+
+def _xs_id(river_sta):
+    """
+    Returns cross section id of RAS river station text as a number, None if it isn't a number. Interpolated
+    cross sections end with '*'.
+    """
+    try:
+        return float(river_sta.split()[0].rstrip('*'))
+    except (ValueError, IndexError):
+        return None
+
+
+def _find(hdf, names):
+    """ Returns the first dataset of names in XS_RESULTS or ADDITIONAL_RESULTS, None if not found """
+    for group in (XS_RESULTS, ADDITIONAL_RESULTS):
+        for name in names:
+            path = group + '/' + name
+            if path in hdf:
+                return hdf[path]
+    return None
+
+
+def _read_rows(dataset, rows):
+    """
+    Returns rows (profiles) of a (profiles, cross sections) dataset as a float array. Rows are read a chunk of
+    the dataset at a time so large plans aren't read in one piece.
+    :param rows: sorted array of row numbers
+    """
+    if dataset.ndim == 1:
+        return np.asarray(dataset[()], dtype=float).reshape(1, -1)[rows]
+    result = np.empty((len(rows), dataset.shape[1]))
+    step = dataset.chunks[0] if dataset.chunks else READ_ROWS
+    for start in range(0, len(rows), step):
+        block = rows[start:start + step]
+        first = int(block[0])
+        result[start:start + len(block)] = dataset[first:int(block[-1]) + 1][block - first]
+    return result
+
+
+def cumulative_lengths(rivers, reaches, channel_lengths):
+    """
+    Returns the channel distance of each cross section from the downstream cross section of its reach, like
+    the RAS 'Cum Ch Len' column
+    :param rivers, reaches: river and reach of each cross section, cross sections of a reach are listed
+        upstream to downstream like the RAS geometry
+    :param channel_lengths: array of channel reach lengths to the next cross section downstream
+    """
+    lengths = np.asarray(channel_lengths, dtype=float).copy()
+    lengths[np.isnan(lengths)] = 0.0
+    result = np.zeros(len(lengths))
+    keys = list(zip(rivers, reaches))
+    start = 0
+    for i in range(1, len(keys) + 1):
+        if i == len(keys) or keys[i] != keys[start]:
+            # The downstream length of the last cross section points past the end of the reach
+            reach_lengths = lengths[start:i].copy()
+            reach_lengths[-1] = 0.0
+            result[start:i] = np.cumsum(reach_lengths[::-1])[::-1]
+            start = i
+    return result
+
+
+class PlanResults(object):
+    """
+    Steady flow results of a plan. Arrays of results have one row per profile and one column per cross
+    section, top_width, left_sta and right_sta are None if they weren't output by RAS.
+    """
+    def __init__(self, rivers, reaches, xs_ids, profiles, cum_length, wsel, top_width=None, left_sta=None,
+                 right_sta=None):
+        self.rivers = rivers
+        self.reaches = reaches
+        self.xs_ids = xs_ids
+        self.profiles = profiles
+        self.cum_length = cum_length
+        self.wsel = wsel
+        self.top_width = top_width
+        self.left_sta = left_sta
+        self.right_sta = right_sta
+
+    def __len__(self):
+        return len(self.xs_ids)
+
+    def _rows(self):
+        """
+        Yields (profile number, cross section number, numeric cross section id) of results with a water surface
+        elevation, in RAS profile table order
+        """
+        for xs, river_sta in enumerate(self.xs_ids):
+            xs_id = _xs_id(river_sta)
+            if xs_id is None:
+                continue
+            for profile in range(len(self.profiles)):
+                if not np.isnan(self.wsel[profile, xs]):
+                    yield profile, xs, xs_id
+
+    def river_system_table(self, profile=None):
+        """
+        Returns results of profile as a bfe_core.river_system_table() dict
+        :param profile: profile name, defaults to the first profile
+        """
+        import bfe_core
+        xs, row = np.meshgrid(np.arange(len(self.xs_ids)), np.arange(len(self.profiles)), indexing='ij')
+        xs, row = xs.ravel(), row.ravel()
+        wsel = self.wsel[row, xs]
+        # Cross sections without results are skipped like culvert/bridge lines in a csv
+        has_wsel = ~np.isnan(wsel)
+        xs, row = xs[has_wsel], row[has_wsel]
+        table = {'river': np.array(self.rivers, dtype=object)[xs],
+                 'reach': np.array(self.reaches, dtype=object)[xs],
+                 'ID': np.array([river_sta.split()[0] for river_sta in self.xs_ids], dtype=object)[xs],
+                 'profile': np.array(self.profiles, dtype=object)[row],
+                 'WSEL': wsel[has_wsel],
+                 'cum_length': self.cum_length[xs]}
+        return bfe_core.profile_table(dict((name, table[name]) for name in bfe_core.TABLE_COLUMNS), profile)
+
+    def ws_elevations(self):
+        """ Returns list of extents_core.WS_elevation like extents_core.import_wsel() """
+        import extents_core
+        return [extents_core.WS_elevation(self.rivers[xs], self.reaches[xs], xs_id, self.profiles[profile],
+                                          float(self.wsel[profile, xs])) for profile, xs, xs_id in self._rows()]
+
+    def ws_extents(self):
+        """ Returns list of extents_core.WS_extent like extents_core.import_extents(), None without extent stations """
+        import extents_core
+        if self.left_sta is None or self.right_sta is None:
+            return None
+        extents = []
+        for profile, xs, xs_id in self._rows():
+            left, right = self.left_sta[profile, xs], self.right_sta[profile, xs]
+            if np.isnan(left) or np.isnan(right):
+                continue
+            extents.append(extents_core.WS_extent(self.rivers[xs], self.reaches[xs], xs_id, self.profiles[profile],
+                                                  float(left), float(right), float(self.wsel[profile, xs])))
+        return extents
+
+
+def read_plan_results(filename, profiles=None):
+    """
+    Reads steady flow results of plan results file filename
+    :param profiles: list of profile names to read, all profiles if None
+    :return: PlanResults
+    """
+    try:
+        import h5py
+    except ImportError:
+        gisio.error('h5py is required to read HEC-RAS plan results ' + filename + ', export a csv from RAS instead')
+        raise
+    with h5py.File(filename, 'r') as hdf:
+        if XS_ATTRIBUTES not in hdf or PROFILE_NAMES not in hdf:
+            gisio.error(filename + ' does not have steady flow results. Has the plan been run?')
+            raise ValueError('No steady flow results in ' + filename)
+        attributes = hdf[XS_ATTRIBUTES][()]
+        rivers = _text(attributes['River'])
+        reaches = _text(attributes['Reach'])
+        xs_ids = _text(attributes['RS'])
+        cum_length = cumulative_lengths(rivers, reaches, attributes['Len Channel'])
+
+        all_profiles = _text(hdf[PROFILE_NAMES][()])
+        if profiles is None:
+            rows = np.arange(len(all_profiles))
+        else:
+            missing = [profile for profile in profiles if profile not in all_profiles]
+            if missing:
+                gisio.error('Profiles ' + ', '.join(missing) + ' not found in ' + filename)
+                raise ValueError('Profiles not found in ' + filename)
+            rows = np.array(sorted(all_profiles.index(profile) for profile in set(profiles)), dtype=np.int64)
+
+        results = {}
+        for name, dataset_names in (('wsel', WSEL), ('top_width', TOP_WIDTH), ('left_sta', LEFT_STA),
+                                    ('right_sta', RIGHT_STA)):
+            dataset = _find(hdf, dataset_names)
+            results[name] = _read_rows(dataset, rows) if dataset is not None else None
+    if results['wsel'] is None:
+        gisio.error('Water surface elevations not found in ' + filename)
+        raise ValueError('No water surface elevations in ' + filename)
+    return PlanResults(rivers, reaches, xs_ids, [all_profiles[row] for row in rows.tolist()], cum_length,
+                       **results)
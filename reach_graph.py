@@ -0,0 +1,266 @@
+"""
+Reach connectivity graph of a HEC-RAS model and a scheduler that runs per reach tasks in topological order.
+The graph is built from the junctions in a RAS geometry file, or by snapping channel alignment end points
+when there is no geometry file. Tasks of a reach start as soon as all reaches upstream of it have finished,
+so independent tributaries run at the same time in a process pool while main stem reaches wait for their
+upstream results.
+
+Reaches are (river, reach) tuples. Channel alignments are digitized from downstream to upstream like
+bfetool expects, the first vertex is the downstream end.
+"""
+import collections
+import csv
+import multiprocessing
+import traceback
+
+import numpy as np
+
+import gisio
+import input_cache
+import rasgeo
+
+JUNCTION = 'Junct Name='
+UP_REACH = 'Up River,Reach='
+DOWN_REACH = 'Dn River,Reach='
+# Alignment end points closer than this are connected, in map units
+SNAP_TOLERANCE = 1.0
+# Seconds to wait for a running task before checking the others
+POLL_SECONDS = 0.05
+
+Junction = collections.namedtuple('Junction', ['name', 'upstream', 'downstream'])
+
+
+class CycleError(Exception):
+    pass
+
+
+class ReachTaskError(Exception):
+    pass
+
+
+def iter_junctions(geofile):
+    """ Yields Junction of every junction in geofile, upstream and downstream are lists of (river, reach) """
+    junction = None
+    with open(geofile, 'rb') as infile:
+        for line in infile:
+            text = line.decode(rasgeo.ENCODING)
+            if text.startswith(JUNCTION):
+                if junction is not None:
+                    yield junction
+                junction = Junction(text[len(JUNCTION):].strip(), [], [])
+            elif text.startswith(rasgeo.RIVER_REACH):
+                if junction is not None:
+                    yield junction
+                junction = None
+            elif junction is not None and text.startswith(UP_REACH):
+                junction.upstream.append(_river_reach(text[len(UP_REACH):]))
+            elif junction is not None and text.startswith(DOWN_REACH):
+                junction.downstream.append(_river_reach(text[len(DOWN_REACH):]))
+    if junction is not None:
+        yield junction
+
+
+def _river_reach(text):
+    fields = text.split(',')
+    return fields[0].strip(), fields[1].strip() if len(fields) > 1 else ''
+
+
+class ReachGraph(object):
+    """ Directed graph of reaches, connections point downstream """
+    def __init__(self):
+        self.downstream = collections.OrderedDict()
+        self.upstream = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.downstream)
+
+    @property
+    def reaches(self):
+        return list(self.downstream)
+
+    def add_reach(self, reach):
+        if reach not in self.downstream:
+            self.downstream[reach] = []
+            self.upstream[reach] = []
+
+    def add_connection(self, upstream, downstream):
+        """ Connects reach upstream to reach downstream, adding the reaches if needed """
+        self.add_reach(upstream)
+        self.add_reach(downstream)
+        if downstream not in self.downstream[upstream]:
+            self.downstream[upstream].append(downstream)
+            self.upstream[downstream].append(upstream)
+
+    def headwaters(self):
+        """ Returns reaches without upstream reaches """
+        return [reach for reach in self.downstream if not self.upstream[reach]]
+
+    def outlets(self):
+        """ Returns reaches without downstream reaches """
+        return [reach for reach in self.downstream if not self.downstream[reach]]
+
+    def topological_order(self):
+        """ Returns reaches with every reach after all reaches upstream of it, raises CycleError """
+        remaining = dict((reach, len(upstream)) for reach, upstream in self.upstream.items())
+        ready = collections.deque(self.headwaters())
+        order = []
+        while ready:
+            reach = ready.popleft()
+            order.append(reach)
+            for down in self.downstream[reach]:
+                remaining[down] -= 1
+                if remaining[down] == 0:
+                    ready.append(down)
+        if len(order) < len(self):
+            cycle = [reach for reach in self.downstream if remaining[reach] > 0]
+            raise CycleError('Reaches are connected in a loop: ' + ', '.join(' '.join(reach) for reach in cycle))
+        return order
+
+    def levels(self):
+        """
+        Returns list of lists of reaches, a reach is one level below its lowest upstream reach. Reaches of a
+        level don't depend on each other, the largest level is the most reaches that can run at once.
+        """
+        level = {}
+        for reach in self.topological_order():
+            level[reach] = max([level[up] + 1 for up in self.upstream[reach]] or [0])
+        levels = [[] for _ in range(max(level.values()) + 1 if level else 0)]
+        for reach in self.downstream:
+            levels[level[reach]].append(reach)
+        return levels
+
+    def max_parallelism(self):
+        """ Returns number of reaches in the largest level """
+        return max([len(level) for level in self.levels()] or [0])
+
+    @classmethod
+    def from_geometry(cls, geofile):
+        """ Builds the graph from the reaches and junctions of RAS geometry file geofile """
+        graph = cls()
+        for river, reach in _geometry_reaches(geofile):
+            graph.add_reach((river, reach))
+        for junction in iter_junctions(geofile):
+            for up in junction.upstream:
+                for down in junction.downstream:
+                    graph.add_connection(up, down)
+        return graph
+
+    @classmethod
+    def from_alignments(cls, backend, filename, river_field, reach_field, tolerance=SNAP_TOLERANCE):
+        """
+        Builds the graph from channel alignments, a reach flows into the reaches whose upstream end is within
+        tolerance of its downstream end
+        """
+        fields = [river_field, reach_field]
+        channels = input_cache.feature_arrays(backend, filename, fields)
+        keys = [(river.strip(), reach.strip()) for river, reach in
+                zip(channels.column(river_field).tolist(), channels.column(reach_field).tolist())]
+        graph = cls()
+        for key in keys:
+            graph.add_reach(key)
+        has_parts = channels.feature_offsets[1:] > channels.feature_offsets[:-1]
+        features = np.flatnonzero(has_parts)
+        down_ends = channels.coords[channels.part_offsets[channels.feature_offsets[features]]]
+        up_ends = channels.coords[channels.part_offsets[channels.feature_offsets[features + 1]] - 1]
+        for i, down_end in zip(features.tolist(), down_ends):
+            distances = np.hypot(up_ends[:, 0] - down_end[0], up_ends[:, 1] - down_end[1])
+            for j in features[distances <= tolerance].tolist():
+                if keys[j] != keys[i]:
+                    graph.add_connection(keys[i], keys[j])
+        return graph
+
+
+def write_graph(graph, filename):
+    """ Writes river, reach, level, and downstream reaches of every reach to csv filename """
+    levels = graph.levels()
+    with gisio.open_csv(filename) as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['river', 'reach', 'level', 'downstream'])
+        for number, level in enumerate(levels):
+            for river, reach in level:
+                writer.writerow([river, reach, number,
+                                 '; '.join(' '.join(down) for down in graph.downstream[(river, reach)])])
+    gisio.message('{} reaches in {} levels, up to {} reaches run at once. Written to {}'.format(
+        len(graph), len(levels), graph.max_parallelism(), filename))
+
+
+def _geometry_reaches(geofile):
+    """ Returns (river, reach) of every reach in geofile in file order """
+    reaches = []
+    with open(geofile, 'rb') as infile:
+        for line in infile:
+            text = line.decode(rasgeo.ENCODING)
+            if text.startswith(rasgeo.RIVER_REACH):
+                reach = rasgeo.parse_river_reach(text)
+                if reach not in reaches:
+                    reaches.append(reach)
+    return reaches
+
+
+def _run_task(task, reach, upstream_results, args):
+    """ Runs task in a worker, returns (reach, error text or None, result) so errors reach the scheduler """
+    try:
+        return reach, None, task(reach, upstream_results, *args)
+    except Exception:
+        return reach, traceback.format_exc(), None
+
+
+def run_reaches(graph, task, workers=1, args=()):
+    """
+    Runs task(reach, upstream_results, *args) for every reach of graph after the tasks of all reaches upstream
+    of it have finished. upstream_results is a dict of upstream reach: result of its task.
+
+    :param task: module level function so it can be sent to worker processes
+    :param workers: number of worker processes, 1 runs the tasks in this process in topological order
+    :return: OrderedDict of reach: result in topological order
+    """
+    order = graph.topological_order()
+    results = {}
+    if workers <= 1 or len(order) < 2:
+        for reach in order:
+            results[reach] = task(reach, dict((up, results[up]) for up in graph.upstream[reach]), *args)
+        return collections.OrderedDict((reach, results[reach]) for reach in order)
+
+    remaining = dict((reach, len(graph.upstream[reach])) for reach in order)
+    pool = multiprocessing.Pool(min(workers, graph.max_parallelism()))
+    # reach: AsyncResult of tasks that haven't been collected. Results are polled rather than collected with
+    # a callback so pool errors, e.g. arguments or a result that can't be pickled, fail the task instead of
+    # never arriving.
+    pending = collections.OrderedDict()
+    errors = []
+    try:
+        def submit(reach):
+            upstream_results = dict((up, results[up]) for up in graph.upstream[reach])
+            pending[reach] = pool.apply_async(_run_task, (task, reach, upstream_results, args))
+
+        for reach in graph.headwaters():
+            submit(reach)
+        while pending:
+            done = [reach for reach, async_result in pending.items() if async_result.ready()]
+            if not done:
+                next(iter(pending.values())).wait(POLL_SECONDS)
+                continue
+            for reach in done:
+                try:
+                    _, error_text, result = pending.pop(reach).get()
+                except Exception:
+                    error_text, result = traceback.format_exc(), None
+                if error_text is not None:
+                    errors.append((reach, error_text))
+                    continue
+                results[reach] = result
+                if errors:
+                    # Let running tasks finish, but don't start reaches below them
+                    continue
+                for down in graph.downstream[reach]:
+                    remaining[down] -= 1
+                    if remaining[down] == 0:
+                        submit(down)
+    finally:
+        pool.close()
+        pool.join()
+    if errors:
+        for reach, error_text in errors:
+            gisio.error('Task of ' + ' '.join(reach) + ' failed:\n' + error_text)
+        raise ReachTaskError('{} reach tasks failed'.format(len(errors)))
+    return collections.OrderedDict((reach, results[reach]) for reach in order)
@@ -0,0 +1,506 @@
+"""
+Synthetic benchmark and golden output check for the n-value, IEFA, obstruction, and top width review tools.
+'generate' writes a synthetic HEC-RAS geometry file with matching cross section cut lines and a floodplain,
+'run' times each tool stage, records peak memory, and compares the outputs to golden outputs from an earlier
+run. Optimized code paths can be checked for speed and identical results on the same inputs.
+
+    python review_benchmark.py generate bench --xs 5000 --reaches 4 --skew-fraction 0.3
+    python review_benchmark.py run bench --update-golden
+    python review_benchmark.py run bench --repeat 3 --tools nvalue topwidth
+
+Each tool runs in a new interpreter so peak memory and parsing times aren't shared between tools. Stage
+times are measured by timing the functions listed in STAGES, the rest of the run ('other') is looking up
+cross sections and writing the output. The segment cache is turned off so segments are always built.
+
+Cut line lengths match the skew corrected RAS cross section widths plus LENGTH_MARGIN. Every reach is a ring
+of one floodplain polygon whose edges cross the cut lines, some cut line ends are inside the floodplain.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+import gisio
+import shpfile
+
+GEOFILE = 'model.g01'
+CUT_LINES = 'xs.shp'
+FLOODPLAIN = 'floodplain.shp'
+SETTINGS = 'benchmark.json'
+OUT_DIR = 'out'
+GOLDEN_DIR = 'golden'
+XS_ID_FIELD = 'XS_ID'
+RIVER_FIELD = 'River'
+REACH_FIELD = 'Reach'
+
+XS_SPACING = 100.0
+N_VALUES = (0.03, 0.035, 0.04, 0.05, 0.06, 0.08, 0.1, 0.12)
+# Cut lines are this much longer than the RAS cross section, n-value review fails if RAS is longer
+LENGTH_MARGIN = 0.5
+# Output coordinates and values closer than this match the golden output
+TOLERANCE = 1e-6
+SHAPEFILE_EXTENSIONS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+TOOLS = ('nvalue', 'iefa', 'blocked', 'topwidth')
+# Tool: (label, module, function name) of the functions timed as stages. Modules are fhad.TOOL_MODULES names
+# or plain module names.
+STAGES = {
+    'nvalue': [('index geometry', 'input_cache', 'ras_geometry'),
+               ('read cut lines', 'input_cache', 'feature_arrays'),
+               ('n-value qa', 'n_value_review', 'n_value_check'),
+               ('parse cross sections', 'rasgeo.RASGeometry', 'return_xs'),
+               ('segments', 'n_value_core', 'create_n_value_segments')],
+    'iefa': [('index geometry', 'input_cache', 'ras_geometry'),
+             ('read cut lines', 'input_cache', 'feature_arrays'),
+             ('parse cross sections', 'rasgeo.RASGeometry', 'return_xs'),
+             ('segments', 'iefa_core', 'create_iefa_segments')],
+    'blocked': [('index geometry', 'input_cache', 'ras_geometry'),
+                ('read cut lines', 'input_cache', 'feature_arrays'),
+                ('parse cross sections', 'rasgeo.RASGeometry', 'return_xs'),
+                ('segments', 'blocked_core', 'create_blocked_segments')],
+    'topwidth': [('read floodplain', 'twcheck', '_get_fp_geo'),
+                 ('read cut lines', 'twcheck', '_get_xs_geo'),
+                 ('index floodplain', 'tw_core', 'FloodplainIndex'),
+                 ('measure', 'tw_core', 'measure_cross_sections'),
+                 ('write', 'twcheck', '_export_tw_points_to_shapefile')],
+}
+REVIEW_MODULES = {'nvalue': 'n_value_review', 'iefa': 'iefa_review', 'blocked': 'blocked_review',
+                  'topwidth': 'twcheck'}
+
+
+# ------------------------------------- Synthetic inputs -------------------------------------
+# Only random() is used so the same seed gives the same model on python 2 and 3
+def _randint(rng, low, high):
+    """ Returns integer from low to high inclusive """
+    return low + int(rng.random() * (high - low + 1))
+
+
+def _sample(rng, values, count):
+    """ Returns count values of list values in their original order """
+    values = list(values)
+    picked = set()
+    while len(picked) < min(count, len(values)):
+        picked.add(_randint(rng, 0, len(values) - 1))
+    return [values[i] for i in sorted(picked)]
+
+
+def _fixed_width(values, per_line):
+    """ Returns RAS geometry lines of values, per_line 8 character fields per line """
+    fields = ['{:8.2f}'.format(value) for value in values]
+    return [''.join(fields[i:i + per_line]) for i in range(0, len(fields), per_line)]
+
+
+def _station_blocks(rng, first, last, count):
+    """ Returns up to count non-overlapping (start, end, elevation) blocks between first and last """
+    edges = sorted(set(round(first + (last - first) * rng.random(), 1) for _ in range(count * 2)))
+    return [(start, end, round(5300.0 + 10 * rng.random(), 2)) for start, end in zip(edges[::2], edges[1::2])
+            if start < end]
+
+
+def _left_right_blocks(rng, first, last, elevation):
+    """ Returns normal (type 0) left and right blocks, the left one starts at first and the right ends at last """
+    width = last - first
+    return [(first, round(first + width * (0.05 + 0.25 * rng.random()), 1), elevation),
+            (round(last - width * (0.05 + 0.25 * rng.random()), 1), last, elevation)]
+
+
+def _block_lines(key, rng, first, last, block_type):
+    """ Returns lines of a '#XS Ineff=' or '#Block Obstruct=' block with 0 (normal) or -1 (blocked) type """
+    if block_type == 0:
+        blocks = _left_right_blocks(rng, first, last, round(5300.0 + 10 * rng.random(), 2))
+    else:
+        blocks = _station_blocks(rng, first, last, _randint(rng, 1, 4)) or [(first + 1.0, first + 2.0, 5301.0)]
+    values = [value for block in blocks for value in block]
+    return ['{} {} ,{} '.format(key, len(blocks), block_type)] + _fixed_width(values, 9)
+
+
+def _cross_section(rng, settings, xs_id):
+    """ Returns (lines of a RAS cross section, skew corrected width) """
+    offset = round(settings['max_offset'] * rng.random(), 1)
+    num_points = _randint(rng, settings['points'][0], settings['points'][1])
+    stations = sorted(set(offset + _randint(rng, 0, 20 * num_points) for _ in range(num_points)))
+    if len(stations) < 4:
+        stations = [offset, offset + 10.0, offset + 20.0, offset + 30.0]
+    stations = [float(station) for station in stations]
+    center = (stations[0] + stations[-1]) / 2
+    sta_elev = []
+    for station in stations:
+        sta_elev += [station, round(5290.0 + 0.02 * abs(station - center) + rng.random(), 2)]
+
+    num_n = _randint(rng, settings['n_breaks'][0], settings['n_breaks'][1])
+    n_stations = [stations[0]] + _sample(rng, stations[1:-1], num_n - 1)
+    mannings = []
+    for station in n_stations:
+        mannings += [station, N_VALUES[_randint(rng, 0, len(N_VALUES) - 1)], 0]
+
+    lines = ['Type RM Length L Ch R = 1 ,{:<8},{},{},{}'.format(xs_id, XS_SPACING, XS_SPACING, XS_SPACING),
+             '#Sta/Elev= {} '.format(len(stations))] + _fixed_width(sta_elev, 10)
+    lines += ['#Mann= {} , 0 , 0 '.format(len(n_stations))]
+    lines += _mannings_lines(mannings)
+    banks = n_stations[1:3] if len(n_stations) > 2 else [stations[1], stations[-2]]
+    lines.append('Bank Sta={},{}'.format(banks[0], banks[-1]))
+
+    if rng.random() < settings['iefa_fraction']:
+        lines += _block_lines('#XS Ineff=', rng, stations[0], stations[-1], _block_type(rng, settings['iefa_types']))
+        lines += ['Permanent Ineff=', '       F       F']
+    if rng.random() < settings['blocked_fraction']:
+        lines += _block_lines('#Block Obstruct=', rng, stations[0], stations[-1],
+                              _block_type(rng, settings['blocked_types']))
+    skew = 0
+    if rng.random() < settings['skew_fraction']:
+        skew = _randint(rng, 5, 40)
+        lines.append('Skew Angle= {} '.format(skew))
+    lines.append('')
+    return lines, (stations[-1] - stations[0]) / math.cos(math.radians(skew))
+
+
+def _mannings_lines(mannings):
+    """ Returns '#Mann=' value lines, three values per n-value and nine per line """
+    fields = []
+    for i in range(0, len(mannings), 3):
+        fields += ['{:8.2f}'.format(mannings[i]), '{:8.3f}'.format(mannings[i + 1]), '{:8d}'.format(mannings[i + 2])]
+    return [''.join(fields[i:i + 9]) for i in range(0, len(fields), 9)]
+
+
+def _block_type(rng, types):
+    if types == 'normal':
+        return 0
+    if types == 'blocked':
+        return -1
+    return 0 if rng.random() < 0.5 else -1
+
+
+def _cut_line(x, y_center, length, bend):
+    """ Returns (3, 2) array, a cut line across the channel of length with its middle vertex moved by bend """
+    half = length / 2
+    bend = min(bend, 0.9 * half)
+    rise = math.sqrt(half * half - bend * bend)
+    return np.array([[x, y_center - rise], [x + bend, y_center], [x, y_center + rise]])
+
+
+def generate(directory, num_xs=2000, reaches=2, seed=1, points=(20, 200), n_breaks=(3, 7), iefa_fraction=0.3,
+             iefa_types='both', blocked_fraction=0.2, blocked_types='both', skew_fraction=0.2, max_offset=500.0):
+    """
+    Writes GEOFILE, CUT_LINES, FLOODPLAIN, and SETTINGS to directory
+
+    :param num_xs: number of cross sections, split evenly between reaches
+    :param points: (min, max) sta/elev points per cross section
+    :param n_breaks: (min, max) n-values per cross section
+    :param iefa_fraction, blocked_fraction: fraction of cross sections with ineffective flow areas and obstructions
+    :param iefa_types, blocked_types: 'normal' (left/right), 'blocked' (multiple blocks), or 'both'
+    :param skew_fraction: fraction of skewed cross sections
+    :param max_offset: largest first station of a cross section
+    """
+    settings = {'xs': num_xs, 'reaches': reaches, 'seed': seed, 'points': list(points), 'n_breaks': list(n_breaks),
+                'iefa_fraction': iefa_fraction, 'iefa_types': iefa_types, 'blocked_fraction': blocked_fraction,
+                'blocked_types': blocked_types, 'skew_fraction': skew_fraction, 'max_offset': max_offset}
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    rng = random.Random(seed)
+    per_reach = max(1, num_xs // reaches)
+    geo_lines = ['Geom Title=Review benchmark {} cross sections seed {}'.format(num_xs, seed),
+                 'Program Version=5.07', '']
+    cut_lines = []
+    rings = []
+    for reach in range(reaches):
+        river_name, reach_name = 'Creek {}'.format(reach + 1), 'Reach {}'.format(reach + 1)
+        geo_lines += ['River Reach={:<16},{:<16}'.format(river_name, reach_name), '']
+        # Reaches are side by side, cross sections run upstream to downstream like the RAS geometry
+        y_center = reach * 100000.0
+        left, right = [], []
+        for k in range(per_reach):
+            xs_id = round((per_reach - k) * XS_SPACING + 0.5, 1)
+            lines, width = _cross_section(rng, settings, xs_id)
+            geo_lines += lines
+            x = k * XS_SPACING
+            line = _cut_line(x, y_center, width + LENGTH_MARGIN, XS_SPACING * 0.2 * rng.random())
+            cut_lines.append(([line], [xs_id, river_name, reach_name]))
+            # Floodplain edges cross most cut lines, about one end in ten is inside the floodplain
+            half = (line[2, 1] - line[0, 1]) / 2
+            left.append((x, y_center + half * (1.1 if rng.random() < 0.1 else 0.3 + 0.6 * rng.random())))
+            right.append((x, y_center - half * (1.1 if rng.random() < 0.1 else 0.3 + 0.6 * rng.random())))
+        ring = [(-XS_SPACING / 2, left[0][1])] + left + [((per_reach - 0.5) * XS_SPACING, left[-1][1]),
+                                                          ((per_reach - 0.5) * XS_SPACING, right[-1][1])]
+        ring += right[::-1] + [(-XS_SPACING / 2, right[0][1])]
+        rings.append(np.array(ring + ring[:1]))
+
+    with open(os.path.join(directory, GEOFILE), 'w') as outfile:
+        outfile.write('\n'.join(geo_lines) + '\n')
+
+    backend = gisio.get_backend(gisio.PYTHON)
+    cut_file = os.path.join(directory, CUT_LINES)
+    backend.create_output(cut_file, 'POLYLINE', [gisio.float_field(XS_ID_FIELD), gisio.text_field(RIVER_FIELD, 50),
+                                                 gisio.text_field(REACH_FIELD, 50)], None)
+    backend.write_features(cut_file, [XS_ID_FIELD, RIVER_FIELD, REACH_FIELD], cut_lines)
+    fp_file = os.path.join(directory, FLOODPLAIN)
+    backend.create_output(fp_file, 'POLYGON', [gisio.text_field('Name', 50)], None)
+    backend.write_features(fp_file, ['Name'], [(rings, ['floodplain'])])
+
+    with open(os.path.join(directory, SETTINGS), 'w') as outfile:
+        json.dump(settings, outfile, indent=2, sort_keys=True)
+    print('Wrote {} cross sections in {} reaches to {}'.format(per_reach * reaches, reaches, directory))
+
+
+# ------------------------------------- Measuring -------------------------------------
+class _StageTimer(object):
+    """ Replaces functions with wrappers that add their run time to a stage total, restore() puts them back """
+    def __init__(self):
+        self.seconds = {}
+        self.replaced = []
+
+    def wrap(self, label, owner, name):
+        original = owner.__dict__[name]
+        self.seconds.setdefault(label, 0.0)
+        depth = [0]
+
+        def timed(*args, **kwargs):
+            # Recursive and nested calls are only counted once
+            depth[0] += 1
+            start = time.time()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                depth[0] -= 1
+                if depth[0] == 0:
+                    self.seconds[label] += time.time() - start
+        setattr(owner, name, timed)
+        self.replaced.append((owner, name, original))
+
+    def restore(self):
+        for owner, name, original in reversed(self.replaced):
+            setattr(owner, name, original)
+        self.replaced = []
+
+
+def _stage_owner(name):
+    """ Returns module or class for a STAGES module name """
+    import fhad
+    module_name, _, class_name = name.partition('.')
+    if module_name in fhad.TOOL_MODULES:
+        module = fhad.load_tool(module_name)
+    else:
+        __import__(module_name)
+        module = sys.modules[module_name]
+    return getattr(module, class_name) if class_name else module
+
+
+def peak_memory_mb():
+    """ Returns peak memory of this process in MB, None if it can't be measured """
+    # ru_maxrss of a new process on linux starts at the peak of the process that started it
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1048576.0
+    # bytes on mac
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1048576.0
+
+
+def tool_params(directory, tool, outfile):
+    """ Returns fhad.py tool parameters for tool on the benchmark in directory """
+    if tool == 'topwidth':
+        return {'floodplain': os.path.join(directory, FLOODPLAIN), 'cross_sections': os.path.join(directory, CUT_LINES),
+                'xs_id_field': XS_ID_FIELD, 'outfile': outfile}
+    return {'geofile': os.path.join(directory, GEOFILE), 'cross_sections': os.path.join(directory, CUT_LINES),
+            'xs_id_field': XS_ID_FIELD, 'river_field': RIVER_FIELD, 'reach_field': REACH_FIELD, 'outfile': outfile}
+
+
+def measure(directory, tool, outfile):
+    """ Runs tool once in this process, returns dict of stage: seconds, 'total', and 'peak_mb' """
+    import fhad
+    # The tool adds its folder to sys.path for its core module
+    fhad.load_tool(REVIEW_MODULES[tool])
+    timer = _StageTimer()
+    for label, owner, name in STAGES[tool]:
+        timer.wrap(label, _stage_owner(owner), name)
+    stdout = sys.stdout
+    start = time.time()
+    try:
+        # Tool messages would swamp the results
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+            fhad.TOOLS[tool](tool_params(directory, tool, outfile), gisio.get_backend(gisio.PYTHON))
+    finally:
+        sys.stdout = stdout
+        timer.restore()
+    result = dict(timer.seconds)
+    result['total'] = time.time() - start
+    result['peak_mb'] = peak_memory_mb()
+    return result
+
+
+def _measure_in_subprocess(directory, tool, outfile):
+    env = dict(os.environ)
+    env['FHAD_SEGMENT_CACHE'] = 'off'
+    env[gisio.BACKEND_ENV] = gisio.PYTHON
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), 'measure', directory, tool,
+                                      outfile], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+# ------------------------------------- Golden outputs -------------------------------------
+def _same_value(value1, value2):
+    if isinstance(value1, float) and isinstance(value2, float):
+        return abs(value1 - value2) <= TOLERANCE * max(1.0, abs(value1))
+    if isinstance(value1, gisio.string_types) and isinstance(value2, gisio.string_types):
+        return value1.strip() == value2.strip()
+    return value1 == value2
+
+
+def _same_geometry(geometry1, geometry2):
+    if geometry1 is None or geometry2 is None:
+        return geometry1 is None and geometry2 is None
+    if isinstance(geometry1, tuple):
+        return np.allclose(geometry1, geometry2, rtol=0, atol=TOLERANCE)
+    return len(geometry1) == len(geometry2) and all(
+        part1.shape == part2.shape and np.allclose(part1, part2, rtol=0, atol=TOLERANCE)
+        for part1, part2 in zip(geometry1, geometry2))
+
+
+def compare_outputs(output, golden, field_names, max_reported=5):
+    """
+    Compares features of output to golden in order
+    :return: list of difference descriptions, empty if output matches
+    """
+    backend = gisio.get_backend(gisio.PYTHON)
+    features = list(backend.read_features(output, field_names))
+    golden_features = list(backend.read_features(golden, field_names))
+    differences = []
+    if len(features) != len(golden_features):
+        differences.append('{} features, golden output has {}'.format(len(features), len(golden_features)))
+    for i, ((geometry, values), (golden_geometry, golden_values)) in enumerate(zip(features, golden_features)):
+        if not _same_geometry(geometry, golden_geometry):
+            differences.append('feature {} geometry differs'.format(i))
+        for name, value, golden_value in zip(field_names, values, golden_values):
+            if not _same_value(value, golden_value):
+                differences.append('feature {} {} is {!r}, golden output has {!r}'.format(i, name, value,
+                                                                                          golden_value))
+        if len(differences) >= max_reported:
+            differences.append('...')
+            break
+    return differences
+
+
+def output_field_names(tool):
+    import fhad
+    module = fhad.load_tool(REVIEW_MODULES[tool])
+    if tool == 'topwidth':
+        fields = module.output_fields(XS_ID_FIELD)
+    else:
+        fields = module.output_fields(XS_ID_FIELD, RIVER_FIELD, REACH_FIELD)
+    return [field.name for field in fields]
+
+
+def _copy_shapefile(source, destination):
+    for extension in SHAPEFILE_EXTENSIONS:
+        if os.path.isfile(shpfile.base_name(source) + extension):
+            shutil.copyfile(shpfile.base_name(source) + extension, shpfile.base_name(destination) + extension)
+
+
+def run(directory, tools=TOOLS, repeat=1, update_golden=False):
+    """
+    Times tools on the benchmark in directory and checks their outputs against the golden outputs
+    :return: True if all outputs match
+    """
+    out_dir = os.path.join(directory, OUT_DIR)
+    golden_dir = os.path.join(directory, GOLDEN_DIR)
+    for folder in (out_dir, golden_dir):
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    all_match = True
+    for tool in tools:
+        outfile = os.path.join(out_dir, tool + '.shp')
+        golden = os.path.join(golden_dir, tool + '.shp')
+        differences = []
+        results = [_measure_in_subprocess(directory, tool, outfile) for _ in range(repeat)]
+        best = min(results, key=lambda result: result['total'])
+
+        if update_golden:
+            _copy_shapefile(outfile, golden)
+            status = 'golden output updated'
+        elif not os.path.isfile(golden):
+            status = 'no golden output, run with --update-golden'
+        else:
+            differences = compare_outputs(outfile, golden, output_field_names(tool))
+            status = 'matches golden output' if not differences else 'DIFFERS from golden output'
+            all_match = all_match and not differences
+
+        print('\n{} ({} of {} runs, {})'.format(tool, 'best' if repeat > 1 else 'one', repeat, status))
+        staged = 0.0
+        for label, _, _ in STAGES[tool]:
+            staged += best[label]
+            print('    {:<22} {:>10.1f} ms'.format(label, best[label] * 1000))
+        print('    {:<22} {:>10.1f} ms'.format('other', (best['total'] - staged) * 1000))
+        print('    {:<22} {:>10.1f} ms'.format('total', best['total'] * 1000))
+        if best['peak_mb'] is not None:
+            print('    {:<22} {:>10.1f} MB'.format('peak memory', max(result['peak_mb'] for result in results)))
+        for difference in differences:
+            print('    ' + difference)
+    return all_match
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Synthetic benchmark and golden output check of the review tools')
+    subparsers = parser.add_subparsers(dest='command')
+
+    sub = subparsers.add_parser('generate', help='write synthetic geometry, cut lines, and floodplain')
+    sub.add_argument('directory')
+    sub.add_argument('--xs', type=int, default=2000, help='number of cross sections')
+    sub.add_argument('--reaches', type=int, default=2)
+    sub.add_argument('--seed', type=int, default=1)
+    sub.add_argument('--points', type=int, nargs=2, default=[20, 200], help='min and max sta/elev points')
+    sub.add_argument('--n-breaks', type=int, nargs=2, default=[3, 7], help='min and max n-values')
+    sub.add_argument('--iefa-fraction', type=float, default=0.3)
+    sub.add_argument('--iefa-types', choices=['normal', 'blocked', 'both'], default='both')
+    sub.add_argument('--blocked-fraction', type=float, default=0.2)
+    sub.add_argument('--blocked-types', choices=['normal', 'blocked', 'both'], default='both')
+    sub.add_argument('--skew-fraction', type=float, default=0.2)
+    sub.add_argument('--max-offset', type=float, default=500.0, help='largest first station')
+
+    sub = subparsers.add_parser('run', help='time the tools and compare outputs to the golden outputs')
+    sub.add_argument('directory')
+    sub.add_argument('--tools', nargs='+', choices=TOOLS, default=list(TOOLS))
+    sub.add_argument('--repeat', type=int, default=1, help='runs per tool, the fastest is reported')
+    sub.add_argument('--update-golden', action='store_true', help='replace the golden outputs with these outputs')
+
+    # Used by 'run' to measure one tool in a new interpreter
+    sub = subparsers.add_parser('measure')
+    sub.add_argument('directory')
+    sub.add_argument('tool', choices=TOOLS)
+    sub.add_argument('outfile')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        generate(args.directory, args.xs, args.reaches, args.seed, args.points, args.n_breaks, args.iefa_fraction,
+                 args.iefa_types, args.blocked_fraction, args.blocked_types, args.skew_fraction, args.max_offset)
+    elif args.command == 'run':
+        return 0 if run(args.directory, args.tools, args.repeat, args.update_golden) else 1
+    elif args.command == 'measure':
+        print(json.dumps(measure(args.directory, args.tool, args.outfile)))
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
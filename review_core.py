@@ -0,0 +1,82 @@
+"""
+Shared, arcpy free geometry for the n-value, IEFA, and obstruction review tools. Cross sections are
+handled as (n, 2) numpy arrays of vertices and split into segments wherever a RAS value changes.
+"""
+import numpy as np
+
+
+def line_stations(coords):
+    """
+    Returns cumulative distance along a line at each vertex
+    :param coords: (n, 2) array of vertices
+    :return: (n,) array, first value is 0
+    """
+    coords = np.asarray(coords, dtype=float)
+    seg_len = np.hypot(np.diff(coords[:, 0]), np.diff(coords[:, 1]))
+    return np.concatenate([[0.0], np.cumsum(seg_len)])
+
+
+def line_length(coords):
+    """ Returns length of line defined by coords """
+    return line_stations(coords)[-1]
+
+
+def part_lengths(coords, part_offsets):
+    """
+    Returns length of every part of a multi-line array in one pass
+    :param coords: (n, 2) array of vertices of all parts
+    :param part_offsets: (number of parts + 1) array, index of the first vertex of each part in coords
+    :return: (number of parts,) array, 0 for parts with less than 2 vertices
+    """
+    stations = line_stations(coords)
+    starts = np.asarray(part_offsets[:-1])
+    ends = np.asarray(part_offsets[1:])
+    full = ends - starts > 1
+    lengths = np.zeros(len(starts))
+    lengths[full] = stations[ends[full] - 1] - stations[starts[full]]
+    return lengths
+
+
+def position_along_line(coords, stations, distances):
+    """
+    Equivalent of arcpy Polyline.positionAlongLine() for an array of distances
+    :param coords: (n, 2) array of vertices
+    :param stations: result of line_stations(coords)
+    :param distances: distances along line
+    :return: (len(distances), 2) array of points
+    """
+    distances = np.asarray(distances, dtype=float)
+    x = np.interp(distances, stations, coords[:, 0])
+    y = np.interp(distances, stations, coords[:, 1])
+    return np.column_stack([x, y])
+
+
+def split_line(coords, change_stations, change_values):
+    """
+    Splits a line into segments at change_stations. Segment i runs from change station i to change
+    station i+1 and includes all line vertices between them. The last segment runs to the end of the line.
+    The first change station should be 0, it is placed exactly on the first vertex to avoid rounding.
+
+    :param coords: (n, 2) array of line vertices
+    :param change_stations: sorted list of stations where values change
+    :param change_values: value that starts at each change station
+    :return: list of tuples [((k, 2) array of vertices, value), ...]
+    """
+    coords = np.asarray(coords, dtype=float)
+    stations = line_stations(coords)
+    change_stations = np.asarray(change_stations, dtype=float)
+
+    change_xy = position_along_line(coords, stations, change_stations)
+    change_xy[0] = coords[0]
+
+    # Changes are listed ahead of vertices so they sort first on equal station (stable sort)
+    all_xy = np.vstack([change_xy, coords[1:]])
+    all_sta = np.concatenate([change_stations, stations[1:]])
+    is_change = np.concatenate([np.ones(len(change_stations), bool), np.zeros(len(coords) - 1, bool)])
+    order = np.argsort(all_sta, kind='mergesort')
+    all_xy, is_change = all_xy[order], is_change[order]
+
+    starts = np.nonzero(is_change)[0]
+    ends = np.append(starts[1:], len(all_xy) - 1)
+    values = [change_values[i] for i in np.argsort(change_stations, kind='mergesort')]
+    return [(all_xy[start:end + 1], value) for start, end, value in zip(starts, ends, values)]
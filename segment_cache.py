@@ -0,0 +1,222 @@
+"""
+Content addressed cache of review segments. Entries are keyed by a hash of the cross section cut line
+vertices and the RAS blocks the segments were built from, so rerunning a review tool on unchanged inputs
+reads the segments back instead of rebuilding them, even after the geometry file was edited elsewhere.
+
+Entries are small binary files in CACHE_DIR, the least recently used entries are deleted when the cache
+grows past MAX_BYTES. Set FHAD_SEGMENT_CACHE to another directory, or to 'off' to disable the cache.
+Warnings raised while building segments are stored with them and repeated for cached cross sections, the
+review tools' warnings are part of their output.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+import gisio
+
+# Bump when segment builders change so old entries are ignored
+VERSION = 3
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.fhad', 'segment_cache')
+MAX_BYTES = 200 * 1024 * 1024
+# Fraction of MAX_BYTES kept after eviction, evicting below the limit avoids evicting on every put
+EVICT_TO = 0.8
+ENV_VAR = 'FHAD_SEGMENT_CACHE'
+OFF = 'off'
+EXTENSION = '.seg'
+
+
+class SegmentCache(object):
+    """ Segment cache in directory, see module docstring """
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Total size of entries, found on first put()
+        self._size = None
+
+    @staticmethod
+    def key(tool, coords, inputs):
+        """
+        Returns cache key
+        :param tool: name of the segment builder
+        :param coords: (n, 2) array of cut line vertices
+        :param inputs: repr-able RAS values the segments are built from
+        """
+        digest = hashlib.sha1('{}:{}:'.format(tool, VERSION).encode('utf-8'))
+        digest.update(np.ascontiguousarray(coords, dtype='<f8').tobytes())
+        digest.update(repr(inputs).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key[:2], key + EXTENSION)
+
+    def get(self, key):
+        """
+        Returns (list of ((k, 2) array, value) segments, list of warning texts) for key, or None if not cached
+        """
+        filename = self._filename(key)
+        try:
+            data = np.fromfile(filename, dtype='<f8')
+        except (IOError, OSError):
+            return None
+        try:
+            # Mark as recently used
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return _unpack(data)
+
+    def put(self, key, segments, warnings=()):
+        """ Stores list of ((k, 2) array, float value) segments and warning texts raised building them under key """
+        filename = self._filename(key)
+        directory = os.path.dirname(filename)
+        # Write to a temporary file and rename so other processes never read a partial entry
+        temp_name = '{}.{}.tmp'.format(filename, os.getpid())
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            data = _pack(segments, warnings)
+            data.tofile(temp_name)
+            gisio.replace_file(temp_name, filename)
+        except (IOError, OSError):
+            # The cache is an optimization, a read only or full disk, or another process storing the same entry
+            # on python 2 on Windows, shouldn't stop the tool
+            if os.path.exists(temp_name):
+                try:
+                    os.remove(temp_name)
+                except OSError:
+                    pass
+            return
+        if self._size is None:
+            self._size = self._scan_size()
+        else:
+            self._size += data.nbytes
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        """ Returns list of (mtime, size, filename) of all entries """
+        entries = []
+        for root, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                if not name.endswith(EXTENSION):
+                    continue
+                filename = os.path.join(root, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """ Deletes least recently used entries until the cache is below EVICT_TO * max_bytes """
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * EVICT_TO
+        for _, entry_size, filename in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            size -= entry_size
+        self._size = size
+
+    def clear(self):
+        for _, _, filename in self._entries():
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        self._size = 0
+
+
+def _pack(segments, warnings=()):
+    """
+    Returns segments and warnings as one float64 array:
+    [number of segments, warning bytes, vertex offsets (number + 1), values (number), x, y, x, y, ..., warnings]
+    Warnings are utf-8 texts separated by nul bytes, one byte per float.
+    """
+    coords = [np.asarray(part, dtype=float).reshape(-1, 2) for part, _ in segments]
+    offsets = np.concatenate([[0], np.cumsum([len(part) for part in coords])])
+    values = np.array([value for _, value in segments], dtype=float)
+    text = np.frombuffer(b'\0'.join(_encode(warning) for warning in warnings), dtype=np.uint8).astype(float)
+    return np.concatenate([[len(segments), len(text)], offsets, values] + [part.ravel() for part in coords] +
+                          [text]).astype('<f8')
+
+
+def _unpack(data):
+    """ Returns (list of ((k, 2) array, value), list of warnings) from _pack() array """
+    number = int(data[0])
+    text_length = int(data[1])
+    offsets = data[2:number + 3].astype(np.int64)
+    values = data[number + 3:2 * number + 3].tolist()
+    coords = data[2 * number + 3:len(data) - text_length].reshape(-1, 2)
+    text = data[len(data) - text_length:].astype(np.uint8).tobytes()
+    warnings = [_decode(warning) for warning in text.split(b'\0')] if text_length else []
+    return [(coords[offsets[i]:offsets[i + 1]], value) for i, value in enumerate(values)], warnings
+
+
+def _encode(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+
+def _decode(data):
+    """ Returns utf-8 data as str, bytes are str on python 2 """
+    return data if isinstance(data, str) else data.decode('utf-8')
+
+
+_default = []
+
+
+def default_cache():
+    """ Returns SegmentCache for CACHE_DIR or FHAD_SEGMENT_CACHE, None if the cache is turned off """
+    if not _default:
+        directory = os.environ.get(ENV_VAR, CACHE_DIR)
+        _default.append(None if directory.lower() == OFF else SegmentCache(directory))
+    return _default[0]
+
+
+def cached_segments(cache, tool, coords, inputs, build, core=None):
+    """
+    Returns segments for coords and inputs from cache, calling build() and storing the result on a miss.
+    Exceptions from build() are not cached.
+
+    :param cache: SegmentCache or None to always build
+    :param tool: name of the segment builder
+    :param coords: (n, 2) array of cut line vertices
+    :param inputs: repr-able RAS values build() uses
+    :param build: function returning list of ((k, 2) array, float value)
+    :param core: module whose warn() build() reports through, e.g. n_value_core. Its warnings are stored with
+        the segments and repeated when they are read from the cache.
+    """
+    if cache is None:
+        return build()
+    key = cache.key(tool, coords, inputs)
+    entry = cache.get(key)
+    if entry is not None:
+        segments, warnings = entry
+        for text in warnings if core is not None else []:
+            core.warn(text)
+        return segments
+
+    warnings = []
+    if core is not None:
+        warn = core.warn
+
+        def record(text):
+            warnings.append(text)
+            warn(text)
+        core.warn = record
+    try:
+        segments = build()
+    finally:
+        if core is not None:
+            core.warn = warn
+    cache.put(key, segments, warnings)
+    return segments
@@ -0,0 +1,266 @@
+"""
+Bulk, memory-mapped shapefile reader. All vertices of a shapefile are returned as one flat (n, 2)
+coordinate array with offset arrays marking where each part and each feature starts, the same layout
+the .shp file uses internally:
+
+    coords[part_offsets[j]:part_offsets[j + 1]]                 vertices of part j
+    part_offsets[feature_offsets[i]:feature_offsets[i + 1]]     parts of feature i
+
+The .shp and .shx files are memory-mapped and records are located from the .shx offsets, vertices are
+gathered with numpy fancy indexing so no python objects are created per vertex or per record. Record
+headers are interleaved with the vertices in the .shp so one gather copy into the flat array is
+unavoidable. Attributes are read from a memory-mapped .dbf and converted to typed numpy columns.
+
+The files are unmapped before read_shapefile() returns, ArcGIS will not delete or overwrite a shapefile
+that is mapped by another process.
+"""
+import math
+import mmap
+
+import numpy as np
+
+import shpfile
+
+POINT = 'POINT'
+POLYLINE = 'POLYLINE'
+POLYGON = 'POLYGON'
+SHAPE_NAMES = {shpfile.POINT: POINT, shpfile.POLYLINE: POLYLINE, shpfile.POLYGON: POLYGON}
+
+# Lookup of 2D shape type by shape type code, codes are < 32
+_SHAPE_2D = np.zeros(32, dtype=int)
+for _code, _code_2d in shpfile.SHAPE_2D.items():
+    _SHAPE_2D[_code] = _code_2d
+
+
+class FeatureArrays(object):
+    """
+    Geometry and attributes of all features in a feature class
+
+    coords - (number of vertices, 2) array of x, y
+    part_offsets - (number of parts + 1) array, index of first vertex of each part in coords
+    feature_offsets - (number of features + 1) array, index of first part of each feature in part_offsets
+    columns - dict of attribute name: numpy array with one value per feature
+    """
+    def __init__(self, shape_type, coords, part_offsets, feature_offsets, columns):
+        self.shape_type = shape_type
+        self.coords = coords
+        self.part_offsets = part_offsets
+        self.feature_offsets = feature_offsets
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.feature_offsets) - 1
+
+    def column(self, name):
+        """ Returns attribute column name, case insensitive like ArcGIS """
+        for key in self.columns:
+            if key.upper() == name.upper():
+                return self.columns[key]
+        raise KeyError(name)
+
+    def parts(self, i):
+        """ Returns vertices of feature i as a list of (n, 2) views into coords, one per part """
+        first, last = self.feature_offsets[i], self.feature_offsets[i + 1]
+        offsets = self.part_offsets
+        return [self.coords[offsets[j]:offsets[j + 1]] for j in range(first, last)]
+
+    def geometry(self, i):
+        """ Returns geometry of feature i in the gisio format: (x, y), list of parts, or None """
+        if self.feature_offsets[i] == self.feature_offsets[i + 1]:
+            return None
+        if self.shape_type == POINT:
+            x, y = self.coords[self.part_offsets[self.feature_offsets[i]]]
+            return (float(x), float(y))
+        return self.parts(i)
+
+    def iter_features(self, field_names=None):
+        """ Yields (geometry, [values of field_names]) like gisio Backend.read_features() """
+        if field_names is None:
+            field_names = list(self.columns)
+        values = [_column_values(self.column(name)) for name in field_names]
+        for i in range(len(self)):
+            yield self.geometry(i), [column[i] for column in values]
+
+    @classmethod
+    def from_features(cls, shape_type, features, field_names):
+        """
+        Builds FeatureArrays from gisio features, used by backends that can't read in bulk
+        :param shape_type: 'POINT', 'POLYLINE', or 'POLYGON'
+        :param features: iterable of (geometry, [values of field_names])
+        """
+        parts = []
+        parts_per_feature = []
+        values = [[] for _ in field_names]
+        for geometry, row in features:
+            if geometry is None:
+                geometry = []
+            elif shape_type == POINT:
+                geometry = [np.array([geometry], dtype=float)]
+            parts.extend(np.asarray(part, dtype=float).reshape(-1, 2) for part in geometry)
+            parts_per_feature.append(len(geometry))
+            for column, value in zip(values, row):
+                column.append(value)
+
+        if parts:
+            coords = np.vstack(parts)
+        else:
+            coords = np.empty((0, 2))
+        part_offsets = _offsets([len(part) for part in parts])
+        feature_offsets = _offsets(parts_per_feature)
+        columns = dict((name, _to_column(column)) for name, column in zip(field_names, values))
+        return cls(shape_type, coords, part_offsets, feature_offsets, columns)
+
+
+def _offsets(counts):
+    """ Returns offsets array [0, cumulative counts...] """
+    return np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64)
+
+
+def _to_column(values):
+    """ Converts list of python values to a typed numpy column """
+    if all(isinstance(value, bool) for value in values):
+        return np.array(values, dtype=bool)
+    if all(value is None or isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        if all(isinstance(value, int) for value in values):
+            return np.array(values, dtype=np.int64)
+        return np.array([np.nan if value is None else value for value in values], dtype=float)
+    return np.array(values, dtype=object)
+
+
+def _column_values(column):
+    """ Returns column as list of python values, missing numbers are None """
+    values = column.tolist()
+    if column.dtype.kind == 'f':
+        values = [None if math.isnan(value) else value for value in values]
+    return values
+
+
+# ------------------------------------- Reading -------------------------------------
+def _ranges(starts, counts):
+    """ Returns concatenation of arange(start, start + count) for each start, count """
+    total = counts.sum()
+    begins = np.cumsum(counts) - counts
+    return np.repeat(starts - begins, counts) + np.arange(total)
+
+
+def _gather(buf, dtype, byte_starts, counts):
+    """
+    Gathers counts[i] items of dtype starting at byte_starts[i] of buf into one array. buf is viewed
+    as dtype once for each distinct alignment of the starts, so indexes are per item rather than per byte.
+    """
+    dtype = np.dtype(dtype)
+    itemsize = dtype.itemsize
+    out = np.empty(counts.sum(), dtype)
+    out_starts = np.cumsum(counts) - counts
+    shifts = byte_starts % itemsize
+    for shift in np.unique(shifts):
+        sel = (shifts == shift) & (counts > 0)
+        if not sel.any():
+            continue
+        view = np.frombuffer(buf, dtype, (len(buf) - shift) // itemsize, shift)
+        src = _ranges((byte_starts[sel] - shift) // itemsize, counts[sel])
+        out[_ranges(out_starts[sel], counts[sel])] = view[src]
+        del view
+    return out
+
+
+def _map(filename):
+    with open(filename, 'rb') as infile:
+        return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_geometry(filename):
+    """
+    Reads all geometry from shapefile
+    :return: (shape type name, coords, part_offsets, feature_offsets), see FeatureArrays
+    """
+    base = shpfile.base_name(filename)
+    with open(base + '.shp', 'rb') as shp:
+        shape_type = SHAPE_NAMES[shpfile.SHAPE_2D[shpfile.read_header(shp)[0]]]
+
+    shx = _map(base + '.shx')
+    shp = _map(base + '.shp')
+    try:
+        index = np.frombuffer(shx, '>i4', (len(shx) - shpfile.HEADER_LENGTH) // 4, shpfile.HEADER_LENGTH)
+        # Byte offset of each record content, skipping the 8 byte record header
+        content = index[0::2].astype(np.int64) * 2 + 8
+        del index
+        ones = np.ones(len(content), dtype=np.int64)
+        types = _SHAPE_2D[_gather(shp, '<i4', content, ones)]
+        not_null = types != shpfile.NULL_SHAPE
+
+        if shape_type == POINT:
+            num_parts = not_null.astype(np.int64)
+            num_points = num_parts
+            coords = _gather(shp, '<f8', content + 4, 2 * num_points)
+            local_offsets = np.zeros(num_parts.sum(), dtype=np.int64)
+        else:
+            # Null shape records end after the shape type, only the others have part and point counts
+            num_parts = np.zeros(len(content), dtype=np.int64)
+            num_points = np.zeros(len(content), dtype=np.int64)
+            num_parts[not_null] = _gather(shp, '<i4', content[not_null] + 36, ones[not_null])
+            num_points[not_null] = _gather(shp, '<i4', content[not_null] + 40, ones[not_null])
+            local_offsets = _gather(shp, '<i4', content + 44, num_parts).astype(np.int64)
+            coords = _gather(shp, '<f8', content + 44 + 4 * num_parts, 2 * num_points)
+    finally:
+        shp.close()
+        shx.close()
+
+    # Part offsets are stored per record, shift them to the flat coordinate array
+    vertex_offsets = _offsets(num_points)
+    part_offsets = np.append(local_offsets + np.repeat(vertex_offsets[:-1], num_parts), vertex_offsets[-1])
+    return shape_type, coords.astype(float).reshape(-1, 2), part_offsets, _offsets(num_parts)
+
+
+def read_columns(filename, field_names):
+    """
+    Reads attribute columns from .dbf of shapefile filename. Numeric fields without decimals become
+    int64 if every value is present, other numeric fields become float with NaN for missing values.
+    Logical fields become bool, all other fields become unicode strings.
+
+    :return: dict of field name: numpy array
+    """
+    dbf_name = shpfile.base_name(filename) + '.dbf'
+    with open(dbf_name, 'rb') as dbf:
+        num_records, header_length, record_length, fields = shpfile.read_dbf_fields(dbf)
+    indexes = [shpfile.field_index(fields, name) for name in field_names]
+    if num_records == 0:
+        return dict((name, _to_column([])) for name in field_names)
+
+    # View the records as a structured array, each field is a fixed width byte string
+    dtype = np.dtype({'names': ['deleted'] + ['f' + str(i) for i in range(len(fields))],
+                      'formats': ['S1'] + ['S' + str(field[2]) for field in fields],
+                      'itemsize': record_length})
+    dbf = _map(dbf_name)
+    try:
+        records = np.frombuffer(dbf, dtype, num_records, header_length)
+        columns = {}
+        for name, i in zip(field_names, indexes):
+            columns[name] = _convert_column(records['f' + str(i)], fields[i][1], fields[i][3])
+        del records
+    finally:
+        dbf.close()
+    return columns
+
+
+def _convert_column(raw, field_type, decimals):
+    """ Converts column of raw dbf byte strings to a typed array """
+    if field_type in 'NF':
+        text = np.char.strip(raw)
+        missing = (text == b'') | np.char.startswith(text, b'*')
+        if decimals == 0 and not missing.any() and not np.char.count(text, b'.').any():
+            return text.astype(np.int64)
+        text = np.where(missing, b'nan', text)
+        return text.astype(float)
+    if field_type == 'L':
+        return np.isin(np.char.strip(raw).astype('S1'), [b'T', b't', b'Y', b'y'])
+    values = np.char.decode(raw, shpfile.DBF_ENCODING)
+    if field_type == 'C':
+        return np.char.rstrip(values)
+    return np.char.strip(values)
+
+
+def read_shapefile(filename, field_names=()):
+    """ Returns FeatureArrays of all features in shapefile filename """
+    shape_type, coords, part_offsets, feature_offsets = read_geometry(filename)
+    return FeatureArrays(shape_type, coords, part_offsets, feature_offsets, read_columns(filename, field_names))
@@ -0,0 +1,544 @@
+"""
+Pure python ESRI shapefile (.shp, .shx, .dbf, .prj) reader and writer. Supports point, polyline, and
+polygon shapes. Z and M values are ignored when reading and are not written.
+
+Geometry is passed around as (x, y) tuples for points and as lists of (n, 2) numpy arrays of vertices
+(one per part or ring) for polylines and polygons.
+"""
+import datetime
+import math
+import os
+import struct
+
+import numpy as np
+
+NULL_SHAPE = 0
+POINT = 1
+POLYLINE = 3
+POLYGON = 5
+
+# Shape types with Z or M values, mapped to their 2D type
+SHAPE_2D = {0: NULL_SHAPE, 1: POINT, 3: POLYLINE, 5: POLYGON, 11: POINT, 13: POLYLINE, 15: POLYGON,
+            21: POINT, 23: POLYLINE, 25: POLYGON}
+SHAPE_TYPES = {'POINT': POINT, 'POLYLINE': POLYLINE, 'POLYGON': POLYGON}
+
+HEADER_LENGTH = 100
+FILE_CODE = 9994
+VERSION = 1000
+DBF_MAX_NAME = 10
+DBF_ENCODING = 'latin-1'
+
+# dbf field type, length, decimals for each field type
+DBF_TYPES = {'TEXT': ('C', 254, 0),
+             'FLOAT': ('F', 13, 6),
+             'DOUBLE': ('N', 19, 11),
+             'SHORT': ('N', 4, 0),
+             'LONG': ('N', 9, 0)}
+
+
+class ShapefileError(Exception):
+    pass
+
+
+def base_name(filename):
+    """ Returns filename without .shp extension """
+    if filename.lower().endswith('.shp'):
+        return filename[:-4]
+    return filename
+
+
+def _signed_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * np.sum(x[:-1] * y[1:] - x[1:] * y[:-1])
+
+
+def _inside(point, ring):
+    """ Returns True if point is inside closed (n, 2) array ring, even-odd rule """
+    x, y = ring[:, 0], ring[:, 1]
+    x0, y0, x1, y1 = x[:-1], y[:-1], x[1:], y[1:]
+    crosses = (y0 > point[1]) != (y1 > point[1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_cross = x0 + (point[1] - y0) * (x1 - x0) / (y1 - y0)
+        return bool(np.count_nonzero(crosses & (point[0] < x_cross)) % 2)
+
+
+def ring_parents(rings):
+    """
+    Returns list with the index of the exterior ring around each hole of a polygon, None for exterior rings.
+    Rings inside an odd number of other rings are holes, so a polygon may have several exterior rings, e.g.
+    disjoint parts or an island in a hole, in any order.
+    :param rings: list of closed (n, 2) arrays
+    """
+    count = len(rings)
+    if count == 1:
+        return [None]
+    containers = [[j for j in range(count) if j != i and _inside(rings[i][0], rings[j])] for i in range(count)]
+    depths = [len(outer) for outer in containers]
+    parents = []
+    for i in range(count):
+        if depths[i] % 2 == 0:
+            parents.append(None)
+        else:
+            # The innermost exterior ring around the hole
+            parents.append(max(containers[i], key=lambda j: depths[j]))
+    return parents
+
+
+def dbf_field_name(name):
+    """ Returns name truncated to the dbf limit """
+    return name[:DBF_MAX_NAME]
+
+
+# ------------------------------------- Reading -------------------------------------
+def read_header(shp):
+    """ Returns (shape type, file length in bytes, bbox) from open .shp/.shx file """
+    header = shp.read(HEADER_LENGTH)
+    if len(header) < HEADER_LENGTH:
+        raise ShapefileError('Truncated shapefile header')
+    file_code, = struct.unpack('>i', header[0:4])
+    if file_code != FILE_CODE:
+        raise ShapefileError('Not a shapefile')
+    length, = struct.unpack('>i', header[24:28])
+    shape_type, = struct.unpack('<i', header[32:36])
+    bbox = struct.unpack('<4d', header[36:68])
+    return shape_type, length * 2, bbox
+
+
+def _parse_shape(content):
+    """ Parses record content, returns geometry in the format described in the module docstring """
+    shape_type, = struct.unpack('<i', content[0:4])
+    shape_type = SHAPE_2D[shape_type]
+    if shape_type == NULL_SHAPE:
+        return None
+    if shape_type == POINT:
+        return struct.unpack('<2d', content[4:20])
+    num_parts, num_points = struct.unpack('<2i', content[36:44])
+    parts = np.frombuffer(content, '<i4', num_parts, 44)
+    points = np.frombuffer(content, '<f8', num_points * 2, 44 + 4 * num_parts).reshape(-1, 2)
+    ends = list(parts[1:]) + [num_points]
+    return [points[start:end] for start, end in zip(parts, ends)]
+
+
+def iter_shapes(filename):
+    """ Yields geometry of each record in filename """
+    with open(base_name(filename) + '.shp', 'rb') as shp:
+        _, length, _ = read_header(shp)
+        position = HEADER_LENGTH
+        while position < length:
+            _, content_length = struct.unpack('>2i', shp.read(8))
+            content = shp.read(content_length * 2)
+            position += 8 + content_length * 2
+            yield _parse_shape(content)
+
+
+def shape_type(filename):
+    """ Returns 2D shape type of filename """
+    with open(base_name(filename) + '.shp', 'rb') as shp:
+        return SHAPE_2D[read_header(shp)[0]]
+
+
+def read_dbf_fields(dbf):
+    """
+    Reads field descriptors from open .dbf file
+    :return: (number of records, header length, record length, list of (name, type, length, decimals))
+    """
+    header = dbf.read(32)
+    num_records, header_length, record_length = struct.unpack('<IHH', header[4:12])
+    fields = []
+    for _ in range((header_length - 33) // 32):
+        descriptor = dbf.read(32)
+        name = descriptor[:11].split(b'\x00')[0].decode(DBF_ENCODING)
+        field_type = descriptor[11:12].decode(DBF_ENCODING)
+        fields.append((name, field_type, _byte(descriptor[16]), _byte(descriptor[17])))
+    return num_records, header_length, record_length, fields
+
+
+def _byte(value):
+    # Python 2 returns characters, not integers, when indexing bytes
+    if isinstance(value, int):
+        return value
+    return ord(value)
+
+
+def _parse_dbf_value(raw, field_type, decimals):
+    if field_type == 'C':
+        return raw.decode(DBF_ENCODING).rstrip()
+    value = raw.strip()
+    if field_type in 'NF':
+        if not value or value.startswith(b'*'):
+            return None
+        if decimals == 0 and b'.' not in value:
+            return int(value)
+        return float(value)
+    if field_type == 'L':
+        return value[:1] in (b'T', b't', b'Y', b'y')
+    return value.decode(DBF_ENCODING)
+
+
+def field_index(fields, name):
+    """ Returns index of field name in list of dbf fields, case insensitive like ArcGIS """
+    target = dbf_field_name(name).upper()
+    for i, field in enumerate(fields):
+        if field[0].upper() == target:
+            return i
+    raise ShapefileError('Field ' + name + ' not found')
+
+
+def iter_records(filename, field_names):
+    """ Yields list of values of field_names for each record in filename """
+    with open(base_name(filename) + '.dbf', 'rb') as dbf:
+        num_records, header_length, record_length, fields = read_dbf_fields(dbf)
+        offsets = np.cumsum([1] + [field[2] for field in fields])
+        indexes = [field_index(fields, name) for name in field_names]
+        dbf.seek(header_length)
+        for _ in range(num_records):
+            record = dbf.read(record_length)
+            yield [_parse_dbf_value(record[offsets[i]:offsets[i + 1]], fields[i][1], fields[i][3]) for i in indexes]
+
+
+def read_prj(filename):
+    """ Returns WKT from .prj file or None if it doesn't exist """
+    prj = base_name(filename) + '.prj'
+    if not os.path.isfile(prj):
+        return None
+    with open(prj) as infile:
+        return infile.read().strip()
+
+
+# ------------------------------------- Writing -------------------------------------
+def create(filename, shape_type_name, fields, spatial_reference=None):
+    """
+    Creates an empty shapefile
+    :param filename: name of shapefile
+    :param shape_type_name: 'POINT', 'POLYLINE', or 'POLYGON'
+    :param fields: list of gisio.Field
+    :param spatial_reference: WKT for .prj file, or None
+    """
+    base = base_name(filename)
+    header = _main_header(SHAPE_TYPES[shape_type_name], HEADER_LENGTH, (0.0, 0.0, 0.0, 0.0))
+    for extension in ('.shp', '.shx'):
+        with open(base + extension, 'wb') as outfile:
+            outfile.write(header)
+
+    descriptors = []
+    record_length = 1
+    for field in fields:
+        dbf_type, length, decimals = DBF_TYPES[field.type]
+        if field.length is not None:
+            length = field.length
+        name = dbf_field_name(field.name).encode(DBF_ENCODING)
+        descriptors.append(struct.pack('<11sc4xBB14x', name, dbf_type.encode(DBF_ENCODING), length, decimals))
+        record_length += length
+    header_length = 32 + 32 * len(descriptors) + 1
+    with open(base + '.dbf', 'wb') as dbf:
+        dbf.write(_dbf_header(0, header_length, record_length))
+        dbf.write(b''.join(descriptors))
+        dbf.write(b'\x0d\x1a')
+
+    if spatial_reference:
+        with open(base + '.prj', 'w') as prj:
+            prj.write(spatial_reference)
+
+
+def _main_header(shape_type, file_length, bbox):
+    return struct.pack('>7i', FILE_CODE, 0, 0, 0, 0, 0, file_length // 2) + \
+        struct.pack('<2i4d4d', VERSION, shape_type, bbox[0], bbox[1], bbox[2], bbox[3], 0, 0, 0, 0)
+
+
+def _dbf_header(num_records, header_length, record_length):
+    today = datetime.date.today()
+    return struct.pack('<B3BIHH20x', 3, today.year - 1900, today.month, today.day, num_records,
+                       header_length, record_length)
+
+
+def _format_dbf_value(value, field_type, length, decimals):
+    if field_type == 'C':
+        if value is None:
+            value = ''
+        if not isinstance(value, bytes):
+            value = u'{}'.format(value).encode(DBF_ENCODING, 'replace')
+        return value[:length].ljust(length)
+    if value is None or isinstance(value, float) and math.isnan(value):
+        return b' ' * length
+    if decimals:
+        text = '{:.{}f}'.format(float(value), decimals)
+        # Give up decimals before overflowing the field
+        if len(text) > length:
+            text = '{:.{}g}'.format(float(value), length - 6)
+    else:
+        text = str(int(value))
+    if len(text) > length:
+        text = '*' * length
+    return text.rjust(length).encode(DBF_ENCODING)
+
+
+def _shape_content(shape_type, geometry):
+    """ Returns (record content, bbox) for geometry """
+    if geometry is None:
+        return struct.pack('<i', NULL_SHAPE), None
+    if shape_type == POINT:
+        x, y = geometry
+        return struct.pack('<i2d', POINT, x, y), (x, y, x, y)
+    parts = [np.asarray(part, dtype='<f8').reshape(-1, 2) for part in geometry]
+    if shape_type == POLYGON:
+        parts = [_close_ring(part) for part in parts]
+        # Shapefile outer rings are clockwise, holes are counter clockwise
+        holes = [parent is not None for parent in ring_parents(parts)]
+        parts = [part[::-1] if (_signed_area(part) > 0) != hole else part for part, hole in zip(parts, holes)]
+    points = np.vstack(parts)
+    starts = np.cumsum([0] + [len(part) for part in parts[:-1]]).astype('<i4')
+    bbox = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+    content = struct.pack('<i4d2i', shape_type, bbox[0], bbox[1], bbox[2], bbox[3], len(parts), len(points)) + \
+        starts.tobytes() + np.ascontiguousarray(points).tobytes()
+    return content, bbox
+
+
+def _close_ring(ring):
+    if ring[0, 0] != ring[-1, 0] or ring[0, 1] != ring[-1, 1]:
+        return np.vstack([ring, ring[:1]])
+    return ring
+
+
+# Record header and fixed part of record content for non-null points, polylines, and polygons
+POINT_RECORD = np.dtype([('number', '>i4'), ('length', '>i4'), ('type', '<i4'), ('xy', '<f8', (2,))])
+POLY_RECORD = np.dtype([('number', '>i4'), ('length', '>i4'), ('type', '<i4'), ('bbox', '<f8', (4,)),
+                        ('num_parts', '<i4'), ('num_points', '<i4')])
+
+
+def _encode_dbf_column(values, field_type, length, decimals):
+    """ Returns array of dbf field values, bytes of width length """
+    if field_type == 'C':
+        if values.dtype.kind not in 'SU':
+            values = [u'' if value is None else u'{}'.format(value) for value in values.tolist()]
+            values = np.array(values, dtype='U')
+        if values.dtype.kind == 'U':
+            values = np.char.encode(values, DBF_ENCODING, 'replace')
+        return np.char.ljust(values.astype('S' + str(length)), length)
+    text = [_format_dbf_value(value, field_type, length, decimals) for value in values.tolist()]
+    return np.array(text, dtype='S' + str(length))
+
+
+class ShapefileWriter(object):
+    """
+    Appends features to an existing shapefile, headers are updated by close(). Records are encoded in
+    bulk and written with a single write() per call to write_features() or write_arrays().
+    """
+    def __init__(self, filename, field_names):
+        self.base = base_name(filename)
+        self.field_names = list(field_names)
+        self.shp = open(self.base + '.shp', 'r+b')
+        self.shx = open(self.base + '.shx', 'r+b')
+        self.dbf = open(self.base + '.dbf', 'r+b')
+        self.shape_type, self.shp_length, self.bbox = read_header(self.shp)
+        self.shape_type = SHAPE_2D[self.shape_type]
+        self.shx.seek(0, os.SEEK_END)
+        self.shp.seek(self.shp_length)
+
+        self.num_records, self.header_length, self.record_length, self.fields = read_dbf_fields(self.dbf)
+        self.indexes = [field_index(self.fields, name) for name in field_names]
+        # Overwrite the end of file marker
+        self.dbf.seek(self.header_length + self.num_records * self.record_length)
+        if self.num_records == 0 and self.bbox == (0.0, 0.0, 0.0, 0.0):
+            self.bbox = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_features(self, rows):
+        """
+        :param rows: iterable of (geometry, [values of field_names])
+        """
+        shp_chunks = []
+        shx_chunks = []
+        dbf_chunks = []
+        for geometry, values in rows:
+            content, bbox = _shape_content(self.shape_type, geometry)
+            self.num_records += 1
+            shx_chunks.append(struct.pack('>2i', self.shp_length // 2, len(content) // 2))
+            shp_chunks.append(struct.pack('>2i', self.num_records, len(content) // 2))
+            shp_chunks.append(content)
+            self.shp_length += 8 + len(content)
+            if bbox is not None:
+                self._extend_bbox(bbox)
+
+            record = [b' ' * field[2] for field in self.fields]
+            for index, value in zip(self.indexes, values):
+                _, field_type, length, decimals = self.fields[index]
+                record[index] = _format_dbf_value(value, field_type, length, decimals)
+            dbf_chunks.append(b' ' + b''.join(record))
+        self.shp.write(b''.join(shp_chunks))
+        self.shx.write(b''.join(shx_chunks))
+        self.dbf.write(b''.join(dbf_chunks))
+
+    def write_arrays(self, arrays):
+        """
+        Writes all features in arrays. Record headers, bounding boxes, and dbf records are built with numpy
+        instead of per feature struct calls. Polygons go through write_features() so rings are closed
+        and oriented.
+
+        :param arrays: shparrays.FeatureArrays with a column for each of field_names
+        """
+        if self.shape_type == POLYGON:
+            self.write_features(arrays.iter_features(self.field_names))
+            return
+        num_features = len(arrays)
+        if num_features == 0:
+            return
+
+        coords = np.ascontiguousarray(arrays.coords, dtype='<f8')
+        feature_offsets = arrays.feature_offsets
+        num_parts = np.diff(feature_offsets)
+        first_vertex = arrays.part_offsets[feature_offsets[:-1]]
+        last_vertex = arrays.part_offsets[feature_offsets[1:]]
+        num_points = last_vertex - first_vertex
+        null = num_points == 0
+
+        if self.shape_type == POINT:
+            content_length = np.where(null, 4, POINT_RECORD.itemsize - 8)
+        else:
+            content_length = np.where(null, 4, POLY_RECORD.itemsize - 8 + 4 * num_parts + 16 * num_points)
+        record_start = self.shp_length + np.cumsum(8 + content_length) - (8 + content_length)
+        numbers = self.num_records + 1 + np.arange(num_features)
+
+        if self.shape_type == POINT:
+            records = np.zeros(num_features, POINT_RECORD)
+            records['xy'][~null] = coords[first_vertex[~null]]
+        else:
+            records = np.zeros(num_features, POLY_RECORD)
+            records['num_parts'] = num_parts
+            records['num_points'] = num_points
+            # Vertices of null features are empty so features with vertices are contiguous for reduceat()
+            starts = first_vertex[~null]
+            if len(starts):
+                bbox = np.column_stack([np.minimum.reduceat(coords[:, 0], starts),
+                                        np.minimum.reduceat(coords[:, 1], starts),
+                                        np.maximum.reduceat(coords[:, 0], starts),
+                                        np.maximum.reduceat(coords[:, 1], starts)])
+                records['bbox'][~null] = bbox
+                self._extend_bbox((bbox[:, 0].min(), bbox[:, 1].min(), bbox[:, 2].max(), bbox[:, 3].max()))
+        if self.shape_type == POINT and (~null).any():
+            xy = records['xy'][~null]
+            self._extend_bbox((xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max()))
+        records['number'] = numbers
+        records['length'] = content_length // 2
+        records['type'] = self.shape_type
+
+        # Part offsets are stored relative to the first vertex of each record
+        local_parts = (arrays.part_offsets[:-1] - np.repeat(first_vertex, num_parts)).astype('<i4').tobytes()
+        vertex_bytes = coords.tobytes()
+        record_bytes = records.tobytes()
+        size = records.itemsize
+        shp_chunks = []
+        for i in range(num_features):
+            if null[i]:
+                shp_chunks.append(struct.pack('>2i', numbers[i], 2) + struct.pack('<i', NULL_SHAPE))
+                continue
+            shp_chunks.append(record_bytes[i * size:(i + 1) * size])
+            if self.shape_type != POINT:
+                shp_chunks.append(local_parts[4 * feature_offsets[i]:4 * feature_offsets[i + 1]])
+                shp_chunks.append(vertex_bytes[16 * first_vertex[i]:16 * last_vertex[i]])
+
+        # dbf records as a structured array, unwritten fields are blank
+        dbf_records = np.zeros(num_features, np.dtype({
+            'names': ['deleted'] + ['f' + str(i) for i in range(len(self.fields))],
+            'formats': ['S1'] + ['S' + str(field[2]) for field in self.fields],
+            'itemsize': self.record_length}))
+        dbf_records['deleted'] = b' '
+        for i, field in enumerate(self.fields):
+            dbf_records['f' + str(i)] = b' ' * field[2]
+        for name, index in zip(self.field_names, self.indexes):
+            _, field_type, length, decimals = self.fields[index]
+            dbf_records['f' + str(index)] = _encode_dbf_column(arrays.column(name), field_type, length, decimals)
+
+        self.shp.write(b''.join(shp_chunks))
+        self.shx.write(np.column_stack([record_start // 2, content_length // 2]).astype('>i4').tobytes())
+        self.dbf.write(dbf_records.tobytes())
+        self.shp_length = int(record_start[-1] + 8 + content_length[-1])
+        self.num_records += num_features
+
+    def _extend_bbox(self, bbox):
+        if self.bbox is None:
+            self.bbox = bbox
+        else:
+            self.bbox = (min(self.bbox[0], bbox[0]), min(self.bbox[1], bbox[1]),
+                         max(self.bbox[2], bbox[2]), max(self.bbox[3], bbox[3]))
+
+    def flush(self):
+        """ Passes written records to the operating system, headers are only updated by close() """
+        for outfile in (self.shp, self.shx, self.dbf):
+            outfile.flush()
+
+    def close(self):
+        if self.shp.closed:
+            return
+        bbox = self.bbox if self.bbox is not None else (0.0, 0.0, 0.0, 0.0)
+        shx_length = HEADER_LENGTH + 8 * self.num_records
+        for outfile, length in ((self.shp, self.shp_length), (self.shx, shx_length)):
+            outfile.seek(0)
+            outfile.write(_main_header(self.shape_type, length, bbox))
+            outfile.close()
+        self.dbf.write(b'\x1a')
+        self.dbf.seek(0)
+        self.dbf.write(_dbf_header(self.num_records, self.header_length, self.record_length))
+        self.dbf.close()
+
+
+def truncate(filename, num_records):
+    """
+    Removes the records after the first num_records and rewrites the headers, e.g. to drop features written
+    after the last checkpoint of an interrupted run (checkpoint.py). The headers of a file that wasn't closed
+    are rebuilt from the .shx index. Raises ShapefileError if fewer than num_records records were written.
+    """
+    base = base_name(filename)
+    with open(base + '.shp', 'r+b') as shp, open(base + '.shx', 'r+b') as shx, open(base + '.dbf', 'r+b') as dbf:
+        shape_type = SHAPE_2D[read_header(shx)[0]]
+        _, header_length, record_length, _ = read_dbf_fields(dbf)
+        shx.seek(0, os.SEEK_END)
+        dbf.seek(0, os.SEEK_END)
+        shp.seek(0, os.SEEK_END)
+        written = min((shx.tell() - HEADER_LENGTH) // 8, (dbf.tell() - header_length) // record_length)
+        shx.seek(HEADER_LENGTH)
+        index = np.frombuffer(shx.read(8 * num_records), '>i4').reshape(-1, 2).astype(np.int64) * 2
+        shp_length = int(index[-1].sum()) + 8 if num_records and written >= num_records else HEADER_LENGTH
+        if written < num_records or shp_length > shp.tell():
+            raise ShapefileError('{} has fewer than {} records'.format(filename, num_records))
+
+        # Bounding box of the kept records, from their record headers
+        bbox = None
+        for offset, _ in index.tolist():
+            shp.seek(offset + 8)
+            content = shp.read(36)
+            record_type = SHAPE_2D[struct.unpack('<i', content[0:4])[0]]
+            if record_type == NULL_SHAPE:
+                continue
+            if record_type == POINT:
+                x, y = struct.unpack('<2d', content[4:20])
+                extent = (x, y, x, y)
+            else:
+                extent = struct.unpack('<4d', content[4:36])
+            bbox = extent if bbox is None else (min(bbox[0], extent[0]), min(bbox[1], extent[1]),
+                                                max(bbox[2], extent[2]), max(bbox[3], extent[3]))
+        if bbox is None:
+            bbox = (0.0, 0.0, 0.0, 0.0)
+
+        shx_length = HEADER_LENGTH + 8 * num_records
+        for outfile, length in ((shp, shp_length), (shx, shx_length)):
+            outfile.truncate(length)
+            outfile.seek(0)
+            outfile.write(_main_header(shape_type, length, bbox))
+        dbf.seek(header_length + num_records * record_length)
+        dbf.write(b'\x1a')
+        dbf.truncate()
+        dbf.seek(0)
+        dbf.write(_dbf_header(num_records, header_length, record_length))
+
+
+def delete(filename):
+    """ Deletes all files belonging to shapefile filename """
+    base = base_name(filename)
+    for extension in ('.shp', '.shx', '.dbf', '.prj', '.cpg', '.sbn', '.sbx', '.shp.xml'):
+        if os.path.isfile(base + extension):
+            os.remove(base + extension)
@@ -0,0 +1,126 @@
+"""
+Douglas-Peucker simplification of polyline outputs. Review segments copy every cut line vertex and top width
+lines copy every merged vertex, densely digitized cut lines make outputs that are large and slow to draw and
+export. Vertices within tolerance of the simplified line are dropped, coordinates of kept vertices are not
+changed.
+
+Part end points are always kept, so the change stations that end review segments are exact. Other vertices
+that must stay, e.g. floodplain intersections inside a top width line, are passed as a keep mask.
+
+All parts of a batch are simplified together: each pass finds the farthest vertex of every open interval
+of every part with one set of numpy operations, so the number of passes is the depth of the Douglas-Peucker
+recursion rather than the number of intervals.
+"""
+import time
+
+import numpy as np
+
+import shparrays
+
+
+def simplify_mask(coords, part_offsets, tolerance, keep=None):
+    """
+    Returns boolean array flagging the vertices kept by Douglas-Peucker simplification of every part
+    :param coords: (n, 2) array of vertices of all parts
+    :param part_offsets: (number of parts + 1) array, index of the first vertex of each part in coords
+    :param tolerance: largest distance of a dropped vertex from the simplified line
+    :param keep: optional boolean array, vertices flagged True are always kept
+    """
+    count = len(coords)
+    part_offsets = np.asarray(part_offsets, dtype=np.int64)
+    if tolerance is None or tolerance <= 0:
+        return np.ones(count, dtype=bool)
+    kept = np.zeros(count, dtype=bool)
+    first_vertex, last_vertex = part_offsets[:-1], part_offsets[1:] - 1
+    has_vertices = last_vertex >= first_vertex
+    kept[first_vertex[has_vertices]] = True
+    kept[last_vertex[has_vertices]] = True
+    if keep is not None:
+        kept |= np.asarray(keep, dtype=bool)
+
+    part_of = np.repeat(np.arange(len(first_vertex)), part_offsets[1:] - part_offsets[:-1])
+    # Interval starting at a kept vertex that is already within tolerance
+    settled = np.zeros(count, dtype=bool)
+    x, y = coords[:, 0], coords[:, 1]
+    while True:
+        kept_index = np.flatnonzero(kept)
+        starts, ends = kept_index[:-1], kept_index[1:]
+        active = (ends - starts > 1) & (part_of[starts] == part_of[ends]) & ~settled[starts]
+        starts, ends = starts[active], ends[active]
+        if len(starts) == 0:
+            return kept
+
+        # Interior vertices of all open intervals, interval by interval
+        sizes = ends - starts - 1
+        offsets = np.cumsum(sizes) - sizes
+        interval = np.repeat(np.arange(len(starts)), sizes)
+        interior = np.arange(sizes.sum()) - offsets[interval] + starts[interval] + 1
+
+        x0, y0 = x[starts][interval], y[starts][interval]
+        dx, dy = x[ends][interval] - x0, y[ends][interval] - y0
+        px, py = x[interior] - x0, y[interior] - y0
+        length = np.hypot(dx, dy)
+        # Distance to the line through the interval ends, or to the start of a closed interval
+        with np.errstate(invalid='ignore', divide='ignore'):
+            distance = np.where(length > 0, np.abs(dx * py - dy * px) / length, np.hypot(px, py))
+
+        max_distance = np.maximum.reduceat(distance, offsets)
+        # First vertex at the largest distance, like the recursive algorithm
+        position = np.where(distance == max_distance[interval], np.arange(len(distance)), len(distance))
+        farthest = interior[np.minimum.reduceat(position, offsets)]
+        split = max_distance > tolerance
+        kept[farthest[split]] = True
+        settled[starts[~split]] = True
+
+
+def simplify_arrays(arrays, tolerance, keep=None):
+    """
+    Returns shparrays.FeatureArrays with polylines simplified, points and polygons are returned unchanged
+    :param keep: optional boolean array of vertices to keep, one value per vertex of arrays.coords
+    """
+    if arrays.shape_type != shparrays.POLYLINE:
+        return arrays
+    mask = simplify_mask(arrays.coords, arrays.part_offsets, tolerance, keep)
+    kept_before = np.concatenate([[0], np.cumsum(mask, dtype=np.int64)])
+    return shparrays.FeatureArrays(arrays.shape_type, arrays.coords[mask], kept_before[arrays.part_offsets],
+                                   arrays.feature_offsets, arrays.columns)
+
+
+def simplify_line(coords, tolerance, keep=None):
+    """ Returns (n, 2) array coords simplified, see simplify_mask() """
+    coords = np.asarray(coords, dtype=float)
+    return coords[simplify_mask(coords, [0, len(coords)], tolerance, keep)]
+
+
+class SimplifyStats(object):
+    """ Vertex counts and times of the simplified batches of an output """
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.vertices_in = 0
+        self.vertices_out = 0
+        self.simplify_seconds = 0.0
+        self.write_seconds = 0.0
+
+    def simplify(self, arrays, keep=None):
+        """ Returns simplify_arrays() of arrays and counts its vertices """
+        start = time.time()
+        simplified = simplify_arrays(arrays, self.tolerance, keep)
+        self.simplify_seconds += time.time() - start
+        self.vertices_in += len(arrays.coords)
+        self.vertices_out += len(simplified.coords)
+        return simplified
+
+    def summary(self, filename):
+        """
+        Returns message with the vertex reduction and the write time saved. The saving is estimated from the
+        write time per kept vertex, less the time spent simplifying.
+        """
+        removed = self.vertices_in - self.vertices_out
+        percent = 100.0 * removed / self.vertices_in if self.vertices_in else 0.0
+        saved = 0.0
+        if self.vertices_out:
+            saved = self.write_seconds / self.vertices_out * removed - self.simplify_seconds
+        return ('Simplified {} with tolerance {}: {} of {} vertices kept ({:.1f}% fewer), simplifying took {:.2f} s, '
+                'writing {:.2f} s, about {:.2f} s of write time saved').format(
+                    filename, self.tolerance, self.vertices_out, self.vertices_in, percent, self.simplify_seconds,
+                    self.write_seconds, saved)
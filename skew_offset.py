@@ -0,0 +1,66 @@
+"""
+Skew and offset correction of HEC-RAS cross section stations. RAS stations start at the first station
+of the cross section and are measured perpendicular to flow, GIS cut lines start at 0 and follow the
+skewed cut line. All tools convert RAS stations to GIS stations the same way, offset first, then skew:
+
+    gis station = (ras station - offset) / cos(skew)
+
+offset is the first station of the cross section and skew is the RAS skew angle in degrees, 0 if the
+cross section isn't skewed. The functions work on numpy arrays so stations of a whole model can be
+corrected in one call.
+"""
+import numpy as np
+
+
+def skew_angle(geo_xs):
+    """ Returns skew angle of rasgeo.CrossSection in degrees, 0 if not skewed """
+    if geo_xs.skew is None or not geo_xs.skew.angle:
+        return 0.0
+    return float(geo_xs.skew.angle)
+
+
+def offset(geo_xs):
+    """ Returns first station of rasgeo.CrossSection, requires the sta_elev block """
+    return float(geo_xs.sta_elev.points[0][0])
+
+
+def corrections(cross_sections):
+    """
+    Returns offset and skew arrays for cross sections
+    :param cross_sections: list of rasgeo.CrossSection, None entries get offset 0 and skew 0
+    :return: (offsets, skews) arrays, one value per cross section
+    """
+    offsets = np.zeros(len(cross_sections))
+    skews = np.zeros(len(cross_sections))
+    for i, geo_xs in enumerate(cross_sections):
+        if geo_xs is not None:
+            offsets[i] = offset(geo_xs)
+            skews[i] = skew_angle(geo_xs)
+    return offsets, skews
+
+
+def correct_stations(stations, offsets, skews):
+    """
+    Converts RAS stations to GIS stations. offsets and skews broadcast against stations, e.g. scalars
+    for one cross section or one value per row of stations for a model.
+
+    :param stations: array of RAS stations
+    :param offsets: first station of the cross section(s)
+    :param skews: skew angle(s) in degrees
+    :return: float array of GIS stations
+    """
+    stations = np.asarray(stations, dtype=float)
+    return (stations - offsets) / np.cos(np.radians(skews))
+
+
+def correct_xs_stations(stations, geo_xs, xs_offset=None):
+    """
+    Converts RAS stations of one cross section to GIS stations
+    :param stations: list or array of RAS stations
+    :param geo_xs: rasgeo.CrossSection object
+    :param xs_offset: first station of the cross section, read from geo_xs.sta_elev if None
+    :return: float array of GIS stations
+    """
+    if xs_offset is None:
+        xs_offset = offset(geo_xs)
+    return correct_stations(stations, xs_offset, skew_angle(geo_xs))
@@ -0,0 +1,363 @@
+"""
+Station interval index of the Manning's n, ineffective flow area, and blocked obstruction tables of a HEC-RAS
+geometry file. The review tools only turn these tables into line segments, this answers "what n, IEFA, or
+obstruction applies at station S of cross section X" and "which intervals overlap stations A - B" for many
+stations at once without rescanning the parsed cross sections.
+
+Each table becomes closed intervals [start, end] of RAS stations:
+
+    n_value         from each n-value station to the next n-value station, the last one to the end of the
+                    cross section
+    iefa            each blocked ineffective area, or the normal left (first station to left station) and
+                    right (right station to last station) areas
+    obstruction     same as iefa for blocked obstructions
+
+Intervals of all cross sections are kept in columnar arrays sorted by cross section and start, along with the
+running maximum end of each cross section, the augmentation of an interval tree. A query counts the intervals
+that start at or before its high station and skips the leading intervals whose running maximum end is below its
+low station, so only the remaining few intervals are compared. RAS tables have tens of intervals at most, so a
+flat array searched with one lexsort per batch is as selective as a tree and keeps the whole batch vectorized.
+
+check_index() sweeps the whole model and reports:
+
+    order               interval starts before the previous interval of its RAS table, or ends before it starts
+    overlap             interval overlaps an earlier starting interval of the same table
+    outside             interval starts before the first or ends after the last sta/elev station
+    iefa_obstruction    ineffective area overlaps a blocked obstruction
+"""
+import collections
+import csv
+
+import numpy as np
+
+import gisio
+import rasgeo
+
+N_VALUE = 'n_value'
+IEFA = 'iefa'
+OBSTRUCTION = 'obstruction'
+KINDS = (N_VALUE, IEFA, OBSTRUCTION)
+
+ORDER = 'order'
+OVERLAP = 'overlap'
+OUTSIDE = 'outside'
+IEFA_OBSTRUCTION = 'iefa_obstruction'
+RULES = (ORDER, OVERLAP, OUTSIDE, IEFA_OBSTRUCTION)
+
+# Elevation of areas with a blank elevation, same as the review tools
+BLANK_ELEVATION = 99999
+# Blocks parsed to build an index
+BLOCKS = (rasgeo.STA_ELEV, rasgeo.MANNINGS_N, rasgeo.IEFA, rasgeo.OBSTRUCT)
+
+Finding = collections.namedtuple('Finding', ['river', 'reach', 'xs_id', 'kind', 'start', 'end', 'rule', 'value',
+                                             'detail'])
+
+
+def blocked_intervals(items):
+    """
+    Returns [(start, end, elevation), ...] of the areas of a blocked (type -1) ineffective area or obstruction
+    table, in RAS order. Lines with a blank station are skipped, blank elevations are BLANK_ELEVATION.
+    :param items: rasgeo.Ineffective.iefa_list or rasgeo.Obstruct.blocked
+    """
+    return [(start, end, BLANK_ELEVATION if elev == '' else elev) for start, end, elev in items
+            if start != '' and end != '']
+
+
+def normal_intervals(items, first_station, last_station):
+    """
+    Returns [(start, end, elevation), ...] of the left and right areas of a normal (type 0) ineffective area or
+    obstruction table, areas with a blank station are skipped
+    """
+    intervals = []
+    if len(items) > 0 and items[0][1] != '':
+        intervals.append((first_station, items[0][1], BLANK_ELEVATION if items[0][2] == '' else items[0][2]))
+    if len(items) > 1 and items[1][0] != '':
+        intervals.append((items[1][0], last_station, BLANK_ELEVATION if items[1][2] == '' else items[1][2]))
+    return intervals
+
+
+def area_intervals(table_type, items, first_station, last_station):
+    """ Returns blocked_intervals() or normal_intervals() of a table of type table_type """
+    if table_type == -1:
+        return blocked_intervals(items)
+    return normal_intervals(items, first_station, last_station)
+
+
+def n_value_intervals(values, last_station):
+    """ Returns [(start, end, n), ...] of rasgeo.ManningsN.values, in RAS order """
+    stations = [value[0] for value in values] + [last_station]
+    return [(stations[i], stations[i + 1], value[1]) for i, value in enumerate(values)]
+
+
+def _search(xs, keys, query_xs, query_keys, side):
+    """
+    Returns the number of entries (xs[i], keys[i]), sorted by xs then key, before each query. Entries equal to
+    a query are counted with side='right', like numpy.searchsorted().
+    """
+    num = len(xs)
+    all_xs = np.concatenate([xs, query_xs])
+    all_keys = np.concatenate([keys, query_keys])
+    is_query = np.concatenate([np.zeros(num, dtype=bool), np.ones(len(query_xs), dtype=bool)])
+    tie = is_query if side == 'right' else ~is_query
+    order = np.lexsort((tie, all_keys, all_xs))
+    before = np.empty(len(query_xs), dtype=np.int64)
+    before[order[is_query[order]] - num] = np.cumsum(~is_query[order])[is_query[order]]
+    return before
+
+
+def _running_max(xs, values):
+    """ Returns running maximum of values within each cross section, xs must be sorted """
+    if len(values) == 0:
+        return values.copy()
+    # Integer ranks keep the values exact while cross sections are kept apart by xs * len(values)
+    unique, rank = np.unique(values, return_inverse=True)
+    key = np.maximum.accumulate(xs.astype(np.int64) * len(values) + rank)
+    return unique[key - xs.astype(np.int64) * len(values)]
+
+
+class IntervalTable(object):
+    """
+    Intervals of one kind for all cross sections sorted by cross section and start. Intervals of cross
+    section i are starts[offsets[i]:offsets[i + 1]], etc.
+
+    xs - index of the cross section of each interval
+    positions - position of each interval in its RAS table, e.g. 0 for the left area of a normal table
+    max_ends - largest end of the intervals of the cross section up to and including each interval
+    """
+    def __init__(self, kind, xs, starts, ends, values, positions, num_xs):
+        order = np.lexsort((positions, starts, xs))
+        self.kind = kind
+        self.xs = xs[order]
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.values = values[order]
+        self.positions = positions[order]
+        self.offsets = np.searchsorted(self.xs, np.arange(num_xs + 1)).astype(np.int64)
+        self.max_ends = _running_max(self.xs, self.ends)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlapping(self, xs, lows, highs):
+        """
+        Returns (query, interval) index arrays of every interval of cross section xs[k] overlapping stations
+        lows[k] - highs[k], sorted by query then start
+        """
+        xs = np.asarray(xs, dtype=np.int64)
+        lows = np.asarray(lows, dtype=float)
+        highs = np.asarray(highs, dtype=float)
+        # Intervals starting after the high station can't overlap, nor can the leading intervals whose running
+        # maximum end is below the low station
+        last = _search(self.xs, self.starts, xs, highs, 'right')
+        first = _search(self.xs, self.max_ends, xs, lows, 'left')
+        first = np.maximum(first, self.offsets[np.maximum(xs, 0)])
+        sizes = np.where(xs >= 0, np.maximum(last - first, 0), 0)
+        query = np.repeat(np.arange(len(xs)), sizes)
+        interval = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes) + np.repeat(first, sizes)
+        hit = self.ends[interval] >= lows[query]
+        return query[hit], interval[hit]
+
+    def containing(self, xs, stations):
+        """ Returns (query, interval) index arrays of every interval of cross section xs[k] containing stations[k] """
+        return self.overlapping(xs, stations, stations)
+
+    def values_at(self, xs, stations):
+        """
+        Returns value in effect at stations[k] of cross section xs[k], nan where no interval contains the
+        station. Where intervals overlap, the last one to start wins, e.g. the n-value that starts at a
+        station rather than the one that ends there.
+        """
+        query, interval = self.containing(xs, stations)
+        result = np.full(len(stations), np.nan)
+        # Intervals are sorted by start, the last assignment of each query wins
+        result[query] = self.values[interval]
+        return result
+
+
+class StationIndex(object):
+    """
+    Interval tables of a model, see module docstring
+
+    rivers, reaches, xs_ids, first_stations, last_stations - one value per cross section, stations are nan
+    without sta/elev points
+    tables - {kind: IntervalTable}
+    """
+    def __init__(self, rivers, reaches, xs_ids, first_stations, last_stations, tables):
+        self.rivers = rivers
+        self.reaches = reaches
+        self.xs_ids = xs_ids
+        self.first_stations = first_stations
+        self.last_stations = last_stations
+        self.tables = tables
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.xs_ids)
+
+    def __getitem__(self, kind):
+        return self.tables[kind]
+
+    @classmethod
+    def from_cross_sections(cls, cross_sections):
+        """ Builds index from rasgeo.CrossSection objects with the blocks in BLOCKS """
+        rivers, reaches, xs_ids, first, last = [], [], [], [], []
+        rows = dict((kind, []) for kind in KINDS)
+        for index, geo_xs in enumerate(cross_sections):
+            rivers.append(geo_xs.header.river)
+            reaches.append(geo_xs.header.reach)
+            xs_ids.append(geo_xs.header.xs_id)
+            points = geo_xs.sta_elev.points if geo_xs.sta_elev is not None else []
+            first.append(points[0][0] if points else np.nan)
+            last.append(points[-1][0] if points else np.nan)
+
+            if geo_xs.mannings_n is not None:
+                intervals = n_value_intervals(geo_xs.mannings_n.values, last[-1])
+                rows[N_VALUE].extend((index, i) + interval for i, interval in enumerate(intervals))
+            if geo_xs.iefa is not None:
+                intervals = area_intervals(geo_xs.iefa.type, geo_xs.iefa.iefa_list, first[-1], last[-1])
+                rows[IEFA].extend((index, i) + interval for i, interval in enumerate(intervals))
+            if geo_xs.obstruct is not None:
+                intervals = area_intervals(geo_xs.obstruct.blocked_type, geo_xs.obstruct.blocked, first[-1],
+                                           last[-1])
+                rows[OBSTRUCTION].extend((index, i) + interval for i, interval in enumerate(intervals))
+
+        tables = {}
+        for kind in KINDS:
+            values = np.array(rows[kind], dtype=float).reshape(-1, 5)
+            tables[kind] = IntervalTable(kind, values[:, 0].astype(np.int64), values[:, 2], values[:, 3],
+                                         values[:, 4], values[:, 1].astype(np.int64), len(xs_ids))
+        return cls(np.array(rivers, dtype=object), np.array(reaches, dtype=object), np.array(xs_ids, dtype=float),
+                   np.array(first, dtype=float), np.array(last, dtype=float), tables)
+
+    def xs_index(self, keys):
+        """ Returns array of the index of each (river, reach, xs_id) in keys, -1 for missing cross sections """
+        if self._lookup is None:
+            self._lookup = dict(((river, reach, xs_id), i) for i, (river, reach, xs_id) in
+                                enumerate(zip(self.rivers, self.reaches, self.xs_ids.tolist())))
+        return np.array([self._lookup.get((river, reach, float(xs_id)), -1) for river, reach, xs_id in keys],
+                        dtype=np.int64)
+
+    def overlapping(self, kind, xs, lows, highs):
+        """ Returns IntervalTable.overlapping() of the kind table """
+        return self.tables[kind].overlapping(xs, lows, highs)
+
+    def containing(self, kind, xs, stations):
+        """ Returns IntervalTable.containing() of the kind table """
+        return self.tables[kind].containing(xs, stations)
+
+    def values_at(self, kind, xs, stations):
+        """ Returns IntervalTable.values_at() of the kind table """
+        return self.tables[kind].values_at(xs, stations)
+
+
+def read_index(geofile):
+    """ Returns StationIndex of every cross section in geofile, only the blocks in BLOCKS are parsed """
+    return StationIndex.from_cross_sections(rasgeo.iter_cross_sections(geofile, blocks=BLOCKS))
+
+
+# ------------------------------------- Rules -------------------------------------
+def order_rule(table):
+    """
+    Returns indexes of intervals that end before they start, or start before the interval ahead of them
+    in their RAS table
+    """
+    reversed_ = table.ends < table.starts
+    # Position order within each cross section, the intervals are sorted by start
+    order = np.lexsort((table.positions, table.xs))
+    previous_start = np.full(len(table), -np.inf)
+    same_xs = np.zeros(len(table), dtype=bool)
+    same_xs[1:] = table.xs[order][1:] == table.xs[order][:-1]
+    previous_start[order[1:]] = table.starts[order][:-1]
+    backwards = np.zeros(len(table), dtype=bool)
+    backwards[order] = same_xs & (table.starts[order] < previous_start[order])
+    return np.flatnonzero(reversed_ | backwards)
+
+
+def overlap_rule(table):
+    """
+    Returns indexes of intervals that start before an earlier starting interval of their table ends, reversed
+    intervals are left to order_rule()
+    """
+    same_xs = np.zeros(len(table), dtype=bool)
+    same_xs[1:] = table.xs[1:] == table.xs[:-1]
+    previous_end = np.full(len(table), -np.inf)
+    previous_end[1:] = table.max_ends[:-1]
+    return np.flatnonzero(same_xs & (table.starts < previous_end) & (table.ends >= table.starts))
+
+
+def outside_rule(index, table):
+    """ Returns indexes of intervals that start before the first or end after the last sta/elev station """
+    with np.errstate(invalid='ignore'):
+        return np.flatnonzero((table.starts < index.first_stations[table.xs]) |
+                              (table.ends > index.last_stations[table.xs]))
+
+
+def iefa_obstruction_rule(index):
+    """
+    Returns (iefa interval, obstruction interval) index arrays of every ineffective area that overlaps a
+    blocked obstruction by more than a point
+    """
+    iefa = index.tables[IEFA]
+    obstruction = index.tables[OBSTRUCTION]
+    query, interval = obstruction.overlapping(iefa.xs, iefa.starts, iefa.ends)
+    positive = np.maximum(iefa.starts[query], obstruction.starts[interval]) < \
+        np.minimum(iefa.ends[query], obstruction.ends[interval])
+    return query[positive], interval[positive]
+
+
+def check_index(index):
+    """
+    Evaluates all rules for index
+    :return: list of Finding, sorted by cross section
+    """
+    findings = []
+
+    def interval_finding(table, i, rule, detail):
+        xs = table.xs[i]
+        findings.append((xs, Finding(index.rivers[xs], index.reaches[xs], float(index.xs_ids[xs]), table.kind,
+                                     float(table.starts[i]), float(table.ends[i]), rule, float(table.values[i]),
+                                     detail)))
+
+    for kind in KINDS:
+        table = index.tables[kind]
+        for i in order_rule(table):
+            interval_finding(table, i, ORDER, 'stations are out of order, entry {} of the RAS table'.format(
+                table.positions[i] + 1))
+        for i in overlap_rule(table):
+            interval_finding(table, i, OVERLAP, 'overlaps an earlier {} ending at {}'.format(
+                kind, table.max_ends[i - 1]))
+        for i in outside_rule(index, table):
+            xs = table.xs[i]
+            interval_finding(table, i, OUTSIDE, 'extends past the sta/elev stations {} - {}'.format(
+                index.first_stations[xs], index.last_stations[xs]))
+
+    obstruction = index.tables[OBSTRUCTION]
+    for i, j in zip(*iefa_obstruction_rule(index)):
+        interval_finding(index.tables[IEFA], i, IEFA_OBSTRUCTION, 'overlaps obstruction {} - {}'.format(
+            obstruction.starts[j], obstruction.ends[j]))
+
+    findings.sort(key=lambda finding: finding[0])
+    return [finding for _, finding in findings]
+
+
+def check_geometry(geofile):
+    """ Returns list of Finding for every cross section in HEC-RAS geometry file geofile """
+    return check_index(read_index(geofile))
+
+
+def summary(findings):
+    """ Returns OrderedDict of rule: number of findings """
+    counts = collections.OrderedDict((rule, 0) for rule in RULES)
+    for finding in findings:
+        counts[finding.rule] += 1
+    return counts
+
+
+def write_findings(findings, filename):
+    """ Writes findings to csv filename """
+    with gisio.open_csv(filename) as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(Finding._fields)
+        for finding in findings:
+            writer.writerow(finding)
+    gisio.message('Station findings written to ' + filename)
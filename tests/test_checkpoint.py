@@ -0,0 +1,94 @@
+"""
+Tests that a review run that stopped partway and was resumed from its checkpoint writes the same shapefile as
+a run that was never interrupted.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import checkpoint
+import fhad
+import gisio
+import review_benchmark
+import segment_cache
+
+# Cross sections reviewed before the interrupted run fails, past the first chunk but not the second
+FAIL_AFTER = checkpoint.CHUNK_SIZE + 100
+
+
+class Interrupted(Exception):
+    pass
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        review_benchmark.generate(self.folder, num_xs=2 * checkpoint.CHUNK_SIZE + 50, reaches=1, points=(10, 30))
+        # Cached segments would skip the segment builder the interrupted run fails in
+        self.environ = os.environ.get(segment_cache.ENV_VAR)
+        os.environ[segment_cache.ENV_VAR] = segment_cache.OFF
+        segment_cache._default[:] = []
+        self.core = fhad.load_tool('n_value_review').n_value_core
+        self.create = self.core.create_n_value_segments
+        self.backend = gisio.get_backend(gisio.PYTHON)
+
+    def tearDown(self):
+        self.core.create_n_value_segments = self.create
+        if self.environ is None:
+            del os.environ[segment_cache.ENV_VAR]
+        else:
+            os.environ[segment_cache.ENV_VAR] = self.environ
+        segment_cache._default[:] = []
+        shutil.rmtree(self.folder)
+
+    def params(self, name):
+        return review_benchmark.tool_params(self.folder, 'nvalue', os.path.join(self.folder, name + '.shp'))
+
+    def fail_after(self, count):
+        calls = []
+
+        def create(*args, **kwargs):
+            calls.append(None)
+            if len(calls) > count:
+                raise Interrupted()
+            return self.create(*args, **kwargs)
+        self.core.create_n_value_segments = create
+
+    def read(self, name):
+        contents = []
+        for ext in ('.shp', '.shx', '.dbf'):
+            with open(os.path.join(self.folder, name + ext), 'rb') as infile:
+                contents.append(infile.read())
+        return contents
+
+    def test_resume_matches_uninterrupted(self):
+        fhad.run_nvalue(self.params('full'), self.backend)
+
+        self.fail_after(FAIL_AFTER)
+        self.assertRaises(Interrupted, fhad.run_nvalue, self.params('part'), self.backend)
+        checkpoint_file = checkpoint.default_filename(self.params('part')['outfile'])
+        self.assertTrue(os.path.exists(checkpoint_file))
+
+        self.core.create_n_value_segments = self.create
+        params = self.params('part')
+        params['resume'] = True
+        fhad.run_nvalue(params, self.backend)
+        self.assertFalse(os.path.exists(checkpoint_file))
+        self.assertEqual(self.read('part'), self.read('full'))
+
+    def test_resume_skips_finished_chunks(self):
+        self.fail_after(FAIL_AFTER)
+        self.assertRaises(Interrupted, fhad.run_nvalue, self.params('part'), self.backend)
+        # Only the cross sections after the finished first chunk are reviewed again
+        self.fail_after(FAIL_AFTER)
+        params = self.params('part')
+        params['resume'] = True
+        fhad.run_nvalue(params, self.backend)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Tests stitching extents points into floodplain rings, and closing the gap between reaches at a junction.
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extents_core
+
+
+def reach_points(group, xs_ids, y0, spacing=4.0, left_x=0.0, right_x=10.0):
+    """ Returns (groups, xs_ids, right, coords) of a left and right point per cross section, ids increase with y """
+    groups, ids, right, coords = [], [], [], []
+    for i, xs_id in enumerate(xs_ids):
+        for is_right, x in ((False, left_x), (True, right_x)):
+            groups.append(group)
+            ids.append(xs_id)
+            right.append(is_right)
+            coords.append((x, y0 + i * spacing))
+    return np.array(groups), np.array(ids, dtype=float), np.array(right), np.array(coords)
+
+
+def join(*point_sets):
+    return tuple(np.concatenate(arrays) for arrays in zip(*point_sets))
+
+
+def rings(groups, xs_ids, right, coords):
+    """ Returns {group: (ring coordinates as a list, lowest id, highest id)} """
+    ring_groups, offsets, ring_coords, lowest, highest = extents_core.floodplain_rings(groups, xs_ids, right, coords)
+    return dict((int(group), (ring_coords[offsets[i]:offsets[i + 1]].tolist(), lowest[i], highest[i]))
+                for i, group in enumerate(ring_groups))
+
+
+class FloodplainRingsTest(unittest.TestCase):
+    def test_ring_order(self):
+        # Points are given out of order, the ring runs up the left side and back down the right side
+        groups, xs_ids, right, coords = reach_points(0, [100.0, 200.0, 300.0], 0.0)
+        order = np.array([5, 0, 3, 1, 4, 2])
+        result = rings(groups[order], xs_ids[order], right[order], coords[order])
+        self.assertEqual(result[0], ([[0.0, 0.0], [0.0, 4.0], [0.0, 8.0], [10.0, 8.0], [10.0, 4.0], [10.0, 0.0]],
+                                     100.0, 300.0))
+
+    def test_wetted_segments(self):
+        # Cross section 200 has two wetted segments, the ring runs from the first left to the last right extent
+        groups, xs_ids, right, coords = join(reach_points(0, [100.0, 200.0], 0.0),
+                                             reach_points(0, [200.0], 4.0, left_x=12.0, right_x=20.0))
+        self.assertEqual(rings(groups, xs_ids, right, coords)[0][0],
+                         [[0.0, 0.0], [0.0, 4.0], [20.0, 4.0], [10.0, 0.0]])
+
+    def test_incomplete(self):
+        groups, xs_ids, right, coords = join(reach_points(0, [100.0, 200.0, 300.0], 0.0), reach_points(1, [5.0], 50.0))
+        # Cross section 200 of group 0 has no right point, group 1 has one cross section
+        keep = ~((groups == 0) & (xs_ids == 200.0) & right)
+        result = rings(groups[keep], xs_ids[keep], right[keep], coords[keep])
+        self.assertEqual(list(result), [0])
+        self.assertEqual(result[0][0], [[0.0, 0.0], [0.0, 8.0], [10.0, 8.0], [10.0, 0.0]])
+
+
+class JunctionPointsTest(unittest.TestCase):
+    def setUp(self):
+        # Group 0 flows into group 1, whose upstream most cross section is 300 at y = 8
+        self.points = join(reach_points(0, [1100.0, 1200.0, 1300.0], 10.0), reach_points(1, [100.0, 200.0, 300.0], 0.0))
+
+    def test_gap_closed(self):
+        points = extents_core.junction_points({0: 1}, *self.points)
+        result = rings(*points)
+        self.assertEqual(result[0][0][0], [0.0, 8.0])
+        self.assertEqual(result[0][0][-1], [10.0, 8.0])
+        self.assertEqual(len(result[0][0]), 8)
+        # Cross section ids of the ring are its own reach's
+        self.assertEqual(result[0][1:], (1100.0, 1300.0))
+        self.assertEqual(result[1], rings(*self.points)[1])
+
+    def test_no_connections(self):
+        points = extents_core.junction_points({}, *self.points)
+        for before, after in zip(self.points, points):
+            self.assertTrue(np.array_equal(before, after))
+
+    def test_missing_downstream_reach(self):
+        points = extents_core.junction_points({0: 7}, *self.points)
+        self.assertEqual(len(points[0]), len(self.points[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
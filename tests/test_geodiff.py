@@ -0,0 +1,109 @@
+"""
+Tests that updating all-geo review lines for the cross sections that changed between two geometry revisions
+gives the same features as reviewing the new geometry from scratch.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fhad
+import geodiff
+import gisio
+import review_benchmark
+import segment_cache
+
+# Header of the blocks edited in the new geometry: field edited in the first line of the block
+EDITS = {'#Mann=': 1, '#XS Ineff=': 2, '#Block Obstruct=': 2}
+# Every EVERY-th block of each kind is edited
+EVERY = 4
+REVIEWS = (('n_value_review', '_n_value.shp'), ('iefa_review', '_iefa.shp'), ('blocked_review', '_blocked.shp'))
+
+
+def edit_geometry(old_geofile, new_geofile):
+    """ Writes old_geofile to new_geofile with an n-value or elevation of every EVERY-th block raised """
+    seen = dict((header, 0) for header in EDITS)
+    edit = None
+    with open(old_geofile) as infile:
+        lines = infile.read().split('\n')
+    for i, line in enumerate(lines):
+        if edit is not None:
+            start = 8 * EDITS[edit]
+            value = float(line[start:start + 8]) + (0.005 if edit == '#Mann=' else 1.0)
+            lines[i] = line[:start] + '{:8.3f}'.format(value) + line[start + 8:]
+            edit = None
+        for header in EDITS:
+            if line.startswith(header):
+                seen[header] += 1
+                if seen[header] % EVERY == 0:
+                    edit = header
+    with open(new_geofile, 'w') as outfile:
+        outfile.write('\n'.join(lines))
+
+
+def canonical(feature):
+    """ Returns geometry and values of feature as a sortable tuple, rounded like the golden output check """
+    geometry, values = feature
+    parts = tuple(tuple((round(x, 4), round(y, 4)) for x, y in part.tolist()) for part in geometry)
+    values = tuple(round(value, 4) if isinstance(value, float) else
+                   value.strip() if isinstance(value, gisio.string_types) else value for value in values)
+    return values, parts
+
+
+class UpdateReviewTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        review_benchmark.generate(self.folder, num_xs=60, reaches=2, points=(10, 30))
+        self.environ = os.environ.get(segment_cache.ENV_VAR)
+        os.environ[segment_cache.ENV_VAR] = segment_cache.OFF
+        segment_cache._default[:] = []
+        self.old_geofile = os.path.join(self.folder, review_benchmark.GEOFILE)
+        self.new_geofile = os.path.join(self.folder, 'model.g02')
+        edit_geometry(self.old_geofile, self.new_geofile)
+        self.backend = gisio.get_backend(gisio.PYTHON)
+
+    def tearDown(self):
+        if self.environ is None:
+            del os.environ[segment_cache.ENV_VAR]
+        else:
+            os.environ[segment_cache.ENV_VAR] = self.environ
+        segment_cache._default[:] = []
+        shutil.rmtree(self.folder)
+
+    def allgeo(self, geofile, out_dir, old_geofile=None):
+        params = review_benchmark.tool_params(self.folder, 'nvalue', None)
+        del params['outfile']
+        params.update({'geofile': geofile, 'out_dir': out_dir, 'prefix': 'model', 'old_geofile': old_geofile})
+        fhad.run_allgeo(params, self.backend)
+
+    def features(self, module_name, filename):
+        fields = fhad.load_tool(module_name).output_fields(review_benchmark.XS_ID_FIELD, review_benchmark.RIVER_FIELD,
+                                                            review_benchmark.REACH_FIELD)
+        return sorted(canonical(feature) for feature in
+                      self.backend.read_features(filename, [field.name for field in fields]))
+
+    def test_changed_blocks(self):
+        geo_diff = geodiff.GeometryDiff(self.old_geofile, self.new_geofile)
+        for module_name, _ in REVIEWS:
+            self.assertTrue(geo_diff.changed(fhad.load_tool(module_name).RAS_BLOCKS))
+        self.assertFalse(geo_diff.added or geo_diff.removed)
+
+    def test_update_matches_regeneration(self):
+        updated = os.path.join(self.folder, 'updated')
+        regenerated = os.path.join(self.folder, 'regenerated')
+        self.allgeo(self.old_geofile, updated)
+        before = dict((suffix, self.features(module_name, os.path.join(updated, 'model' + suffix)))
+                      for module_name, suffix in REVIEWS)
+        self.allgeo(self.new_geofile, updated, self.old_geofile)
+        self.allgeo(self.new_geofile, regenerated)
+        for module_name, suffix in REVIEWS:
+            features = self.features(module_name, os.path.join(updated, 'model' + suffix))
+            self.assertEqual(features, self.features(module_name, os.path.join(regenerated, 'model' + suffix)))
+            self.assertNotEqual(features, before[suffix])
+
+
+if __name__ == '__main__':
+    unittest.main()
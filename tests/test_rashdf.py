@@ -0,0 +1,91 @@
+"""
+Regression tests for BFEs from HEC-RAS plan results files with several profiles. Every profile of a plan
+repeats each cross section at the same cumulative length, BFEs are only calculated along one profile.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bfe_core
+import input_cache
+import rashdf
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+PROFILES = ['10yr', '100yr']
+RIVER_STATIONS = ['300', '200', '100']
+# Water surface elevation of each profile and cross section, cross sections are listed upstream to downstream
+WSEL = [[5003.5, 5002.2, 5000.1],
+        [5006.4, 5004.8, 5002.3]]
+
+
+def write_plan(filename):
+    """ Writes a two profile, three cross section steady flow plan results file """
+    attributes = np.zeros(len(RIVER_STATIONS), dtype=[('River', 'S16'), ('Reach', 'S16'), ('RS', 'S8'),
+                                                      ('Len Channel', 'f4')])
+    attributes['River'] = b'Boulder Creek'
+    attributes['Reach'] = b'Upper'
+    attributes['RS'] = [station.encode('ascii') for station in RIVER_STATIONS]
+    attributes['Len Channel'] = [100.0, 100.0, 0.0]
+    with h5py.File(filename, 'w') as hdf:
+        hdf[rashdf.XS_ATTRIBUTES] = attributes
+        hdf[rashdf.PROFILE_NAMES] = np.array([profile.encode('ascii') for profile in PROFILES], dtype='S16')
+        hdf[rashdf.XS_RESULTS + '/' + rashdf.WSEL[0]] = np.array(WSEL, dtype='f4')
+
+
+@unittest.skipIf(h5py is None, 'h5py is required to read plan results')
+class PlanProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'model.p01.hdf')
+        write_plan(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def bfes(self, profile=None):
+        rs = input_cache.river_system(self.filename, profile)
+        rs.sort_all()
+        rs.calc_all_reach_lengths()
+        rs.calc_all_BFEs()
+        return rs
+
+    def test_one_profile(self):
+        table = rashdf.read_plan_results(self.filename).river_system_table('100yr')
+        self.assertEqual(table['profile'].tolist(), ['100yr'] * 3)
+        self.assertEqual(table['cum_length'].tolist(), [200.0, 100.0, 0.0])
+
+    def test_defaults_to_first_profile(self):
+        rs = self.bfes()
+        self.assertEqual(rs.number_of_XSs(), len(RIVER_STATIONS))
+        self.assertEqual(set(xs.profile for reach in rs.reaches for xs in reach.cross_sections), set(['10yr']))
+
+    def test_bfes_of_profile(self):
+        rs = self.bfes('100yr')
+        self.assertEqual(rs.number_of_XSs(), len(RIVER_STATIONS))
+        self.assertEqual([bfe.elevation for bfe in rs.reaches[0].BFEs], [5003, 5004, 5005, 5006])
+
+    def test_missing_profile(self):
+        self.assertRaises(ValueError, self.bfes, '500yr')
+
+    def test_csv_profile(self):
+        filename = os.path.join(self.folder, 'profiles.csv')
+        with open(filename, 'w') as outfile:
+            for profile, wsels in zip(PROFILES, WSEL):
+                for station, wsel, length in zip(RIVER_STATIONS, wsels, [200.0, 100.0, 0.0]):
+                    outfile.write('Boulder Creek,Upper,{},{},{},{}\n'.format(station, profile, wsel, length))
+        table = bfe_core.river_system_table(input_cache.river_system(filename, '100yr'))
+        self.assertEqual(table['WSEL'].tolist(), WSEL[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
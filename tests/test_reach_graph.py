@@ -0,0 +1,68 @@
+"""
+Tests the reach task scheduler. Tasks run after all reaches upstream of them, and failed tasks, including
+pool errors, raise ReachTaskError instead of hanging.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reach_graph
+
+
+def graph():
+    """ Returns two tributaries joining a main stem that flows into an outlet reach """
+    result = reach_graph.ReachGraph()
+    result.add_connection(('Creek', 'Left'), ('Creek', 'Main'))
+    result.add_connection(('Creek', 'Right'), ('Creek', 'Main'))
+    result.add_connection(('Creek', 'Main'), ('Creek', 'Outlet'))
+    return result
+
+
+def path_task(reach, upstream_results):
+    """ Returns reaches at and above reach, fails if an upstream result is missing """
+    reaches = set([reach])
+    for up_reaches in upstream_results.values():
+        reaches.update(up_reaches)
+    return reaches
+
+
+def failing_task(reach, upstream_results):
+    if reach == ('Creek', 'Right'):
+        raise ValueError('No cross sections')
+    return reach
+
+
+def unpicklable_task(reach, upstream_results):
+    return lambda: reach
+
+
+class RunReachesTest(unittest.TestCase):
+    def check_order(self, workers):
+        results = reach_graph.run_reaches(graph(), path_task, workers=workers)
+        self.assertEqual(list(results), graph().topological_order())
+        self.assertEqual(results[('Creek', 'Main')], set([('Creek', 'Left'), ('Creek', 'Right'), ('Creek', 'Main')]))
+        self.assertEqual(len(results[('Creek', 'Outlet')]), 4)
+
+    def test_order(self):
+        self.check_order(1)
+
+    def test_order_in_pool(self):
+        self.check_order(2)
+
+    def test_failed_task(self):
+        self.assertRaises(reach_graph.ReachTaskError, reach_graph.run_reaches, graph(), failing_task, workers=2)
+
+    def test_unpicklable_result(self):
+        self.assertRaises(reach_graph.ReachTaskError, reach_graph.run_reaches, graph(), unpicklable_task, workers=2)
+
+    def test_unpicklable_argument(self):
+        self.assertRaises(reach_graph.ReachTaskError, reach_graph.run_reaches, graph(), path_task, workers=2,
+                          args=(lambda: None,))
+
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+Tests the review segment cache. Cached segments read back like built ones, and warnings raised while
+building them are repeated when they come from the cache.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import segment_cache
+
+COORDS = np.array([[0.0, 0.0], [30.0, 40.0], [60.0, 80.0]])
+
+
+def core_module():
+    """ Returns a stand in for a review core module, its warn() records texts """
+    core = types.ModuleType('review_core_stub')
+    core.warnings = []
+    core.warn = core.warnings.append
+    return core
+
+
+class CachedSegmentsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = segment_cache.SegmentCache(self.folder)
+        self.core = core_module()
+        self.builds = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def build(self):
+        self.builds += 1
+        self.core.warn('Cross section 1200.5 appears to have n-value change at last station. Ignoring.')
+        return [(COORDS[:2], 0.035), (COORDS[1:], 0.06)]
+
+    def segments(self):
+        return segment_cache.cached_segments(self.cache, 'n_value', COORDS, [0.035, 0.06], self.build, self.core)
+
+    def test_cached(self):
+        built = self.segments()
+        cached = self.segments()
+        self.assertEqual(self.builds, 1)
+        self.assertEqual([value for _, value in cached], [value for _, value in built])
+        for (cached_coords, _), (built_coords, _) in zip(cached, built):
+            self.assertTrue(np.array_equal(cached_coords, built_coords))
+
+    def test_warnings_repeated(self):
+        self.segments()
+        self.segments()
+        self.assertEqual(len(self.core.warnings), 2)
+        self.assertEqual(self.core.warnings[0], self.core.warnings[1])
+
+    def test_pack(self):
+        warnings = ['At XS 10, IEFA station 5.0', u'Station \xb1 2']
+        segments, unpacked = segment_cache._unpack(segment_cache._pack([(COORDS, 1.0)], warnings))
+        self.assertTrue(np.array_equal(segments[0][0], COORDS))
+        self.assertEqual([segment_cache._encode(text) for text in unpacked],
+                         [segment_cache._encode(text) for text in warnings])
+        self.assertEqual(segment_cache._unpack(segment_cache._pack([(COORDS, 1.0)]))[1], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Tests the batched Douglas-Peucker simplification against the textbook recursive algorithm.
+"""
+import math
+import os
+import random
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simplify
+
+
+def distance(point, start, end):
+    """ Returns distance of point to the line through start and end, or to start if they're the same """
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    px, py = point[0] - start[0], point[1] - start[1]
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return math.hypot(px, py)
+    return abs(dx * py - dy * px) / length
+
+
+def douglas_peucker(coords, first, last, tolerance, kept):
+    """ Flags the vertices of coords[first:last + 1] kept by recursive Douglas-Peucker in kept """
+    kept[first] = kept[last] = True
+    if last - first < 2:
+        return
+    distances = [distance(coords[i], coords[first], coords[last]) for i in range(first + 1, last)]
+    farthest = int(np.argmax(distances))
+    if distances[farthest] > tolerance:
+        douglas_peucker(coords, first, first + 1 + farthest, tolerance, kept)
+        douglas_peucker(coords, first + 1 + farthest, last, tolerance, kept)
+
+
+def reference_mask(coords, part_offsets, tolerance, keep=None):
+    """ Returns recursive Douglas-Peucker of every part, split at the vertices flagged in keep """
+    kept = [False] * len(coords)
+    for start, stop in zip(part_offsets[:-1], part_offsets[1:]):
+        if stop <= start:
+            continue
+        ends = [start] + [i for i in range(start + 1, stop - 1) if keep is not None and keep[i]] + [stop - 1]
+        for first, last in zip(ends[:-1], ends[1:]):
+            douglas_peucker(coords, first, last, tolerance, kept)
+        kept[start] = kept[stop - 1] = True
+    return np.array(kept, dtype=bool)
+
+
+def random_parts(rng, count):
+    """ Returns (coords, part_offsets) of count random walks, some with repeated vertices and closed """
+    parts = []
+    for _ in range(count):
+        size = rng.randint(1, 60)
+        x, y = rng.uniform(0, 1000), rng.uniform(0, 1000)
+        part = []
+        for _ in range(size):
+            x += rng.uniform(-20, 20)
+            y += rng.uniform(-20, 20)
+            part.append((round(x, 1), round(y, 1)))
+            if rng.random() < 0.05:
+                part.append(part[-1])
+        if len(part) > 2 and rng.random() < 0.2:
+            part.append(part[0])
+        parts.append(part)
+    part_offsets = np.concatenate([[0], np.cumsum([len(part) for part in parts])])
+    return np.array([vertex for part in parts for vertex in part], dtype=float), part_offsets
+
+
+class SimplifyMaskTest(unittest.TestCase):
+    def test_matches_recursive(self):
+        rng = random.Random(7)
+        coords, part_offsets = random_parts(rng, 200)
+        for tolerance in (0.5, 2.0, 10.0, 50.0):
+            self.assertEqual(simplify.simplify_mask(coords, part_offsets, tolerance).tolist(),
+                             reference_mask(coords, part_offsets, tolerance).tolist())
+
+    def test_keep(self):
+        rng = random.Random(11)
+        coords, part_offsets = random_parts(rng, 100)
+        keep = np.array([rng.random() < 0.1 for _ in range(len(coords))])
+        mask = simplify.simplify_mask(coords, part_offsets, 5.0, keep)
+        self.assertEqual(mask.tolist(), reference_mask(coords, part_offsets, 5.0, keep).tolist())
+        self.assertTrue(mask[keep].all())
+
+    def test_no_tolerance(self):
+        coords, part_offsets = random_parts(random.Random(3), 10)
+        self.assertTrue(simplify.simplify_mask(coords, part_offsets, 0).all())
+        self.assertTrue(simplify.simplify_mask(coords, part_offsets, None).all())
+
+    def test_straight_line(self):
+        line = np.array([[0.0, 0.0], [1.0, 0.01], [2.0, -0.01], [3.0, 0.0], [10.0, 0.0]])
+        self.assertEqual(simplify.simplify_line(line, 0.1).tolist(), [[0.0, 0.0], [10.0, 0.0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Tests the station index rules on a small geometry file with one problem per cross section, and station
+queries against a scan of the intervals.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import station_index
+
+STATIONS = [0.0, 25.0, 50.0, 75.0, 100.0]
+
+
+def fixed_width(values, per_line):
+    fields = ['{:8.2f}'.format(value) for value in values]
+    return [''.join(fields[i:i + per_line]) for i in range(0, len(fields), per_line)]
+
+
+def cross_section(xs_id, n_values, iefa=None, obstructions=None):
+    """
+    Returns lines of a RAS cross section with sta/elev STATIONS
+    :param n_values: list of (station, n)
+    :param iefa, obstructions: (type, [(start, end, elevation), ...]) or None
+    """
+    sta_elev = []
+    for station in STATIONS:
+        sta_elev += [station, 5290.0 + abs(station - 50.0) / 10.0]
+    lines = ['Type RM Length L Ch R = 1 ,{:<8},100.0,100.0,100.0'.format(xs_id),
+             '#Sta/Elev= {} '.format(len(STATIONS))] + fixed_width(sta_elev, 10)
+    lines.append('#Mann= {} , 0 , 0 '.format(len(n_values)))
+    fields = []
+    for station, n in n_values:
+        fields += ['{:8.2f}'.format(station), '{:8.3f}'.format(n), '{:8d}'.format(0)]
+    lines += [''.join(fields[i:i + 9]) for i in range(0, len(fields), 9)]
+    lines.append('Bank Sta=25,75')
+    for key, table in (('#XS Ineff=', iefa), ('#Block Obstruct=', obstructions)):
+        if table is None:
+            continue
+        table_type, blocks = table
+        lines.append('{} {} ,{} '.format(key, len(blocks), table_type))
+        lines += fixed_width([value for block in blocks for value in block], 9)
+        if key == '#XS Ineff=':
+            lines += ['Permanent Ineff=', '       F       F']
+    return lines + ['']
+
+
+# Cross section id: expected (kind, rule) findings
+EXPECTED = {500.0: [],
+            400.0: [(station_index.IEFA, station_index.OVERLAP)],
+            300.0: [(station_index.OBSTRUCTION, station_index.OUTSIDE)],
+            200.0: [(station_index.IEFA, station_index.IEFA_OBSTRUCTION)],
+            # 60 - 40 runs backwards and 40 - 100 starts inside 0 - 60
+            100.0: [(station_index.N_VALUE, station_index.ORDER), (station_index.N_VALUE, station_index.OVERLAP)]}
+
+
+def write_geometry(filename):
+    lines = ['Geom Title=Station index test', 'Program Version=5.07', '',
+             'River Reach={:<16},{:<16}'.format('Creek', 'Upper'), '']
+    lines += cross_section(500.0, [(0.0, 0.06), (25.0, 0.035), (75.0, 0.06)], iefa=(0, [(0.0, 20.0, 5295.0),
+                                                                                       (80.0, 100.0, 5295.0)]))
+    lines += cross_section(400.0, [(0.0, 0.06), (50.0, 0.035)], iefa=(-1, [(10.0, 40.0, 5295.0),
+                                                                          (30.0, 60.0, 5296.0)]))
+    lines += cross_section(300.0, [(0.0, 0.06), (50.0, 0.035)], obstructions=(-1, [(90.0, 120.0, 5300.0)]))
+    lines += cross_section(200.0, [(0.0, 0.06), (50.0, 0.035)], iefa=(-1, [(10.0, 40.0, 5295.0)]),
+                           obstructions=(-1, [(30.0, 50.0, 5300.0)]))
+    lines += cross_section(100.0, [(0.0, 0.06), (60.0, 0.035), (40.0, 0.05)])
+    with open(filename, 'w') as outfile:
+        outfile.write('\n'.join(lines) + '\n')
+
+
+class StationIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.geofile = os.path.join(self.folder, 'model.g01')
+        write_geometry(self.geofile)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_rules(self):
+        findings = station_index.check_geometry(self.geofile)
+        found = dict((xs_id, []) for xs_id in EXPECTED)
+        for finding in findings:
+            found[finding.xs_id].append((finding.kind, finding.rule))
+        self.assertEqual(dict((xs_id, sorted(set(rules))) for xs_id, rules in found.items()), EXPECTED)
+
+    def test_queries(self):
+        index = station_index.read_index(self.geofile)
+        for kind in station_index.KINDS:
+            table = index[kind]
+            xs = np.repeat(np.arange(len(index)), 11)
+            low = np.tile(np.arange(-10.0, 101.0, 11.0), len(index))
+            high = low + 12.0
+            query, interval = table.overlapping(xs, low, high)
+            expected = set((q, i) for q in range(len(xs)) for i in range(table.offsets[xs[q]], table.offsets[xs[q] + 1])
+                           if table.starts[i] <= high[q] and table.ends[i] >= low[q])
+            self.assertEqual(set(zip(query.tolist(), interval.tolist())), expected)
+
+    def test_values_at(self):
+        index = station_index.read_index(self.geofile)
+        values = index.values_at(station_index.N_VALUE, np.zeros(3, dtype=np.int64), np.array([10.0, 30.0, 90.0]))
+        self.assertEqual(values.tolist(), [0.06, 0.035, 0.06])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Tests water surface interpolation between BFE lines. Cells are only weighted between two lines of a reach
+when they lie between them.
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wsgrid
+
+
+def lines(xs, elevations, groups=None):
+    """ Returns WSLines of vertical lines from y = -50 to 50 at xs """
+    segments = np.array([[x, -50.0, x, 50.0] for x in xs])
+    groups = np.zeros(len(xs), dtype=np.int64) if groups is None else np.array(groups, dtype=np.int64)
+    return wsgrid.WSLines(segments, np.arange(len(xs)), np.array(elevations, dtype=float), groups)
+
+
+class InterpolateTest(unittest.TestCase):
+    def setUp(self):
+        self.lines = lines([10.0, 90.0], [5.0, 1.0])
+
+    def wsel(self, x, y=0.0, ws_lines=None):
+        return wsgrid.interpolate(ws_lines or self.lines, np.array([x], dtype=float), np.array([y], dtype=float))[0]
+
+    def test_between_lines(self):
+        self.assertAlmostEqual(self.wsel(50.0), 3.0)
+        self.assertAlmostEqual(self.wsel(30.0), 4.0)
+
+    def test_past_last_line(self):
+        for x in (94.0, 200.0, 400.0):
+            self.assertAlmostEqual(self.wsel(x), 1.0)
+
+    def test_before_first_line(self):
+        self.assertAlmostEqual(self.wsel(5.0), 5.0)
+
+    def test_beside_lines(self):
+        # Cells beyond the ends of short lines are still between them along the reach
+        self.assertAlmostEqual(self.wsel(50.0, 300.0), 3.0)
+
+    def test_uneven_spacing(self):
+        ws_lines = lines([0.0, 100.0, 400.0], [1.0, 2.0, 5.0])
+        self.assertAlmostEqual(self.wsel(110.0, ws_lines=ws_lines), 2.1)
+        self.assertAlmostEqual(self.wsel(-20.0, ws_lines=ws_lines), 1.0)
+
+    def test_other_reach(self):
+        ws_lines = lines([10.0, 90.0], [5.0, 1.0], groups=[0, 1])
+        self.assertAlmostEqual(self.wsel(40.0, ws_lines=ws_lines), 5.0)
+
+    def test_max_distance(self):
+        self.assertTrue(np.isnan(self.wsel(90.0 + wsgrid.MAX_DISTANCE + 1.0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,343 @@
+"""
+Water surface elevation and depth grids from BFE lines, or from cross section cut lines and HEC-RAS water
+surface elevations. The water surface at each DEM cell between two lines of the same reach is interpolated
+between them, weighted by inverse distance, so it varies linearly between cross sections or BFEs along the
+reach. Cells past the ends of a reach get the elevation of the nearest line. Depth is the water surface
+minus the DEM, cells with a positive depth are inundated.
+
+The DEM and the output grids are ESRI float grids (.flt with a .hdr, 'Raster To Float' in ArcGIS). Grids
+are memory mapped and processed in tiles, optionally in a process pool, so memory use depends on the tile
+size and not the size of the DEM. Outputs have the DEM's cells:
+
+    <prefix>_wsel.flt   water surface elevation of inundated cells
+    <prefix>_depth.flt  depth of inundated cells
+    <prefix>_mask.flt   1 for inundated cells
+"""
+import multiprocessing
+import os
+
+import numpy as np
+
+import gisio
+import input_cache
+
+NODATA = -9999.0
+TILE_SIZE = 512
+# Cells farther than this from every line are not interpolated, in map units
+MAX_DISTANCE = 500.0
+# Cell to line segment distances calculated at once, bounds memory of tiles near many lines
+MAX_PAIRS = 1000000
+WSEL = 'wsel'
+DEPTH = 'depth'
+MASK = 'mask'
+OUTPUTS = (WSEL, DEPTH, MASK)
+# River of profile table rows without a river column, see extents_core.import_wsel()
+UNKNOWN_RIVER = 'Unknown'
+
+
+class GridHeader(object):
+    """ ESRI float grid header, xll and yll are the lower left corner of the lower left cell """
+    def __init__(self, ncols, nrows, xll, yll, cellsize, nodata=NODATA, byteorder='LSBFIRST'):
+        self.ncols = ncols
+        self.nrows = nrows
+        self.xll = xll
+        self.yll = yll
+        self.cellsize = cellsize
+        self.nodata = nodata
+        self.byteorder = byteorder
+
+    @property
+    def dtype(self):
+        return np.dtype('<f4' if self.byteorder.upper().startswith('LSB') else '>f4')
+
+    def cell_centers(self, row0, row1, col0, col1):
+        """ Returns x of columns col0:col1 and y of rows row0:row1, rows start at the top """
+        xs = self.xll + (np.arange(col0, col1) + 0.5) * self.cellsize
+        ys = self.yll + (self.nrows - np.arange(row0, row1) - 0.5) * self.cellsize
+        return xs, ys
+
+    @classmethod
+    def read(cls, filename):
+        """ Reads the .hdr of float grid filename """
+        values = {}
+        with open(_header_name(filename)) as infile:
+            for line in infile:
+                fields = line.split()
+                if len(fields) == 2:
+                    values[fields[0].lower()] = fields[1]
+        try:
+            cellsize = float(values['cellsize'])
+            xll = float(values['xllcorner']) if 'xllcorner' in values else float(values['xllcenter']) - cellsize / 2
+            yll = float(values['yllcorner']) if 'yllcorner' in values else float(values['yllcenter']) - cellsize / 2
+            return cls(int(values['ncols']), int(values['nrows']), xll, yll, cellsize,
+                       float(values.get('nodata_value', NODATA)), values.get('byteorder', 'LSBFIRST'))
+        except KeyError as e:
+            gisio.error('Grid header ' + _header_name(filename) + ' is missing ' + str(e))
+            raise
+
+    def write(self, filename):
+        with open(_header_name(filename), 'w') as outfile:
+            for name, value in (('ncols', int(self.ncols)), ('nrows', int(self.nrows)),
+                                ('xllcorner', repr(float(self.xll))), ('yllcorner', repr(float(self.yll))),
+                                ('cellsize', repr(float(self.cellsize))), ('NODATA_value', repr(float(self.nodata))),
+                                ('byteorder', self.byteorder)):
+                outfile.write('{:<14}{}\n'.format(name, value))
+
+
+def _header_name(filename):
+    return os.path.splitext(filename)[0] + '.hdr'
+
+
+def open_grid(filename, mode='r'):
+    """ Returns (GridHeader, memory mapped (nrows, ncols) array) of float grid filename """
+    header = GridHeader.read(filename)
+    return header, np.memmap(filename, dtype=header.dtype, mode=mode, shape=(header.nrows, header.ncols))
+
+
+def create_grid(filename, header):
+    """ Creates float grid filename of header, cells are written by the tiles """
+    header.write(filename)
+    grid = np.memmap(filename, dtype=header.dtype, mode='w+', shape=(header.nrows, header.ncols))
+    del grid
+
+
+class WSLines(object):
+    """
+    Lines with a water surface elevation. Segments are an (m, 4) array of x1, y1, x2, y2 ordered by line,
+    segment_lines is the line of each segment. Lines of one reach have the same group number. All attributes
+    are numpy arrays so lines pickle quickly to worker processes.
+    """
+    def __init__(self, segments, segment_lines, elevations, groups):
+        self.segments = segments
+        self.segment_lines = segment_lines
+        self.elevations = elevations
+        self.groups = groups
+        if len(segments):
+            self.seg_min = np.minimum(segments[:, :2], segments[:, 2:])
+            self.seg_max = np.maximum(segments[:, :2], segments[:, 2:])
+        else:
+            self.seg_min = self.seg_max = np.zeros((0, 2))
+
+    def __len__(self):
+        return len(self.elevations)
+
+    @classmethod
+    def from_features(cls, features, elevations, groups):
+        """
+        :param features: shparrays.FeatureArrays of polylines, all parts of a feature are used
+        :param elevations: water surface elevation of each feature, nan to skip the feature
+        :param groups: list of reach keys of each feature
+        """
+        elevations = np.asarray(elevations, dtype=float)
+        parts_per_feature = np.diff(features.feature_offsets)
+        part_features = np.repeat(np.arange(len(features)), parts_per_feature)
+        vertex_parts = np.repeat(np.arange(len(features.part_offsets) - 1), np.diff(features.part_offsets))
+        # Segments join consecutive vertices of a part
+        starts = np.flatnonzero(vertex_parts[:-1] == vertex_parts[1:])
+        segment_features = part_features[vertex_parts[starts]]
+        keep = ~np.isnan(elevations)
+        starts, segment_features = starts[keep[segment_features]], segment_features[keep[segment_features]]
+        line_numbers = np.cumsum(keep) - 1
+
+        group_numbers = {}
+        group_ids = [group_numbers.setdefault(group, len(group_numbers)) for group, kept in zip(groups, keep) if kept]
+        segments = np.hstack([features.coords[starts], features.coords[starts + 1]])
+        return cls(segments, line_numbers[segment_features], elevations[keep], np.array(group_ids, dtype=np.int64))
+
+
+def lines_from_features(backend, filename, elev_field, group_fields=()):
+    """
+    Returns WSLines of polylines with an elevation field, e.g. bfetool output
+    :param group_fields: fields identifying the reach of each line, e.g. river and reach fields. Lines are
+        interpolated with lines of the same reach, all lines are one reach if empty.
+    """
+    features = input_cache.feature_arrays(backend, filename, [elev_field] + list(group_fields))
+    try:
+        elevations = features.column(elev_field).astype(float)
+    except ValueError:
+        gisio.error('Unable to convert ' + elev_field + ' in ' + filename + ' to numbers')
+        raise
+    groups = list(zip(*[features.column(field).tolist() for field in group_fields])) if group_fields else \
+        [()] * len(features)
+    return WSLines.from_features(features, elevations, groups)
+
+
+def lines_from_cross_sections(backend, xs_file, xs_id_field, river_field, reach_field, wsel_list, profile,
+                              round_digits=None):
+    """
+    Returns WSLines of cross section cut lines with the water surface elevation of profile. Cut lines are
+    matched to elevations by river, reach, and cross section id, river stations repeat across reaches.
+    :param wsel_list: list of extents_core.WS_elevation, see extents_core.import_wsel()
+    :param round_digits: round cross section ids to digits when matching, None to match exactly
+    """
+    def key(river, reach, xs_id):
+        return river, reach, round(xs_id, round_digits) if round_digits is not None else xs_id
+
+    wsels = {}
+    for row in wsel_list:
+        if row.profile == profile:
+            # Single reach profile tables have no river column, those rows are matched by id alone
+            if row.river == UNKNOWN_RIVER:
+                wsels[key(None, None, row.XS_ID)] = row
+            else:
+                wsels[key(row.river, row.reach, row.XS_ID)] = row
+    if not wsels:
+        gisio.error('Profile ' + profile + ' not found')
+        raise ValueError('Profile ' + profile + ' not found')
+    features = input_cache.feature_arrays(backend, xs_file, [xs_id_field, river_field, reach_field])
+    keys = zip(features.column(river_field).tolist(), features.column(reach_field).tolist(),
+               features.column(xs_id_field).astype(float).tolist())
+    matches = [wsels.get(key(river, reach, xs_id)) or wsels.get(key(None, None, xs_id)) for river, reach, xs_id in keys]
+    missing = sum(1 for row in matches if row is None)
+    if missing:
+        gisio.warn('{} cross sections in {} have no water surface elevation for profile {}'.format(
+            missing, xs_file, profile))
+    elevations = [row.WSEL if row is not None else np.nan for row in matches]
+    groups = [(row.river, row.reach) if row is not None else None for row in matches]
+    return WSLines.from_features(features, elevations, groups)
+
+
+def _segment_offsets(x, y, segments):
+    """ Returns (points, segments) arrays of x and y offsets from points x, y to the closest point of segments """
+    x, y = x[:, np.newaxis], y[:, np.newaxis]
+    x1, y1, x2, y2 = segments[:, 0], segments[:, 1], segments[:, 2], segments[:, 3]
+    dx, dy = x2 - x1, y2 - y1
+    length2 = dx * dx + dy * dy
+    t = ((x - x1) * dx + (y - y1) * dy) / np.where(length2 > 0, length2, 1.0)
+    np.clip(t, 0.0, 1.0, out=t)
+    return x1 + t * dx - x, y1 + t * dy - y
+
+
+def _between(x1, y1, x2, y2):
+    """
+    Returns True where a point is between two lines, x1, y1 and x2, y2 are offsets from the point to its closest
+    point on each line. The point is between if it projects onto the segment joining the closest points.
+    """
+    dot = x1 * x2 + y1 * y2
+    return (x1 * x1 + y1 * y1 >= dot) & (x2 * x2 + y2 * y2 >= dot)
+
+
+def interpolate(lines, x, y, max_distance=MAX_DISTANCE):
+    """
+    Returns water surface elevations at points x, y, nan farther than max_distance from every line. Points
+    between their nearest line and another line of the same reach are weighted between the two by inverse
+    distance, other points, e.g. past the last line of a reach, get the nearest line's elevation.
+    """
+    result = np.full(len(x), np.nan)
+    if len(x) == 0 or len(lines) == 0:
+        return result
+    near = np.flatnonzero((lines.seg_max[:, 0] >= x.min() - max_distance) &
+                          (lines.seg_min[:, 0] <= x.max() + max_distance) &
+                          (lines.seg_max[:, 1] >= y.min() - max_distance) &
+                          (lines.seg_min[:, 1] <= y.max() + max_distance))
+    if len(near) == 0:
+        return result
+    segments = lines.segments[near]
+    segment_lines = lines.segment_lines[near]
+    # Segments are ordered by line, first segment of each nearby line
+    is_first = np.concatenate([[True], segment_lines[1:] != segment_lines[:-1]])
+    firsts = np.flatnonzero(is_first)
+    segment_numbers = np.cumsum(is_first) - 1
+    line_ids = segment_lines[firsts]
+    elevations = lines.elevations[line_ids]
+    groups = lines.groups[line_ids]
+
+    block = max(1, MAX_PAIRS // len(segments))
+    for start in range(0, len(x), block):
+        stop = min(start + block, len(x))
+        offset_x, offset_y = _segment_offsets(x[start:stop], y[start:stop], segments)
+        distances = np.hypot(offset_x, offset_y)
+        line_distances = np.minimum.reduceat(distances, firsts, axis=1)
+        rows = np.arange(stop - start)
+        # Offsets to the closest point of each line
+        closest = np.maximum.reduceat(np.where(distances == line_distances[:, segment_numbers],
+                                               np.arange(len(segments)), -1), firsts, axis=1)
+        line_x, line_y = offset_x[rows[:, np.newaxis], closest], offset_y[rows[:, np.newaxis], closest]
+
+        nearest = np.argmin(line_distances, axis=1)
+        d1 = line_distances[rows, nearest]
+        blend = (groups[np.newaxis, :] == groups[nearest][:, np.newaxis]) & \
+            _between(line_x[rows, nearest][:, np.newaxis], line_y[rows, nearest][:, np.newaxis], line_x, line_y)
+        others = np.where(blend, line_distances, np.inf)
+        others[rows, nearest] = np.inf
+        second = np.argmin(others, axis=1)
+        d2 = others[rows, second]
+        e1, e2 = elevations[nearest], elevations[second]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            wsel = np.where(np.isinf(d2) | (d1 + d2 == 0), e1, (e1 * d2 + e2 * d1) / (d1 + d2))
+        wsel[d1 > max_distance] = np.nan
+        result[start:stop] = wsel
+    return result
+
+
+def tiles(header, tile_size=TILE_SIZE):
+    """ Returns list of (row0, row1, col0, col1) tiles covering the grid """
+    return [(row, min(row + tile_size, header.nrows), col, min(col + tile_size, header.ncols))
+            for row in range(0, header.nrows, tile_size) for col in range(0, header.ncols, tile_size)]
+
+
+# (WSLines, DEM filename, {output: filename}, max distance) of the current worker process, set by _init_worker()
+_worker_task = None
+
+
+def _init_worker(task):
+    global _worker_task
+    _worker_task = task
+
+
+def _rasterize_tile(tile):
+    """ Interpolates and writes one tile of all outputs, returns number of inundated cells """
+    lines, dem_filename, outputs, max_distance = _worker_task
+    row0, row1, col0, col1 = tile
+    header, dem = open_grid(dem_filename)
+    xs, ys = header.cell_centers(row0, row1, col0, col1)
+    x, y = np.meshgrid(xs, ys)
+    wsel = interpolate(lines, x.ravel(), y.ravel(), max_distance).reshape(x.shape)
+
+    ground = np.asarray(dem[row0:row1, col0:col1], dtype=float)
+    depth = wsel - ground
+    with np.errstate(invalid='ignore'):
+        wet = (ground != header.nodata) & np.isfinite(ground) & (depth > 0)
+    values = {WSEL: np.where(wet, wsel, NODATA),
+              DEPTH: np.where(wet, depth, NODATA),
+              MASK: np.where(wet, 1.0, NODATA)}
+    for name, filename in outputs.items():
+        _, grid = open_grid(filename, 'r+')
+        grid[row0:row1, col0:col1] = values[name]
+        grid.flush()
+        del grid
+    return int(wet.sum())
+
+
+def output_names(out_prefix):
+    """ Returns dict of output: float grid filename """
+    return dict((name, '{}_{}.flt'.format(out_prefix, name)) for name in OUTPUTS)
+
+
+def rasterize(lines, dem_filename, out_prefix, max_distance=MAX_DISTANCE, tile_size=TILE_SIZE, processes=1):
+    """
+    Creates water surface elevation, depth, and inundation grids on the cells of dem_filename
+    :param lines: WSLines
+    :param dem_filename: ESRI float grid (.flt)
+    :param out_prefix: outputs are named <out_prefix>_wsel.flt etc.
+    :param processes: number of worker processes, 1 rasterizes in the current process
+    :return: number of inundated cells
+    """
+    header = GridHeader.read(dem_filename)
+    outputs = output_names(out_prefix)
+    for filename in outputs.values():
+        create_grid(filename, GridHeader(header.ncols, header.nrows, header.xll, header.yll, header.cellsize))
+    grid_tiles = tiles(header, tile_size)
+    gisio.message('Rasterizing {} x {} cells in {} tiles...'.format(header.ncols, header.nrows, len(grid_tiles)))
+    task = (lines, dem_filename, outputs, max_distance)
+    if processes <= 1 or len(grid_tiles) < 2:
+        _init_worker(task)
+        return sum(_rasterize_tile(tile) for tile in grid_tiles)
+
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(task,))
+    try:
+        # Tiles write disjoint parts of the outputs, the order they finish doesn't matter
+        return sum(pool.imap_unordered(_rasterize_tile, grid_tiles))
+    finally:
+        pool.close()
+        pool.join()